@@ -1,7 +1,6 @@
-from random import uniform, choice, choices
-from numpy.random import normal
 from numpy import exp, arange
 from copy import copy
+from attraction_tree import AttractionTree
 
 def default_felicity_fnc(x):
   return x
@@ -52,6 +51,7 @@ class Shepherd(Agent):
     self.explore_rate = self.init_explore_rate
     self.min_explore_rate = 0
     self.actions_avail = {}
+    self.attraction_trees = {} #Mirrors memory, for fast weighted draws and best action lookups
     self.lifetime_felicity = 0
     #For model experiments:
     if 'recency_bias' in agent_variables:
@@ -94,8 +94,34 @@ class Shepherd(Agent):
       for act in self.actions_avail[a_k]:
         self.memory[a_k].append(self.max_payoff-self.min_payoff)
         self.choice_freq[a_k].append(0)
+      self.attraction_trees[a_k] = AttractionTree(self.memory[a_k])
     self.seen_before_move = None
     self.seen = None
+    self.draw = self.model.uniform.next #U[0,1) draws from the model's Generator
+    #Picking the variants of the per period methods this agent's configuration needs:
+    self.action_plan = [(a_k, self.attraction_trees[a_k], type(a_v['grain']) == int)
+                        for a_k, a_v in self.agent_variables['action_set'].items()]
+    if self.recency_bias:
+      learn = self._learn_recency
+    else:
+      learn = self._learn_average
+    self.learners = {}
+    for a_k in self.agent_variables['action_set'].keys():
+      if self.similarity and a_k.startswith('sheep_count'):
+        self.learners[a_k] = self._learn_similar
+      else:
+        self.learners[a_k] = learn
+    self._learn_chosen = learn
+    if 'move_if_seen' in self.agent_variables['action_set']:
+      self.apply_sheep_strategy = self._apply_sheep_strategy_spatial
+      self.update_memory = self._update_memory_spatial
+    else:
+      self.apply_sheep_strategy = self._apply_sheep_strategy
+      self.update_memory = self._update_memory
+    if self.altruism > 0:
+      self.calc_felicity = self._calc_felicity_altruistic
+    else:
+      self.calc_felicity = self._calc_felicity
 
   def _period_prob_explore(self):
     '''Determines with what probability agents will explore a new strategy this turn
@@ -110,21 +136,14 @@ class Shepherd(Agent):
   def decide_period_strategy(self):
     '''Returns the agents strategy for this period.'''
     self._period_prob_explore()
-    roll = uniform(0,1)
-    for act, av in self.agent_variables['action_set'].items():
-      actions_avail = [i for i in range(len(self.memory[act]))]
+    roll = self.draw()
+    for act, tree, integer_grain in self.action_plan:
       if roll < self.explore_rate: #Explore:
-        action = choices(actions_avail, weights = [i**2 for i in self.memory[act]], k = 1)[0] #Weighted exploration
-        #action = choice(actions_avail)
-      else: #Exploit
-        max_score = max(self.memory[act])
-        max_positions = []
-        for s in range(len(self.memory[act])):
-          if self.memory[act][s] == max_score:
-            max_positions.append(s)
-        max_pos = choice(max_positions)
-        action = actions_avail[max_pos]
-      if type(av['grain']) == int:
+        action = tree.sample_weighted(self.draw()) #Weighted exploration (by squared attraction)
+      else: #Exploit (ties broken uniformly at random)
+        max_score, tie_count = tree.best()
+        action = tree.sample_max(int(self.draw()*tie_count))
+      if integer_grain:
         action = round(action)
       self.period_strategy[act] = action
 
@@ -134,16 +153,17 @@ class Shepherd(Agent):
     '''
     self.period_choices['moved'] = False
     if (self.seen_before_move and self.period_strategy['move_if_seen'] == 1) or (not self.seen_before_move and self.period_strategy['move_if_unseen'] == 1):
-      unoccupied_positions = [k for k in range(0,self.landscape_size)]
-      for a in self.model.agents.values():
-        if a.pos in unoccupied_positions:
-          unoccupied_positions.remove(a.pos)
-      self.pos = choice(unoccupied_positions)
+      #Uniform over cells no agent (including this one) occupies:
+      self.model.move_agent(self, self.model.free_cells.sample(self.draw()))
       self.period_choices['moved'] = True
 
-  def apply_sheep_strategy(self):
-    '''Takes the agents strategy for choosing grazing level and acts on it.'''
-    if 'move_if_seen' in self.model.action_names and not self.seen:
+  def _apply_sheep_strategy(self):
+    '''Takes the agents strategy for choosing grazing level and acts on it (non-spatial, so always seen).'''
+    self.period_choices['sheep_count'] = self.period_strategy['sheep_count_if_seen']
+
+  def _apply_sheep_strategy_spatial(self):
+    '''Takes the agents strategy for choosing grazing level and acts on it, depending on whether it is seen.'''
+    if not self.seen:
       self.period_choices['sheep_count'] = self.period_strategy['sheep_count_if_unseen']
     else:
       self.period_choices['sheep_count'] = self.period_strategy['sheep_count_if_seen']
@@ -152,107 +172,111 @@ class Shepherd(Agent):
     '''Calculates felicity attributed to own consumption only.'''
     self.period_selfish_felicity = self.felicity_fnc(self.period_payoff - self.min_payoff)
 
-  def calc_felicity(self, total_fel):
+  def _calc_felicity(self, total_fel):
+    '''Calculates felicity (no altruism, so own consumption only).'''
+    self.period_felicity = self.period_selfish_felicity
+    self.lifetime_felicity += self.period_felicity
+
+  def _calc_felicity_altruistic(self, total_fel):
     '''Calculates felicity, accounting for altruism'''
-    if self.altruism > 0:
-      self.period_felicity = (self.altruism * total_fel) + ((1-self.altruism) * self.period_selfish_felicity)
-    else:
-      self.period_felicity = self.period_selfish_felicity
+    self.period_felicity = (self.altruism * total_fel) + ((1-self.altruism) * self.period_selfish_felicity)
     self.lifetime_felicity += self.period_felicity
 
-  def update_memory(self):
+  def _set_attraction(self, act, pos, value):
+    '''Sets memory[act][pos], keeping the attraction tree in step.'''
+    self.memory[act][pos] = value
+    self.attraction_trees[act].update(pos, value)
+
+  def _learn_average(self, act, r):
+    '''Moves the attraction of this period's choice for action dimension act to the running average of its felicities.
+       Returns the attraction before the update.'''
+    chosen = self.period_strategy[act]
+    existing_score = self.memory[act][chosen]
+    self.choice_freq[act][chosen] += 1
+    freq = self.choice_freq[act][chosen]
+    self._set_attraction(act, chosen, ((freq-1)/freq)*existing_score + (1/freq)*r)
+    return existing_score
+
+  def _learn_recency(self, act, r):
+    '''Moves the attraction of this period's choice for action dimension act towards r, weighting r by recency_bias.
+       Returns the attraction before the update.'''
+    chosen = self.period_strategy[act]
+    existing_score = self.memory[act][chosen]
+    self.choice_freq[act][chosen] += 1
+    self._set_attraction(act, chosen, (1-self.recency_bias)*existing_score + (self.recency_bias)*r)
+    return existing_score
+
+  def _learn_similar(self, act, r):
+    '''Updates the attraction of this period's choice, then partially credits its neighbouring harvest levels.'''
+    existing_score = self._learn_chosen(act, r)
+    chosen = self.period_strategy[act]
+    for nbr in (chosen - 1, chosen + 1):
+      if 0 <= nbr < len(self.actions_avail[act]):
+        self.choice_freq[act][nbr] += self.sim_weight
+        freq_n = self.choice_freq[act][nbr]
+        self._set_attraction(act, nbr, ((freq_n - self.sim_weight)/freq_n)*existing_score + (self.sim_weight/freq_n)*r)
+    return existing_score
+
+  def _update_memory(self):
+    '''Updates action weights based on performance this round (non-spatial: harvest decision only).'''
+    self.learners['sheep_count_if_seen']('sheep_count_if_seen', self.period_felicity)
+
+  def _update_memory_spatial(self):
     '''Updates action weights based on performance this round.'''
     r = self.period_felicity
-    #if self.id == 0:
-    #if self.model.period % 100 == 0 or self.model.period <5:
-    #  print(f'Got a payoff of {r}')
-    #  print(f'Period {self.model.period} action payoffs: {self.memory}')
-    #  print(f'Period {self.model.period} action frequencies: {self.choice_freq}')
-    if 'move_if_seen' in self.model.action_names:
-      #---Updating Move Decision---
-      if not self.seen_before_move:
-        existing_score = self.memory['move_if_unseen'][self.period_strategy['move_if_unseen']]
-        self.choice_freq['move_if_unseen'][self.period_strategy['move_if_unseen']] += 1
-        freq = self.choice_freq['move_if_unseen'][self.period_strategy['move_if_unseen']]
-        if self.recency_bias:
-          self.memory['move_if_unseen'][self.period_strategy['move_if_unseen']] = (1-self.recency_bias)*existing_score + (self.recency_bias)*r
-        else:
-          self.memory['move_if_unseen'][self.period_strategy['move_if_unseen']] = ((freq-1)/freq)*existing_score + (1/freq)*r
-      else:
-        existing_score = self.memory['move_if_seen'][self.period_strategy['move_if_seen']]
-        self.choice_freq['move_if_seen'][self.period_strategy['move_if_seen']] += 1
-        freq = self.choice_freq['move_if_seen'][self.period_strategy['move_if_seen']]
-        if self.recency_bias:
-          self.memory['move_if_seen'][self.period_strategy['move_if_seen']] = (1-self.recency_bias)*existing_score + (self.recency_bias)*r
-        else:
-          self.memory['move_if_seen'][self.period_strategy['move_if_seen']] = ((freq-1)/freq)*existing_score + (1/freq)*r
-      
-      #---Updating Harvest Decision---
-      if not self.seen:
-        existing_score = self.memory['sheep_count_if_unseen'][self.period_strategy['sheep_count_if_unseen']]
-        self.choice_freq['sheep_count_if_unseen'][self.period_strategy['sheep_count_if_unseen']] += 1
-        freq = self.choice_freq['sheep_count_if_unseen'][self.period_strategy['sheep_count_if_unseen']]
-        if self.recency_bias:
-          self.memory['sheep_count_if_unseen'][self.period_strategy['sheep_count_if_unseen']] = (1-self.recency_bias)*existing_score + (self.recency_bias)*r
-        else:
-          self.memory['sheep_count_if_unseen'][self.period_strategy['sheep_count_if_unseen']] = ((freq-1)/freq)*existing_score + (1/freq)*r
-        if self.similarity:
-          act_pos = self.actions_avail['sheep_count_if_unseen'].index(self.period_strategy['sheep_count_if_unseen'])
-          if act_pos != 0:
-            act_L = self.actions_avail['sheep_count_if_unseen'][act_pos-1]
-            self.choice_freq['sheep_count_if_unseen'][act_L] += self.sim_weight
-            freq_L = self.choice_freq['sheep_count_if_unseen'][act_L]
-            self.memory['sheep_count_if_unseen'][act_L] = ((freq_L - self.sim_weight)/freq_L)*existing_score + (self.sim_weight/freq_L)*r
-          if act_pos < len(self.actions_avail['sheep_count_if_unseen']) -1:
-            act_H = self.actions_avail['sheep_count_if_unseen'][act_pos + 1]
-            self.choice_freq['sheep_count_if_unseen'][act_H] += self.sim_weight
-            freq_H = self.choice_freq['sheep_count_if_unseen'][act_H]
-            self.memory['sheep_count_if_unseen'][act_H] = ((freq_H - self.sim_weight)/freq_H)*existing_score + (self.sim_weight/freq_H)*r
-      else:
-        existing_score = self.memory['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']]
-        self.choice_freq['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']] += 1
-        freq = self.choice_freq['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']]
-        if self.recency_bias:
-          self.memory['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']] = (1-self.recency_bias)*existing_score + (self.recency_bias)*r
-        else:
-          self.memory['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']] = ((freq-1)/freq)*existing_score + (1/freq)*r
-        if self.similarity:
-          act_pos = self.actions_avail['sheep_count_if_seen'].index(self.period_strategy['sheep_count_if_seen'])
-          if act_pos != 0:
-            act_L = self.actions_avail['sheep_count_if_seen'][act_pos-1]
-            self.choice_freq['sheep_count_if_seen'][act_L] += self.sim_weight
-            freq_L = self.choice_freq['sheep_count_if_seen'][act_L]
-            self.memory['sheep_count_if_seen'][act_L] = ((freq_L - self.sim_weight)/freq_L)*existing_score + (self.sim_weight/freq_L)*r
-          if act_pos < len(self.actions_avail['sheep_count_if_seen']) -1:
-            act_H = self.actions_avail['sheep_count_if_seen'][act_pos + 1]
-            self.choice_freq['sheep_count_if_seen'][act_H] += self.sim_weight
-            freq_H = self.choice_freq['sheep_count_if_seen'][act_H]
-            self.memory['sheep_count_if_seen'][act_H] = ((freq_H - self.sim_weight)/freq_H)*existing_score + (self.sim_weight/freq_H)*r        
+    #---Updating Move Decision---
+    if not self.seen_before_move:
+      self.learners['move_if_unseen']('move_if_unseen', r)
     else:
-      #---Updating Harvest Decision in Non-Spatial model---
-      existing_score = self.memory['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']]
-      self.choice_freq['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']] += 1
-      freq = self.choice_freq['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']]
-      if self.recency_bias:
-        self.memory['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']] = (1-self.recency_bias)*existing_score + (self.recency_bias)*r
-      else:
-        self.memory['sheep_count_if_seen'][self.period_strategy['sheep_count_if_seen']] = ((freq-1)/freq)*existing_score + (1/freq)*r
-      if self.similarity:
-        act_pos = self.actions_avail['sheep_count_if_seen'].index(self.period_strategy['sheep_count_if_seen'])
-        if act_pos != 0:
-          act_L = self.actions_avail['sheep_count_if_seen'][act_pos-1]
-          self.choice_freq['sheep_count_if_seen'][act_L] += self.sim_weight
-          freq_L = self.choice_freq['sheep_count_if_seen'][act_L]
-          self.memory['sheep_count_if_seen'][act_L] = ((freq_L - self.sim_weight)/freq_L)*existing_score + (self.sim_weight/freq_L)*r
-        if act_pos < len(self.actions_avail['sheep_count_if_seen']) - 1:
-          act_H = self.actions_avail['sheep_count_if_seen'][act_pos + 1]
-          self.choice_freq['sheep_count_if_seen'][act_H] += self.sim_weight
-          freq_H = self.choice_freq['sheep_count_if_seen'][act_H]
-          self.memory['sheep_count_if_seen'][act_H] = ((freq_H - self.sim_weight)/freq_H)*existing_score + (self.sim_weight/freq_H)*r
-  
+      self.learners['move_if_seen']('move_if_seen', r)
+    #---Updating Harvest Decision---
+    if not self.seen:
+      self.learners['sheep_count_if_unseen']('sheep_count_if_unseen', r)
+    else:
+      self.learners['sheep_count_if_seen']('sheep_count_if_seen', r)
+
+  def is_locked_in(self):
+    '''True if this agent will exploit its current harvest choice forever, given it keeps getting this period's felicity.
+       Needs no exploration left and no similarity updates (which can lift a neighbouring action past the chosen one).
+       The chosen attraction only moves between its current value and the felicity, so it stays the unique
+       max as long as both are above every other attraction.'''
+    if self.explore_rate > self.min_explore_rate or self.min_explore_rate > 0 or self.similarity:
+      return False
+    act = 'sheep_count_if_seen'
+    chosen = self.period_strategy[act]
+    return min(self.memory[act][chosen], self.period_felicity) > self.attraction_trees[act].max_excluding(chosen)
+
+  def fast_forward(self, periods):
+    '''Applies periods more repeats of this period's choice and felicity in closed form (see is_locked_in).'''
+    act = 'sheep_count_if_seen'
+    chosen = self.period_strategy[act]
+    r = self.period_felicity
+    freq = self.choice_freq[act][chosen]
+    if self.recency_bias:
+      self._set_attraction(act, chosen, r + ((1-self.recency_bias)**periods)*(self.memory[act][chosen] - r))
+    else:
+      self._set_attraction(act, chosen, (freq*self.memory[act][chosen] + periods*r)/(freq + periods))
+    self.choice_freq[act][chosen] += periods
+    self.lifetime_felicity += periods*r
+
+  def learned_state(self):
+    '''Returns what this agent has learned: its attractions, choice frequencies and explore rate (copies).'''
+    return {'memory': {act: list(m) for act, m in self.memory.items()},
+            'choice_freq': {act: list(f) for act, f in self.choice_freq.items()},
+            'explore_rate': self.explore_rate}
+
+  def load_learned_state(self, memory, choice_freq, explore_rate):
+    '''Takes up another run's learned_state, keeping the attraction trees in step.'''
+    for act in self.memory.keys():
+      for pos, value in enumerate(memory[act]):
+        self._set_attraction(act, pos, value)
+      self.choice_freq[act][:] = choice_freq[act]
+    self.explore_rate = explore_rate
+
   def store_attraction_snapshot(self, period):
     '''Stores probability of taking each action at this period of time.'''
     p_explore = self._period_prob_explore()
+    self.attraction_snapshots = {period: {}} #Only the latest snapshot is kept (the model averages it right away)
     for act in self.agent_variables['action_set'].keys():
       actions_avail = [i for i in range(len(self.memory[act]))]
       #Contribute prob_explore component to prob_choose vector:
@@ -273,7 +297,6 @@ class Shepherd(Agent):
         for pos in max_positions:
             prob_choose[pos] += p_exploit/len(max_positions)
       #Save to agent
-      self.attraction_snapshots[period] = {}
       self.attraction_snapshots[period][act] = {}
       for aa_pos in range(len(actions_avail)):
         self.attraction_snapshots[period][act][actions_avail[aa_pos]] = prob_choose[aa_pos]
@@ -0,0 +1,89 @@
+from math import inf
+
+
+class AttractionTree():
+  '''
+  A segment tree over one action dimension's attractions (a Shepherd's memory[act] list).
+  Each node keeps, for the actions under it, the sum of squared attractions plus the highest
+  attraction and how many actions tie at it. That gives, in O(log A) for A actions:
+    - sample_weighted ~ a draw weighted by squared attraction (as random.choices with weights = [m**2 ...])
+    - sample_max ~ the k-th of the tied best actions (in action order)
+    - update ~ changing one attraction
+  Sums are rebuilt from the children on every update, so no rounding error builds up over a run.
+  '''
+  def __init__(self, values):
+    self.size = len(values)
+    self.cap = 1
+    while self.cap < self.size:
+      self.cap *= 2
+    self.sq_sum = [0.0]*(2*self.cap)
+    self.max = [-inf]*(2*self.cap)
+    self.max_count = [0]*(2*self.cap)
+    for pos, v in enumerate(values):
+      leaf = self.cap + pos
+      self.sq_sum[leaf] = v**2
+      self.max[leaf] = v
+      self.max_count[leaf] = 1
+    for node in range(self.cap - 1, 0, -1):
+      self._pull(node)
+
+  def _pull(self, node):
+    '''Recomputes node from its two children.'''
+    left, right = 2*node, 2*node + 1
+    self.sq_sum[node] = self.sq_sum[left] + self.sq_sum[right]
+    if self.max[left] > self.max[right]:
+      self.max[node], self.max_count[node] = self.max[left], self.max_count[left]
+    elif self.max[left] < self.max[right]:
+      self.max[node], self.max_count[node] = self.max[right], self.max_count[right]
+    else:
+      self.max[node], self.max_count[node] = self.max[left], self.max_count[left] + self.max_count[right]
+
+  def update(self, pos, value):
+    '''Sets the attraction of action pos to value.'''
+    node = self.cap + pos
+    self.sq_sum[node] = value**2
+    self.max[node] = value
+    node //= 2
+    while node:
+      self._pull(node)
+      node //= 2
+
+  def best(self):
+    '''Returns the highest attraction and how many actions tie at it.'''
+    return self.max[1], self.max_count[1]
+
+  def sample_weighted(self, u):
+    '''Maps u ~ U[0,1) to an action drawn with probability proportional to its squared attraction.
+       Like random.choices, returns the first action whose cumulative weight exceeds u * total.'''
+    target = u * self.sq_sum[1]
+    node = 1
+    while node < self.cap:
+      if target < self.sq_sum[2*node]:
+        node = 2*node
+      else:
+        target -= self.sq_sum[2*node]
+        node = 2*node + 1
+    return min(node - self.cap, self.size - 1)
+
+  def sample_max(self, k):
+    '''Returns the k-th (0 based, in action order) of the actions tied at the highest attraction.'''
+    best = self.max[1]
+    node = 1
+    while node < self.cap:
+      left = 2*node
+      if self.max[left] == best:
+        if k < self.max_count[left]:
+          node = left
+          continue
+        k -= self.max_count[left]
+      node = left + 1
+    return node - self.cap
+
+  def max_excluding(self, pos):
+    '''Returns the highest attraction among all actions other than pos.'''
+    best = -inf
+    node = self.cap + pos
+    while node > 1:
+      best = max(best, self.max[node ^ 1])
+      node //= 2
+    return best
@@ -3,9 +3,75 @@ import time
 from model import Model, run_model
 from scenarioV2A import run_run_model
 from copy import deepcopy
+from eval_cache import EvalCache
+from checkpoint import SearchCheckpoint
 
-def run_model_bundle(gv, av, vv, dto, sv, ils_sv, pv, ffa, tag = '', rrm_fnc = run_run_model, finetune=False):
-    '''This function runs 3 version of the model together (listed below).'''
+def run_model_bundle(gv, av, vv, dto, sv, ils_sv, pv, ffa, tag = '', rrm_fnc = run_run_model, finetune=False, cache_mode = None,
+                     checkpoint_every = None, resume_from = None):
+    '''This function runs 3 version of the model together (listed below).
+
+    -cache_mode ~ None, or an eval_cache.EvalCache mode ('merge' or 'reuse') to keep the V2A policy evaluations in
+                  v2A_{tag}_eval_cache.json, shared by the search, its restarts, the fine-tune and later bundles of the same tag.
+    -checkpoint_every ~ None, or how many hill climb depths between checkpoints of the V2A search (and fine-tune),
+                        kept in v2A_{tag}_checkpoint.pkl
+    -resume_from ~ path of a bundle's checkpoint to continue from: V0 and V1 aren't rerun if they had finished,
+                   and the search (or fine-tune) continues from the restart and depth it had reached.
+                   A finished bundle ('done') isn't rerun at all.
+    Returns the search's result, and the fine-tune's (None without finetune).
+    '''
+    checkpoint = SearchCheckpoint(f'v2A_{tag}_checkpoint.pkl', every = checkpoint_every) if checkpoint_every else None
+    if resume_from:
+        checkpoint = SearchCheckpoint.resume(resume_from, checkpoint)
+    stage = checkpoint.state.get('bundle', {'stage': 'no_policy'}) if checkpoint else {'stage': 'no_policy'}
+    if stage['stage'] == 'done':
+        print('Bundle already finished.')
+        return stage['result'], stage['result2']
+    if stage['stage'] == 'no_policy':
+        _run_no_policy(gv, av, vv, dto, ffa, tag)
+        if checkpoint:
+            checkpoint.state['bundle'] = stage = {'stage': 'search'}
+            checkpoint.save()
+
+    #Running V2A - Agents face policy from social planner:
+    #Step 1. Run general search
+    starttime = time.time()
+    cache = EvalCache(f'v2A_{tag}_eval_cache.json', mode = cache_mode) if cache_mode else None
+    if resume_from and stage['stage'] != 'no_policy' and 'ils' not in checkpoint.state:
+        checkpoint.restore(cache) #Stopped between stages
+    if stage['stage'] == 'search':
+        result = Iterated_Local_Search(param_vars=pv, hc_search_vars = sv, pop_size = sv['cores']-1, hc_depth = sv['hc_depth'],
+                                        fitness_fnc = rrm_fnc, ils_depth = ils_sv['ils_depth'], ils_search_vars = ils_sv,
+                                        fitness_fnc_args = ffa, verbose = False, output_to_file = True, tag = f'v2A_{tag}',
+                                        cache = cache, checkpoint = checkpoint)
+        print(f'Policy run done.\n{result}')
+        print(f'Runtime: {time.time() - starttime}\n\n')
+        if checkpoint:
+            checkpoint.state = {'bundle': {'stage': 'finetune', 'result': result}} #The fine-tune starts its own search
+            checkpoint.save(cache)
+    else:
+        result = stage['result']
+
+    #Step2. Run higher resolution close around results
+    result2 = None
+    if finetune:
+        starttime = time.time()
+        sv_v2b = deepcopy(sv)
+        sv_v2b['explore_range'] *= .1
+        ffa_v2b = deepcopy(ffa)
+        ffa_v2b['trials_per_policy'] *= 3
+        result2 = Iterated_Local_Search(param_vars=pv, hc_search_vars = sv_v2b, pop_size = sv_v2b['cores']-1, hc_depth = sv['hc_depth'],
+                                        fitness_fnc = rrm_fnc, ils_depth = 1, ils_search_vars = ils_sv,
+                                        fitness_fnc_args = ffa_v2b, verbose = False, output_to_file = True, tag = f'ft_v2A_{tag}',
+                                        starting_point = result, cache = cache, checkpoint = checkpoint)
+        print(f'Policy fine-tune done.\n{result2}')
+        print(f'Runtime: {time.time() - starttime}\n\n')
+    if checkpoint:
+        checkpoint.state = {'bundle': {'stage': 'done', 'result': result, 'result2': result2}}
+        checkpoint.save(cache)
+    return result, result2
+
+def _run_no_policy(gv, av, vv, dto, ffa, tag):
+    '''Runs V0 and V1 (agents facing no policy, altruistic then selfish).'''
     #---Running V0 - Agents face no policy (altruistic)---:
     starttime = time.time()
     av_v0 = deepcopy(av)
@@ -31,26 +97,3 @@ def run_model_bundle(gv, av, vv, dto, sv, ils_sv, pv, ffa, tag = '', rrm_fnc = r
         results = run_model(model = scenario1, steps = ffa['steps'])
     print(f'Selfish no policy done')
     print(f'Runtime: {time.time() - starttime}\n\n')
-
-    #Running V2A - Agents face policy from social planner:
-    #Step 1. Run general search
-    starttime = time.time()
-    result = Iterated_Local_Search(param_vars=pv, hc_search_vars = sv, pop_size = sv['cores']-1, hc_depth = sv['hc_depth'],
-                                    fitness_fnc = rrm_fnc, ils_depth = ils_sv['ils_depth'], ils_search_vars = ils_sv,
-                                    fitness_fnc_args = ffa, verbose = False, output_to_file = True, tag = f'v2A_{tag}')
-    print(f'Policy run done.\n{result}')
-    print(f'Runtime: {time.time() - starttime}\n\n')
-
-    #Step2. Run higher resolution close around results
-    if finetune:
-        starttime = time.time()
-        sv_v2b = deepcopy(sv)
-        sv_v2b['explore_range'] *= .1
-        ffa_v2b = deepcopy(ffa)
-        ffa_v2b['trials_per_policy'] *= 3
-        result2 = Iterated_Local_Search(param_vars=pv, hc_search_vars = sv_v2b, pop_size = sv_v2b['cores']-1, hc_depth = sv['hc_depth'],
-                                        fitness_fnc = rrm_fnc, ils_depth = 1, ils_search_vars = ils_sv,
-                                        fitness_fnc_args = ffa_v2b, verbose = False, output_to_file = True, tag = f'ft_v2A_{tag}',
-                                        starting_point = result)
-        print(f'Policy fine-tune done.\n{result2}')
-        print(f'Runtime: {time.time() - starttime}\n\n')
\ No newline at end of file
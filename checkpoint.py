@@ -0,0 +1,81 @@
+'''
+Checkpoints of a running policy search (SA_hillclimb, Iterated_Local_Search, run_model_bundle), so a crashed
+or rebooted search can continue where it stopped instead of starting over.
+
+A SearchCheckpoint holds the search's state in levels ('hc' ~ the hill climb in progress: its depth, memory,
+incumbent and logs; 'ils' ~ the restart in progress, home_base and best_ever; 'bundle' ~ which stage of a bundle
+is running), and save() writes it with the state the levels share: the random module's and numpy's global
+random states (which roll candidates and ILS moves) and the evaluation cache's and surrogate's contents.
+The file is written via a temporary file, so a crash never leaves a half written checkpoint.
+Resuming rolls the same candidates from the checkpointed depth on; with seeded simulations (eg. common random
+numbers) their fitness is the same as well.
+'''
+import os
+import pickle
+import random
+import numpy as np
+
+
+def rng_state():
+    '''The global random states the search draws from.'''
+    return {'random': random.getstate(), 'numpy': np.random.get_state()}
+
+
+def set_rng_state(state):
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+
+
+def truncate_log(path, size):
+    '''Cuts a log file back to size bytes, dropping rows written after a checkpoint.'''
+    if os.path.exists(path):
+        with open(path, 'r+') as f:
+            f.truncate(size)
+
+
+def log_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class SearchCheckpoint():
+    '''
+    A search's checkpoint file.
+    -path ~ where it's written (eg. f'{tag}_checkpoint.pkl')
+    -every ~ how many hill climb depths between checkpoints (ILS also checkpoints after every restart)
+    '''
+    def __init__(self, path, every = 1):
+        self.path = path
+        self.every = every
+        self.state = {}
+
+    @classmethod
+    def resume(cls, path, checkpoint = None):
+        '''Loads the checkpoint at path (into checkpoint, if given, keeping its every).'''
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if checkpoint is None:
+            checkpoint = cls(path, saved['every'])
+        checkpoint.state = saved['state']
+        return checkpoint
+
+    def due(self, depth, last_depth):
+        '''Whether a hill climb checkpoints after depth.'''
+        return (depth + 1) % self.every == 0 or depth == last_depth
+
+    def save(self, cache = None, surrogate = None):
+        '''Writes the levels' state with the shared random, cache and surrogate state.'''
+        self.state['rng'] = rng_state()
+        self.state['cache'] = cache.get_state() if cache else None
+        self.state['surrogate'] = surrogate.get_state() if surrogate else None
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'every': self.every, 'state': self.state}, f)
+        os.replace(tmp, self.path)
+
+    def restore(self, cache = None, surrogate = None):
+        '''Sets the shared random, cache and surrogate state back to the checkpoint's.'''
+        set_rng_state(self.state['rng'])
+        if cache and self.state.get('cache'):
+            cache.set_state(self.state['cache'])
+        if surrogate and self.state.get('surrogate'):
+            surrogate.set_state(self.state['surrogate'])
@@ -0,0 +1,327 @@
+import os
+from glob import glob
+import numpy as np
+
+#Optional dependency, only needed for format = 'parquet':
+try:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+except ImportError:
+  pa = None
+  pq = None
+
+FORMATS = ('csv', 'npy', 'parquet', 'trajectory')
+
+#Column layouts of Model/VectorModel datafiles, as (name, dtype):
+SPATIAL_COLUMNS = [('run', int), ('period', int), ('agent_count', int), ('landscape_size', int), ('pop_density', float),
+                   ('agent_id', int), ('position', int), ('move_if_seen', int), ('best_move_if_seen', int),
+                   ('move_if_unseen', int), ('best_move_if_unseen', int), ('sheep_count_if_seen', int),
+                   ('best_sheep_count_if_seen', int), ('sheep_count_if_unseen', int), ('best_sheep_count_if_unseen', int),
+                   ('avg_social_welfare', float), ('payoff', float), ('avg_period_felicity', float), ('monitored', bool),
+                   ('monitoring_rate', float)]
+NON_SPATIAL_COLUMNS = [('run', int), ('period', int), ('agent_count', int), ('landscape_size', int), ('agent_id', int),
+                       ('sheep_count_if_seen', int), ('best_sheep_count_if_seen', int), ('payoff', float),
+                       ('avg_period_felicity', float), ('avg_social_welfare', float)]
+#Columns with one value per (run, period), shared by every agent's row:
+PERIOD_COLUMNS = ['agent_count', 'landscape_size', 'pop_density', 'avg_social_welfare', 'avg_period_felicity', 'monitoring_rate']
+
+
+def datafile_path(tag, fmt = 'csv'):
+  '''Where a model with this tag writes its data in the given format.'''
+  if fmt == 'csv':
+    return f'{tag}_data.txt'
+  elif fmt == 'npy':
+    return f'{tag}_data.npy'
+  elif fmt == 'parquet':
+    return f'{tag}_data.parquet' #A directory with one part per run
+  elif fmt == 'trajectory':
+    return f'{tag}_data.traj'
+  raise ValueError(f'Unknown datafile format {fmt}, expected one of {FORMATS}')
+
+
+def open_datafile(tag, columns, fmt = 'csv', buffer_rows = 65536, append = False, run = 0):
+  '''Opens the writer for fmt: a TrajectoryLog for 'trajectory', a BufferedDatafile otherwise.'''
+  if fmt == 'trajectory':
+    return TrajectoryLog(tag, columns, buffer_rows = buffer_rows, append = append)
+  return BufferedDatafile(tag, columns, fmt = fmt, buffer_rows = buffer_rows, append = append, run = run)
+
+
+class BufferedDatafile():
+  '''
+  Rows for a model's datafile, kept in preallocated column arrays and written buffer_rows at a time
+  through one handle held open for the model's life.
+
+  Formats:
+  - 'csv' ~ the comma separated text layout {tag}_data.txt has always had (header written when not appending).
+  - 'npy' ~ {tag}_data.npy, a sequence of structured array chunks (one np.save per flush), see read_datafile.
+  - 'parquet' ~ {tag}_data.parquet/run{run}.parquet, one part per run (needs pyarrow).
+  append ~ add to the data earlier runs left rather than starting the file over.
+  '''
+  def __init__(self, tag, columns, fmt = 'csv', buffer_rows = 65536, append = False, run = 0):
+    self.path = datafile_path(tag, fmt)
+    self.fmt = fmt
+    self.names = [name for name, dtype in columns]
+    self.dtypes = dict(columns)
+    self.capacity = buffer_rows
+    self.filled = 0
+    self.columns = {name: np.empty(self.capacity, dtype = dtype) for name, dtype in columns}
+    if fmt == 'csv':
+      self.handle = open(self.path, 'a' if append else 'w')
+      if not append:
+        self.handle.write(','.join(self.names) + '\n')
+    elif fmt == 'npy':
+      self.handle = open(self.path, 'ab' if append else 'wb')
+    else:
+      if pq is None:
+        raise ImportError("format 'parquet' needs pyarrow installed")
+      os.makedirs(self.path, exist_ok = True)
+      if not append:
+        for old_part in glob(os.path.join(self.path, '*.parquet')):
+          os.remove(old_part)
+      schema = pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype))) for name, dtype in columns])
+      self.handle = pq.ParquetWriter(os.path.join(self.path, f'run{run}.parquet'), schema)
+
+  def add_rows(self, count, **values):
+    '''Adds count rows. Each column is given either one value per row or a single value shared by all of them.'''
+    if self.filled + count > self.capacity:
+      self.flush()
+      if count > self.capacity:
+        self.capacity = count
+        self.columns = {name: np.empty(count, dtype = self.dtypes[name]) for name in self.names}
+    end = self.filled + count
+    for name in self.names:
+      self.columns[name][self.filled:end] = values[name]
+    self.filled = end
+
+  def flush(self):
+    '''Writes out the buffered rows.'''
+    if self.filled == 0:
+      return
+    chunk = {name: self.columns[name][:self.filled] for name in self.names}
+    if self.fmt == 'csv':
+      rows = zip(*[chunk[name].tolist() for name in self.names])
+      self.handle.write(''.join([','.join(map(str, row)) + '\n' for row in rows]))
+    elif self.fmt == 'npy':
+      table = np.empty(self.filled, dtype = [(name, self.dtypes[name]) for name in self.names])
+      for name in self.names:
+        table[name] = chunk[name]
+      np.save(self.handle, table)
+    else:
+      self.handle.write_table(pa.table(chunk))
+    self.filled = 0
+
+  def sync(self):
+    '''Writes out the buffered rows and pushes them to the file, so they survive a crash (eg. at a checkpoint).
+       A parquet writer only gets a file's footer on close, so there this is the same as flush.'''
+    self.flush()
+    if self.fmt != 'parquet':
+      self.handle.flush()
+
+  def close(self):
+    '''Flushes what is left and closes the handle.'''
+    self.flush()
+    self.handle.close()
+
+
+class TrajectoryLog():
+  '''
+  The 'trajectory' format: the per period datafile with each agent's columns (strategies, best actions,
+  payoff, position, monitored) stored as run-length segments ~ (run, agent_id, column, start, stop, value)
+  meaning the column held value from period start to period stop. A segment is only written once the value
+  changes (or the log closes), so a converged agent costs nothing per period. The PERIOD_COLUMNS are kept
+  once per (run, period) in a plain array. Both go to {tag}_data.traj as np.save chunks, after a header
+  record naming the columns; read_trajectory expands it back to the full table.
+  Takes rows exactly as BufferedDatafile does.
+  '''
+  SEGMENT_DTYPE = [('run', '<i4'), ('agent_id', '<i4'), ('column', '<i2'), ('start', '<i4'), ('stop', '<i4'), ('value', '<f8')]
+
+  def __init__(self, tag, columns, buffer_rows = 65536, append = False):
+    self.path = datafile_path(tag, 'trajectory')
+    self.names = [name for name, dtype in columns]
+    self.period_names = [name for name in self.names if name in PERIOD_COLUMNS]
+    self.agent_names = [name for name in self.names if name not in PERIOD_COLUMNS + ['run', 'period', 'agent_id']]
+    self.agent_columns = np.array([self.names.index(name) for name in self.agent_names])
+    self.capacity = buffer_rows
+    self.handle = open(self.path, 'ab' if append else 'wb')
+    if not append:
+      np.save(self.handle, np.array([(name, np.dtype(dtype).str) for name, dtype in columns],
+                                    dtype = [('name', 'U64'), ('dtype', 'U8')]))
+    #Per (run, agent_id) slot: its key, last period seen, and the open segment (start, value) of each agent column:
+    self.slots = {}
+    self.slot_run = np.empty(0, dtype = int)
+    self.slot_agent = np.empty(0, dtype = int)
+    self.last_period = np.empty(0, dtype = int)
+    self.start = np.empty((len(self.agent_names), 0), dtype = int) #-1 ~ no open segment
+    self.value = np.empty((len(self.agent_names), 0))
+    self._layout = (None, None, None, None)
+    self.segments = []
+    self.segment_rows = 0
+    self.period_dtype = [('run', int), ('period', int)] + [(name, float) for name in self.period_names]
+    self.period_columns = {name: np.empty(self.capacity, dtype = dtype) for name, dtype in self.period_dtype}
+    self.filled = 0
+
+  def _slots_for(self, run, agent):
+    '''Returns the slot of each row's (run, agent_id), adding slots for new ones, and the first row of each run.'''
+    last_run, last_agent, last_slots, last_firsts = self._layout
+    if last_run is not None and np.array_equal(run, last_run) and np.array_equal(agent, last_agent):
+      return last_slots, last_firsts
+    slots = []
+    for key in zip(run.tolist(), agent.tolist()):
+      if key not in self.slots:
+        self.slots[key] = len(self.slots)
+      slots.append(self.slots[key])
+    slots = np.array(slots)
+    grow = len(self.slots) - len(self.slot_run)
+    if grow > 0:
+      self.slot_run = np.concatenate([self.slot_run, np.zeros(grow, dtype = int)])
+      self.slot_agent = np.concatenate([self.slot_agent, np.zeros(grow, dtype = int)])
+      self.last_period = np.concatenate([self.last_period, np.full(grow, -1)])
+      self.start = np.concatenate([self.start, np.full((len(self.agent_names), grow), -1)], axis = 1)
+      self.value = np.concatenate([self.value, np.zeros((len(self.agent_names), grow))], axis = 1)
+      self.slot_run[slots] = run
+      self.slot_agent[slots] = agent
+    firsts = np.flatnonzero(np.r_[True, run[1:] != run[:-1]])
+    self._layout = (run.copy(), agent.copy(), slots, firsts)
+    return slots, firsts
+
+  def _emit(self, cols, slots):
+    '''Queues the open segments of agent columns cols (positions in agent_names) for slots, pairwise.'''
+    has_open = self.start[cols, slots] >= 0
+    cols, slots = cols[has_open], slots[has_open]
+    if len(slots) == 0:
+      return
+    segment = np.empty(len(slots), dtype = self.SEGMENT_DTYPE)
+    segment['run'] = self.slot_run[slots]
+    segment['agent_id'] = self.slot_agent[slots]
+    segment['column'] = self.agent_columns[cols]
+    segment['start'] = self.start[cols, slots]
+    segment['stop'] = self.last_period[slots]
+    segment['value'] = self.value[cols, slots]
+    self.segments.append(segment)
+    self.segment_rows += len(slots)
+
+  def add_rows(self, count, **values):
+    '''Adds count rows (see BufferedDatafile.add_rows).'''
+    run = _per_row(values['run'], count)
+    agent = _per_row(values['agent_id'], count)
+    period = _per_row(values['period'], count)
+    slots, firsts = self._slots_for(run, agent)
+    #Per period columns, from the first row of each run:
+    if self.filled + len(firsts) > self.capacity:
+      self.flush()
+    end = self.filled + len(firsts)
+    self.period_columns['run'][self.filled:end] = run[firsts]
+    self.period_columns['period'][self.filled:end] = period[firsts]
+    for name in self.period_names:
+      value = values[name]
+      self.period_columns[name][self.filled:end] = value if np.ndim(value) == 0 else np.asarray(value)[firsts]
+    self.filled = end
+    #Agent columns, closing the segments whose value changed:
+    new_values = np.empty((len(self.agent_names), count))
+    for pos, name in enumerate(self.agent_names):
+      new_values[pos] = values[name]
+    changed = (new_values != self.value[:, slots]) | (self.start[:, slots] < 0)
+    if changed.any():
+      cols, rows = np.nonzero(changed)
+      self._emit(cols, slots[rows])
+      self.start[cols, slots[rows]] = period[rows]
+      self.value[cols, slots[rows]] = new_values[cols, rows]
+    self.last_period[slots] = period
+    if self.segment_rows >= self.capacity:
+      self.flush()
+
+  def flush(self):
+    '''Writes out the closed segments and per period rows gathered so far.'''
+    if self.filled == 0 and not self.segments:
+      return
+    np.save(self.handle, np.concatenate(self.segments) if self.segments else np.empty(0, dtype = self.SEGMENT_DTYPE))
+    period_table = np.empty(self.filled, dtype = self.period_dtype)
+    for name, dtype in self.period_dtype:
+      period_table[name] = self.period_columns[name][:self.filled]
+    np.save(self.handle, period_table)
+    self.segments, self.segment_rows, self.filled = [], 0, 0
+
+  def close(self):
+    '''Closes every open segment, flushes and closes the handle.'''
+    cols, slots = np.nonzero(self.start >= 0)
+    self._emit(cols, slots)
+    self.start[:] = -1
+    self.flush()
+    self.handle.close()
+
+
+def _per_row(value, count):
+  '''Returns value as an array with one entry per row (repeating it if it is a single value).'''
+  if np.ndim(value) == 0:
+    return np.full(count, value)
+  return np.asarray(value)
+
+
+def read_trajectory(path, columns = None, runs = None):
+  '''Expands a 'trajectory' datafile (see TrajectoryLog) into a pandas DataFrame with the same rows and
+     columns as the csv layout, ordered by run, then period, then agent_id. Only the columns (default all) and runs (default all) asked for are expanded,
+     so plotting one variable never builds the full table.'''
+  import pandas as pd
+  with open(path, 'rb') as file:
+    header = np.load(file)
+    segments, periods = [], []
+    while file.peek(1):
+      segments.append(np.load(file))
+      periods.append(np.load(file))
+  names = header['name'].tolist()
+  dtypes = dict(zip(names, header['dtype'].tolist()))
+  segments = np.concatenate([s for s in segments if len(s)])
+  periods = np.concatenate([p for p in periods if len(p)])
+  if columns is None:
+    columns = names
+  if runs is None:
+    runs = np.unique(periods['run']).tolist()
+  frames = []
+  for run in runs:
+    run_periods = periods[periods['run'] == run]
+    run_segments = segments[segments['run'] == run]
+    period_list = run_periods['period']
+    agent_ids = np.unique(run_segments['agent_id'])
+    n = len(agent_ids)
+    frame = {}
+    for name in columns:
+      if name == 'run':
+        frame[name] = np.full(len(period_list)*n, run)
+      elif name == 'period':
+        frame[name] = np.repeat(period_list, n)
+      elif name == 'agent_id':
+        frame[name] = np.tile(agent_ids, len(period_list))
+      elif name in PERIOD_COLUMNS:
+        frame[name] = np.repeat(run_periods[name], n)
+      else:
+        expanded = np.empty((len(period_list), n))
+        col_segments = run_segments[run_segments['column'] == names.index(name)]
+        lo = np.searchsorted(period_list, col_segments['start'])
+        hi = np.searchsorted(period_list, col_segments['stop'], side = 'right')
+        agent_pos = np.searchsorted(agent_ids, col_segments['agent_id'])
+        for l, h, a, v in zip(lo.tolist(), hi.tolist(), agent_pos.tolist(), col_segments['value'].tolist()):
+          expanded[l:h, a] = v
+        frame[name] = expanded.reshape(-1)
+      frame[name] = frame[name].astype(dtypes[name])
+    frames.append(pd.DataFrame(frame))
+  return pd.concat(frames, ignore_index = True)
+
+
+def read_datafile(tag, fmt = 'csv', columns = None):
+  '''Reads a datafile written by BufferedDatafile or TrajectoryLog back into a pandas DataFrame.'''
+  import pandas as pd
+  path = datafile_path(tag, fmt)
+  if fmt == 'trajectory':
+    return read_trajectory(path, columns = columns)
+  if fmt == 'csv':
+    return pd.read_csv(path, sep=',', usecols = columns)
+  elif fmt == 'npy':
+    chunks = []
+    with open(path, 'rb') as file:
+      while file.peek(1):
+        chunks.append(np.load(file))
+    df = pd.DataFrame(np.concatenate(chunks))
+    return df if columns is None else df[columns]
+  if pq is None:
+    raise ImportError("format 'parquet' needs pyarrow installed")
+  return pq.read_table(path, columns = columns).to_pandas()
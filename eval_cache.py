@@ -0,0 +1,135 @@
+'''
+A persistent cache of policy evaluations (run_run_model outputs), so a search doesn't throw away
+what it already knows about a policy it has simulated before.
+
+Entries are keyed by the canonical policy, a hash of the model config it was simulated under
+(CONFIG_KEYS of the fitness_fnc_args) and the seed stream, and hold the running mean of csw and
+(per trial) iw over every trial run so far, with the trial count.
+A repeat request for a policy either
+    -'merge' ~ runs trials_per_policy new trials and merges them into the running mean (the default), or
+    -'reuse' ~ runs only the trials the entry is short of (none once it has trials_per_policy).
+New trials continue the entry's replicate numbering (run_run_model's first_trial), so with a fixed
+seed no replicate is ever counted twice.
+'''
+from hashlib import sha1
+from copy import deepcopy
+import json
+import os
+
+CONFIG_KEYS = ('agent_count', 'game_variables', 'agent_variables', 'steps', 'social_planner_vars', 'engine', 'backend')
+MODES = ('merge', 'reuse')
+
+
+def _canonical(obj):
+    '''json.dumps default for what json can't write (eg. an agent's utility_fnc).'''
+    if callable(obj):
+        return f'{getattr(obj, "__module__", "")}.{getattr(obj, "__qualname__", repr(obj))}'
+    return repr(obj)
+
+
+def config_hash(fitness_fnc_args):
+    '''Hash of the parts of fitness_fnc_args that change what a policy's trials return.'''
+    config = {k: fitness_fnc_args.get(k) for k in CONFIG_KEYS}
+    return sha1(json.dumps(config, sort_keys = True, default = _canonical).encode()).hexdigest()[:16]
+
+
+def policy_key(policy):
+    '''Canonical string for a policy (eg. {'fine_vector': [...]}), with numbers written as floats.'''
+    canon = {name: [float(v) for v in val] if isinstance(val, (list, tuple)) else float(val)
+             for name, val in policy.items()}
+    return json.dumps(canon, sort_keys = True)
+
+
+class EvalCache():
+    '''
+    Evaluations of policies, saved to path (a json file) if given and loaded from it if it exists.
+    A search asks request() what still needs simulating for a policy, runs that with the returned
+    overrides of its fitness_fnc_args, and hands the output to merge(), which returns the combined estimate.
+    '''
+    def __init__(self, path = None, mode = 'merge'):
+        if mode not in MODES:
+            raise ValueError(f"EvalCache mode must be one of {MODES}, got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.pending = {} #Trials requested but not merged yet, by key
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)['entries']
+
+    def key(self, policy, fitness_fnc_args):
+        seed = fitness_fnc_args.get('seed')
+        return f'{config_hash(fitness_fnc_args)}|{_canonical(seed) if seed is not None else "fresh"}|{policy_key(policy)}'
+
+    def request(self, policy, fitness_fnc_args):
+        '''Returns the policy's key and the fitness_fnc_args overrides for the trials still to run
+           ({'first_trial', 'trials_per_policy'}), or None if the cached estimate will do.'''
+        key = self.key(policy, fitness_fnc_args)
+        wanted = fitness_fnc_args['trials_per_policy']
+        have = self.entries[key]['count'] if key in self.entries else 0
+        reserved = have + self.pending.get(key, 0)
+        to_run = wanted if self.mode == 'merge' else max(0, wanted - reserved)
+        if to_run == 0:
+            self.hits += 1
+            return key, None
+        self.misses += 1
+        self.pending[key] = self.pending.get(key, 0) + to_run
+        return key, {'first_trial': reserved, 'trials_per_policy': to_run}
+
+    def merge(self, key, result, overrides, trials_per_policy):
+        '''Folds result (a run_run_model output for overrides['trials_per_policy'] trials, or None if
+           nothing was run) into key's entry. Returns the entry as a run_run_model output for trials_per_policy trials.'''
+        if result is not None:
+            n = overrides['trials_per_policy']
+            self.pending[key] -= n
+            if not self.pending[key]:
+                del self.pending[key]
+            entry = self.entries.setdefault(key, {'count': 0, 'csw': 0.0, 'iw': None, 'last_act': []})
+            total = entry['count'] + n
+            entry['csw'] += (result['csw'] - entry['csw'])*(n/total)
+            if 'iw' in result:
+                iw = [v/n for v in result['iw']] #run_run_model's iw is summed over trials
+                if entry['iw'] is None:
+                    entry['iw'] = iw
+                else:
+                    entry['iw'] = [m + (v - m)*(n/total) for m, v in zip(entry['iw'], iw)]
+            if 'last_act' in result:
+                entry['last_act'] = (entry['last_act'] + result['last_act'])[-trials_per_policy:]
+            entry['count'] = total
+        return self.lookup(key, trials_per_policy)
+
+    def lookup(self, key, trials_per_policy):
+        '''Returns key's entry as a run_run_model output for trials_per_policy trials.'''
+        entry = self.entries[key]
+        output = {'csw': entry['csw'], 'trials': entry['count']}
+        if entry['iw'] is not None:
+            output['iw'] = [m*trials_per_policy for m in entry['iw']]
+        if entry['last_act']:
+            output['last_act'] = entry['last_act']
+        return output
+
+    def retain(self, keys):
+        '''Drops every entry but those of keys (eg. the policies still in play).'''
+        keys = set(keys)
+        self.entries = {k: v for k, v in self.entries.items() if k in keys}
+
+    def get_state(self):
+        '''The entries and hit counts (for search checkpoints, taken between depths when nothing is pending).'''
+        return {'entries': deepcopy(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def set_state(self, state):
+        self.entries = deepcopy(state['entries'])
+        self.hits = state['hits']
+        self.misses = state['misses']
+        self.pending = {}
+
+    def save(self):
+        '''Writes the cache to path (via a temporary file, so a crash never leaves it half written).'''
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'entries': self.entries}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,185 @@
+'''
+How a policy search scores its candidates. An Evaluator holds the fitness function and the way its evaluations
+are run, so SA_hillclimb and Iterated_Local_Search take one object instead of a keyword argument per mode.
+
+Modes (picked from what the Evaluator is given):
+-'pool' (fitness_fnc) ~ one fitness_fnc job per candidate on the shared worker pool (execution.get_pool)
+-'batch' (batch_fitness_fnc, eg. scenarioV2A.run_run_model_batch) ~ the whole population in one vectorized call
+    in this process
+-'flat' (trial_jobs_fnc, eg. scenarioV2A.run_run_model_jobs) ~ each candidate split into per trial jobs, and all of
+    them run as one flat queue on a pool sized to the hardware
+-'race' (trial_jobs_fnc and race_vars, see racing.py) ~ as 'flat', but trials only go to candidates still in the running
+An EvalCache is used in 'pool' and 'flat' modes (racing and batches don't use one).
+'''
+from concurrent.futures import wait
+from copy import copy
+import os
+from execution import get_pool, run_flat
+from racing import race
+
+
+def _evaluate_policy(policy, fitness_fnc_args, fitness_fnc, overrides = None):
+    '''Runs fitness_fnc on one policy in a pool worker (fitness_fnc and fitness_fnc_args come from the worker's config).
+       overrides (eg. from an EvalCache request) replace some of fitness_fnc_args for this call.'''
+    if overrides:
+        fitness_fnc_args = dict(fitness_fnc_args or {}, **overrides)
+    if fitness_fnc_args:
+        return fitness_fnc(**policy, **fitness_fnc_args)
+    return fitness_fnc(**policy)
+
+
+class Evaluator():
+    '''
+    Scores lists of candidate policies, returning one fitness_fnc style output ({'csw', ...}) per candidate, in order.
+    -fitness_fnc, fitness_fnc_args ~ the fitness function and its arguments besides the policy
+    -cores ~ workers of the shared pool in 'pool' mode
+    -batch_fitness_fnc, trial_jobs_fnc, race_vars ~ pick the mode (see above)
+    -cache (an eval_cache.EvalCache) ~ reuses or merges into earlier evaluations of the same policy
+        (fitness_fnc or trial_jobs_fnc must then take first_trial, as run_run_model does)
+    '''
+    def __init__(self, fitness_fnc = None, fitness_fnc_args = None, cores = 1, batch_fitness_fnc = None,
+                 trial_jobs_fnc = None, cache = None, race_vars = None):
+        self.fitness_fnc = fitness_fnc
+        self.fitness_fnc_args = fitness_fnc_args if fitness_fnc_args is not None else {}
+        self.cores = cores
+        self.batch_fitness_fnc = batch_fitness_fnc
+        self.trial_jobs_fnc = trial_jobs_fnc
+        self.race_vars = race_vars
+        if batch_fitness_fnc:
+            self.mode = 'batch'
+        elif trial_jobs_fnc and race_vars is not None:
+            self.mode = 'race'
+        elif trial_jobs_fnc:
+            self.mode = 'flat'
+        else:
+            self.mode = 'pool'
+        self.cache = cache if self.mode in ('pool', 'flat') else None
+
+    @property
+    def return_last_act(self):
+        return self.fitness_fnc_args.get('return_last_act', False)
+
+    def without_cache(self):
+        '''The same evaluator, but not using the cache (eg. when every depth's seeds are new).'''
+        uncached = copy(self)
+        uncached.cache = None
+        return uncached
+
+    def check_warm(self):
+        '''Warm starts need each candidate's own run (its learned states), so not batches or races.'''
+        if self.mode in ('batch', 'race'):
+            raise ValueError('warm_vars works with fitness_fnc or trial_jobs_fnc, not batch_fitness_fnc or racing')
+
+    def evaluate(self, candidates, extra = None):
+        '''Scores candidates with fitness_fnc_args overridden by extra (eg. a common random numbers seed, or warm
+           start states; batches and races only take its seed).'''
+        extra = extra or {}
+        if self.mode in ('batch', 'race'):
+            args = dict(self.fitness_fnc_args, seed = extra['seed']) if 'seed' in extra else self.fitness_fnc_args
+            if self.mode == 'batch':
+                return self._batch(candidates, args)
+            return race(candidates, self.trial_jobs_fnc, args, self.race_vars)
+        requests = self._cache_requests(candidates, extra)
+        if self.mode == 'flat':
+            return self._flat(candidates, requests)
+        outputs = self._pool(candidates, [overrides for key, overrides in requests])
+        return [self._cache_merge(request, output) for output, request in zip(outputs, requests)]
+
+    def screen(self, candidates, low_args):
+        '''Scores candidates at a screening fidelity (low_args, see fidelity.screening_args) in the same mode,
+           without the cache. Returns each candidate's csw.'''
+        if self.mode == 'batch':
+            return [output['csw'] for output in self._batch(candidates, low_args)]
+        if self.mode in ('flat', 'race'):
+            jobs = [self.trial_jobs_fnc(**c, **low_args) for c in candidates]
+            scores = [None]*len(candidates)
+            for c, score in run_flat(get_pool(os.cpu_count()), [j for j, r in jobs], [r for j, r in jobs]):
+                scores[c] = score['csw']
+            return scores
+        overrides = {k: low_args[k] for k in ('steps', 'trials_per_policy', 'agent_variables', 'seed') if k in low_args}
+        return [output['csw'] for output in self._pool(candidates, [overrides]*len(candidates))]
+
+    def teach(self, surrogate, scored, depth_seed = None):
+        '''Feeds surrogate [candidate, output] pairs. Only evaluations on new random draws (fresh entropy, or a depth's
+           common random numbers seed) are new observations; cached running means and re-runs of the same seeded
+           trials update what it has.'''
+        fresh = not self.cache and (depth_seed is not None or self.fitness_fnc_args.get('seed') is None)
+        full_trials = self.fitness_fnc_args.get('trials_per_policy')
+        for p in scored:
+            weight = p[1]['trials']/full_trials if 'trials' in p[1] and full_trials else 1 #Raced/cached trial counts
+            if fresh:
+                surrogate.add(p[0], p[1]['csw'], weight)
+            else:
+                surrogate.update(p[0], p[1]['csw'], weight)
+
+    def save(self):
+        '''Saves the cache (if any).'''
+        if self.cache:
+            self.cache.save()
+
+    def _batch(self, candidates, args):
+        '''Scores candidates with one call to batch_fitness_fnc, each parameter stacked across them
+           (eg. fine_vector becomes a candidates x size matrix).'''
+        stacked = {name: [c[name] for c in candidates] for name in candidates[0].keys()}
+        if args:
+            return self.batch_fitness_fnc(**stacked, **args)
+        return self.batch_fitness_fnc(**stacked)
+
+    def _cache_requests(self, candidates, extra):
+        '''Returns each candidate's (key, fitness_fnc_args overrides) from the cache, with overrides None for
+           candidates the cache already has an estimate for. Without a cache every candidate is run with extra.'''
+        if not self.cache:
+            return [(None, dict(extra)) for c in candidates]
+        return [self.cache.request(c, self.fitness_fnc_args) for c in candidates]
+
+    def _cache_merge(self, request, output):
+        '''Folds a candidate's output into the cache, returning the combined estimate.'''
+        if not self.cache:
+            return output
+        key, overrides = request
+        return self.cache.merge(key, output, overrides, self.fitness_fnc_args['trials_per_policy'])
+
+    def _flat(self, candidates, requests):
+        '''Runs all the candidates' trials as one flat queue on the hardware sized shared pool.'''
+        candidate_jobs = []
+        reducers = []
+        for c, (key, overrides) in zip(candidates, requests):
+            if overrides is None:
+                jobs, reducer = [], lambda job_results: None #Already cached
+            else:
+                jobs, reducer = self.trial_jobs_fnc(**c, **dict(self.fitness_fnc_args, **overrides))
+            candidate_jobs.append(jobs)
+            reducers.append(reducer)
+        scores = [None]*len(candidates)
+        waiting = [] #Cached candidates whose key still has trials running (for a duplicate of them earlier in the list)
+        for c, score in run_flat(get_pool(os.cpu_count()), candidate_jobs, reducers):
+            if requests[c][1] is None and requests[c][0] in self.cache.pending:
+                waiting.append(c)
+            else:
+                scores[c] = self._cache_merge(requests[c], score)
+            for w in [w for w in waiting if requests[w][0] not in self.cache.pending]:
+                scores[w] = self._cache_merge(requests[w], None)
+                waiting.remove(w)
+        return scores
+
+    def _pool(self, candidates, overrides):
+        '''Runs fitness_fnc on each candidate on the shared pool, with its own fitness_fnc_args overrides
+           (None ~ skip it, eg. as it's cached). Returns each candidate's output (None if skipped).'''
+        pool = get_pool(self.cores, config = {'fitness_fnc': self.fitness_fnc, 'fitness_fnc_args': self.fitness_fnc_args})
+        results = []
+        for c, o in zip(candidates, overrides):
+            if o is None:
+                results.append(None)
+            else:
+                results.append(pool.submit_with_config(_evaluate_policy, policy = c, overrides = o))
+        wait([r for r in results if r])
+        outputs = []
+        for r in results:
+            if not r:
+                outputs.append(None)
+            elif not r.exception():
+                outputs.append(r.result())
+            else:
+                print(r.exception())
+                raise Exception(f"Got exception for a result from parallel process")
+        return outputs
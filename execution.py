@@ -0,0 +1,103 @@
+'''
+Long-lived pools of worker processes shared by SA_hillclimb, Iterated_Local_Search, run_run_model and
+run_N_party_democracy, so workers are started (and the model code imported) once per session
+rather than once per hill-climb depth or fitness call.
+
+Workers preload PRELOAD_MODULES when they start and keep the config they were started with
+(eg. a search's fitness_fnc and fitness_fnc_args), which jobs sent with submit_with_config are run
+with, so it is pickled once per worker instead of once per job.
+Pools are kept per (workers, config), so a search that uses both a configured pool and the
+hardware sized one (eg. fidelity screening and flat trial queues) doesn't restart workers every depth.
+'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import atexit
+import importlib
+import os
+from copy import deepcopy
+
+PRELOAD_MODULES = ('agent', 'model', 'vector_model', 'scenarioV2A')
+
+MAX_POOLS = 4 #Most pools kept running at once; the least recently used one is stopped past this
+
+_worker_config = {} #The config this worker was started with (set in each worker process)
+_shared_pools = [] #Least recently used first
+
+
+def _init_worker(preload, config):
+    '''Runs once in each worker as it starts.'''
+    global _worker_config
+    for module in preload:
+        importlib.import_module(module)
+    _worker_config = config or {}
+
+
+def _run_with_config(fnc, kwargs):
+    '''Runs fnc in a worker with its kwargs plus the worker's config.'''
+    return fnc(**kwargs, **_worker_config)
+
+
+class WorkerPool():
+    '''A ProcessPoolExecutor whose workers preload the model code and keep a config.'''
+    def __init__(self, workers = None, config = None, preload = PRELOAD_MODULES):
+        self.workers = workers or os.cpu_count()
+        self.config = deepcopy(config) #Kept to compare against later requests
+        self.executor = ProcessPoolExecutor(self.workers, initializer = _init_worker, initargs = (preload, config))
+
+    def submit(self, fnc, *args, **kwargs):
+        '''Runs fnc(*args, **kwargs) on a worker, returning its Future.'''
+        return self.executor.submit(fnc, *args, **kwargs)
+
+    def submit_with_config(self, fnc, **kwargs):
+        '''Runs fnc(**kwargs, **config) on a worker, returning its Future.'''
+        return self.executor.submit(_run_with_config, fnc, kwargs)
+
+    def shutdown(self):
+        self.executor.shutdown(wait = True)
+
+
+def get_pool(workers = None, config = None):
+    '''Returns a shared WorkerPool with workers workers (defaults to os.cpu_count()) started with config.
+       A running pool with the same workers and config is reused (with config None, any with the same workers,
+       as jobs sent with submit don't use it); otherwise a new one is started alongside it.'''
+    workers = workers or os.cpu_count()
+    for pool in reversed(_shared_pools):
+        if pool.workers == workers and (config is None or pool.config == config):
+            _shared_pools.remove(pool)
+            _shared_pools.append(pool)
+            return pool
+    pool = WorkerPool(workers, config)
+    _shared_pools.append(pool)
+    while len(_shared_pools) > MAX_POOLS:
+        _shared_pools.pop(0).shutdown()
+    return pool
+
+
+def shutdown_pool():
+    '''Stops every shared pool's workers (also done at exit).'''
+    while _shared_pools:
+        _shared_pools.pop().shutdown()
+
+
+def run_flat(pool, candidate_jobs, reducers):
+    '''Runs every candidate's jobs as one flat queue on pool, so candidate and replicate level parallelism
+       share the same workers instead of nesting pools.
+       -candidate_jobs ~ one list of (fnc, kwargs) jobs per candidate (eg. one per trial)
+       -reducers ~ one function per candidate, turning the list of its jobs' results (in job order) into its score
+       Yields (candidate position, score) for each candidate as soon as its last job finishes.'''
+    results = [[None]*len(jobs) for jobs in candidate_jobs]
+    remaining = [len(jobs) for jobs in candidate_jobs]
+    futures = {}
+    for c, jobs in enumerate(candidate_jobs):
+        if not jobs:
+            yield c, reducers[c]([])
+        for j, (fnc, kwargs) in enumerate(jobs):
+            futures[pool.submit(fnc, **kwargs)] = (c, j)
+    for future in as_completed(futures):
+        c, j = futures[future]
+        results[c][j] = future.result()
+        remaining[c] -= 1
+        if remaining[c] == 0:
+            yield c, reducers[c](results[c])
+
+
+atexit.register(shutdown_pool)
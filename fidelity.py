@@ -0,0 +1,78 @@
+'''
+Multi-fidelity screening for the policy search: candidates are first scored cheaply, on a shorter horizon
+(with the agents' learning schedule compressed to match) and/or fewer trials, and only the best
+fraction is promoted to the full evaluation.
+
+fidelity_vars ~ {'horizon': .1, 'trials': 1, 'promote': .25} (these are the defaults)
+    -horizon ~ fraction of steps simulated when screening. explore_decay is divided by it, so agents
+               reach the same exploration rate at the same fraction of the run.
+    -trials ~ fraction of trials_per_policy run when screening (at least 1)
+    -promote ~ fraction of the screened candidates promoted to the full evaluation (at least 1)
+Scores at different fidelities aren't on the same scale (welfare is summed over periods), so screening
+only ranks candidates; fidelity_report gives the rank correlation between the two fidelities.
+'''
+from math import ceil
+import numpy as np
+
+FIDELITY_DEFAULTS = {'horizon': .1, 'trials': 1, 'promote': .25}
+DEFAULT_EXPLORE_DECAY = 0.0005 #As Shepherd and VectorModel default to
+
+
+def screening_args(fitness_fnc_args, fidelity_vars = None):
+    '''Returns a copy of fitness_fnc_args (for run_run_model) at the screening fidelity.'''
+    fidelity_vars = dict(FIDELITY_DEFAULTS, **(fidelity_vars or {}))
+    args = dict(fitness_fnc_args)
+    horizon = fidelity_vars['horizon']
+    args['steps'] = max(1, int(fitness_fnc_args['steps']*horizon))
+    args['trials_per_policy'] = max(1, int(round(fitness_fnc_args['trials_per_policy']*fidelity_vars['trials'])))
+    agent_variables = dict(fitness_fnc_args['agent_variables'])
+    agent_variables['explore_decay'] = agent_variables.get('explore_decay', DEFAULT_EXPLORE_DECAY)/horizon
+    args['agent_variables'] = agent_variables
+    return args
+
+
+def promote(scores, fidelity_vars = None):
+    '''Returns the positions (in order) of the best promote fraction of scores.'''
+    fraction = dict(FIDELITY_DEFAULTS, **(fidelity_vars or {}))['promote']
+    keep = max(1, ceil(len(scores)*fraction))
+    best = sorted(range(len(scores)), key = lambda c: -scores[c])[:keep]
+    return sorted(best)
+
+
+def _ranks(values):
+    '''Ranks of values (1 = smallest), ties sharing their average rank.'''
+    values = np.asarray(values, dtype = float)
+    order = np.argsort(values, kind = 'stable')
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(1, len(values) + 1)
+    for v in np.unique(values):
+        tied = values == v
+        ranks[tied] = ranks[tied].mean()
+    return ranks
+
+
+def spearman(x, y):
+    '''Spearman rank correlation of x and y (nan if either is constant or there are fewer than 2 pairs).'''
+    if len(x) < 2:
+        return float('nan')
+    rx, ry = _ranks(x), _ranks(y)
+    if rx.std() == 0 or ry.std() == 0:
+        return float('nan')
+    return float(np.corrcoef(rx, ry)[0, 1])
+
+
+def fidelity_report(pairs):
+    '''Summarises (screening score, full score) pairs by their rank correlation.'''
+    screened = [p[0] for p in pairs]
+    full = [p[1] for p in pairs]
+    return {'pairs': len(pairs), 'spearman': spearman(screened, full)}
+
+
+def calibrate_fidelity(candidates, fitness_fnc, fitness_fnc_args, fidelity_vars = None):
+    '''Scores every candidate at both fidelities (eg. a sample of _roll_canidate draws, before a search)
+       and returns fidelity_report of the pairs, with the pairs themselves under 'scores'.'''
+    low_args = screening_args(fitness_fnc_args, fidelity_vars)
+    pairs = [(fitness_fnc(**c, **low_args)['csw'], fitness_fnc(**c, **fitness_fnc_args)['csw']) for c in candidates]
+    report = fidelity_report(pairs)
+    report['scores'] = pairs
+    return report
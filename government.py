@@ -1,5 +1,11 @@
 from hillclimbing import _roll_canidate
-from scenarioV2A import run_run_model
+from scenarioV2A import run_run_model, run_run_model_jobs
+from racing import race, voter_criteria
+from execution import get_pool, run_flat
+from eval_cache import EvalCache
+from checkpoint import SearchCheckpoint, truncate_log, log_size
+from datafile import open_datafile
+import os
 import random
 import collections
 from copy import copy, deepcopy
@@ -23,6 +29,11 @@ def _eval_policy(lag_win_info, policy_id, policy, newp_runs, agent_count, game_v
     #print(f'Policy_eval: {policy_eval}')
     if verbose:
         print(f"Policy:\n{policy}\nPlayer round utility est.: {policy_eval['iw']}")
+    return _incorporate_lag_win(lag_win_info, policy_id, policy_eval, verbose)
+
+def _incorporate_lag_win(lag_win_info, policy_id, policy_eval, verbose = False):
+    '''If policy_id is the standing winner, averages its new evaluation with those from its winning streak.
+       Returns [social welfare, each player's utility].'''
     if lag_win_info['id'] == policy_id:
         if verbose:
             print(f'...this policy has occured before, so will incorperate past outcomes in utility estimate..')
@@ -40,20 +51,105 @@ def _eval_policy(lag_win_info, policy_id, policy, newp_runs, agent_count, game_v
             print(f"Player updated round utility est. (incorperating past performance): {policy_eval['iw']}")
     return [policy_eval['csw'], policy_eval['iw']]
 
-def vote(lag_win_info, newp_runs, platforms, agent_count, gv, av, vv, dto, steps, spv, verbose=False, cores = 1):
+def _vote_args(newp_runs, agent_count, gv, av, vv, dto, steps, spv):
+    '''run_run_model's arguments (besides the fine vector) for evaluating a platform.'''
+    return {'agent_count': agent_count, 'game_variables': gv, 'agent_variables': av, 'verbose_variables': vv,
+            'data_to_output': dto, 'steps': steps, 'trials_per_policy': newp_runs, 'social_planner_vars': spv,
+            'return_indv_welfare': True}
+
+def _race_policies(lag_win_info, platforms, newp_runs, agent_count, gv, av, vv, dto, steps, spv, race_vars, verbose = False):
+    '''Evaluates every platform by racing (see racing.py): a platform stops getting trials once no player
+       could still prefer it. Returns {platform id: [social welfare, each player's utility]}.'''
+    args = _vote_args(newp_runs, agent_count, gv, av, vv, dto, steps, spv)
+    pids = list(platforms.keys())
+    evals = race([platforms[pid] for pid in pids], run_run_model_jobs, args,
+                 race_vars = race_vars, criteria = voter_criteria)
+    forecasts = {}
+    for pid, policy_eval in zip(pids, evals):
+        if verbose:
+            print(f"Policy:\n{platforms[pid]}\nPlayer round utility est. ({policy_eval['trials']} trials): {policy_eval['iw']}")
+        forecasts[pid] = _incorporate_lag_win(lag_win_info, pid, policy_eval, verbose)
+    return forecasts
+
+def _reuse_request(cache, policy, args, reuse_vars):
+    '''Asks cache (in 'reuse' mode) for the trials policy still needs: newp_runs if it's new, and for a platform
+       it already has, reuse_vars['top_up_trials'] more while its estimate rests on fewer than reuse_vars['max_trials'].'''
+    newp_runs = args['trials_per_policy']
+    max_trials = reuse_vars.get('max_trials') or newp_runs
+    entry = cache.entries.get(cache.key(policy, args))
+    wanted = newp_runs
+    if entry and entry['count'] < max_trials:
+        wanted = min(max_trials, entry['count'] + (reuse_vars.get('top_up_trials') or newp_runs))
+    return cache.request(policy, dict(args, trials_per_policy = wanted))
+
+def _evaluate_policies(lag_win_info, platforms, args, cores = 1, cache = None, reuse_vars = None, verbose = False):
+    '''Evaluates every platform. With cores > 1 all platform x replicate trials run as one flat queue on the
+       shared pool (see execution.py), rather than platform by platform.
+       With cache (an EvalCache in 'reuse' mode), platforms unchanged since a past round reuse their estimate (the
+       mean over all their trials so far, so it takes the place of lag_win_info's streak average), and are only topped up
+       with fresh trials as reuse_vars asks (see _reuse_request). Returns {platform id: [social welfare, each player's utility]}.'''
+    pids = list(platforms.keys())
+    requests = [_reuse_request(cache, platforms[pid], args, reuse_vars or {}) if cache else (None, {}) for pid in pids]
+    outputs = [None]*len(pids)
+    if cores > 1:
+        candidate_jobs, reducers = [], []
+        for pid, (key, overrides) in zip(pids, requests):
+            jobs, reducer = ([], lambda job_results: None) if overrides is None else \
+                run_run_model_jobs(fine_vector = platforms[pid]['fine_vector'], **dict(args, **overrides))
+            candidate_jobs.append(jobs)
+            reducers.append(reducer)
+        for pos, output in run_flat(get_pool(os.cpu_count()), candidate_jobs, reducers):
+            outputs[pos] = output
+    else:
+        for pos, (pid, (key, overrides)) in enumerate(zip(pids, requests)):
+            if overrides is not None:
+                outputs[pos] = run_run_model(fine_vector = platforms[pid]['fine_vector'], **dict(args, **overrides))
+    forecasts = {}
+    for pid, request, output in zip(pids, requests, outputs):
+        if cache:
+            key, overrides = request
+            policy_eval = cache.merge(key, output, overrides, args['trials_per_policy'])
+            if verbose:
+                print(f"Policy:\n{platforms[pid]}\nPlayer round utility est. ({policy_eval['trials']} trials): {policy_eval['iw']}")
+            forecasts[pid] = [policy_eval['csw'], policy_eval['iw']]
+        else:
+            if verbose:
+                print(f"Policy:\n{platforms[pid]}\nPlayer round utility est.: {output['iw']}")
+            forecasts[pid] = _incorporate_lag_win(lag_win_info, pid, output, verbose)
+    return forecasts
+
+def vote(lag_win_info, newp_runs, platforms, agent_count, gv, av, vv, dto, steps, spv, verbose=False, cores = 1, race_vars = None,
+         cache = None, reuse_vars = None):
     '''Creates a dict of evals for each player for each policy in platforms using
-       _eval_policy. Returns vote (policy which yeilds best estimated EU) for each agent.'''
+       _eval_policy (or, if race_vars are given, by racing the platforms on the shared pool).
+       With cores > 1 or a cache, platforms are evaluated together by _evaluate_policies instead: all their trials
+       run at once on the shared pool, and platforms the cache (an EvalCache in 'reuse' mode) has seen are reused
+       rather than re-simulated, topped up with fresh trials per reuse_vars ~ {'max_trials': None, 'top_up_trials': None}
+       (None ~ newp_runs; by default a reused platform is never topped up).
+       Returns vote (policy which yeilds best estimated EU) for each agent.'''
     #Step 1: Create dict to store agent's favorite policies
     votes = [-1 for a in range(agent_count)]
     util_under_voted_pol = [-1_000_000 for a in range(agent_count)]
     util_under_all_pol = []
     sw_under_each_pol = {}
     #Step 2: Evaluate each policy, and store it for each agent if better than best so far:
+    if race_vars is not None:
+        forecasts = _race_policies(lag_win_info, platforms, newp_runs, agent_count, gv, av, vv, dto, steps, spv, race_vars, verbose)
+    elif cores > 1 or cache:
+        if cache and cache.mode != 'reuse':
+            raise ValueError("vote's cache must be in 'reuse' mode")
+        forecasts = _evaluate_policies(lag_win_info, platforms, _vote_args(newp_runs, agent_count, gv, av, vv, dto, steps, spv),
+                                       cores = cores, cache = cache, reuse_vars = reuse_vars, verbose = verbose)
+    else:
+        forecasts = None
     for pid, plat in platforms.items():
-        policy_utility_forcast = _eval_policy(lag_win_info, policy_id = pid, policy = plat, newp_runs = newp_runs,
-                                               agent_count = agent_count, game_variables = gv,
-                                               agent_variables = av, verbose_variables = vv, data_to_output = dto, steps = steps,
-                                               spv = spv, verbose = verbose, cores = cores)
+        if forecasts is not None:
+            policy_utility_forcast = forecasts[pid]
+        else:
+            policy_utility_forcast = _eval_policy(lag_win_info, policy_id = pid, policy = plat, newp_runs = newp_runs,
+                                                   agent_count = agent_count, game_variables = gv,
+                                                   agent_variables = av, verbose_variables = vv, data_to_output = dto, steps = steps,
+                                                   spv = spv, verbose = verbose, cores = cores)
         sw_under_each_pol[pid] = policy_utility_forcast[0]
         util_under_all_pol.append(copy(policy_utility_forcast[1]))
         for aid in range(len(policy_utility_forcast[1])):
@@ -108,30 +204,59 @@ def update_platforms(winID, platforms, lag_platforms, vote_shares, lag_vote_shar
 
 def run_N_party_democracy(rounds, N, newp_runs, policy_vars,
                           agent_count, gv, av, vv, dto, steps, sv, agg_type = 'majority',
-                          verbose = False, cores = 1):
-    '''Runs an N platform democracy for a number of rounds.'''
+                          verbose = False, cores = 1, race_vars = None, checkpoint_every = None, resume_from = None,
+                          reuse_vars = None):
+    '''Runs an N platform democracy for a number of rounds.
+       With cores > 1, every round's evaluations run on the one shared worker pool (see execution.py).
+       race_vars (see racing.py) if given, has each vote race the platforms rather than give each newp_runs trials.
+       reuse_vars ({'max_trials', 'top_up_trials'}, see vote) if given, keeps the evaluations of the platforms in play
+       in an EvalCache, so a platform kept from last round (eg. the winner) is reused rather than re-simulated.
+       Each new winner is written to {N}Party_{tag}_data.txt through a buffered writer, flushed at every checkpoint
+       (every round when checkpointing is off).
+    -checkpoint_every ~ None, or how many rounds between checkpoints of the round state (platforms, lag info, random state)
+                        in {N}Party_{tag}_checkpoint.pkl
+    -resume_from ~ path of a checkpoint to continue from: finished rounds aren't rerun, and the data file is cut
+                   back to the rows written by the checkpointed round'''
     #Initializing the model:
-    lag_best_eval_info ={'id':-100, 'streak': -100, 'iw': None, 'sw': None}
-    lag_vote_shares = [0 for i in range(N)]
-    platforms = initialize_platforms(N = N, policy_vars = policy_vars) #<---- For later: Custom initial positions?
-    lag_platforms = None
-    #Prepping file writing:
-    npfile = open(f'{N}Party_{dto["tag"]}_data.txt','w')
-    var_titles = ''
+    if cores > 1:
+        get_pool(os.cpu_count()) #Starting the workers once, before the first round
+    file_tag = f'{N}Party_{dto["tag"]}'
+    columns = [('N', int), ('t', int), ('winning_id', int), ('vote_share', float)]
     for vname, var in policy_vars.items():
-        for i in range(var['size']):
-            var_titles += f',{vname}_{i}'
-    npfile.write(f'N,t,winning_id,vote_share,{var_titles},fitness\n') #Writing variable names for the file
-    npfile.close()
+        columns.extend((f'{vname}_{i}', float) for i in range(var['size']))
+    columns.append(('fitness', float))
+    checkpoint = SearchCheckpoint(f'{file_tag}_checkpoint.pkl', every = checkpoint_every) if checkpoint_every else None
+    if resume_from:
+        checkpoint = SearchCheckpoint.resume(resume_from, checkpoint)
+    resumed = checkpoint.state.get('democracy') if checkpoint else None
+    cache = EvalCache(mode = 'reuse') if reuse_vars is not None and race_vars is None else None
+    if resumed:
+        if resumed['tag'] != file_tag:
+            raise ValueError(f"Checkpoint is of democracy {resumed['tag']!r}, not {file_tag!r}")
+        checkpoint.restore(cache)
+        first_round = resumed['round']
+        platforms, lag_platforms = resumed['platforms'], resumed['lag_platforms']
+        lag_best_eval_info, lag_vote_shares = resumed['lag_best_eval_info'], resumed['lag_vote_shares']
+        winning_id = resumed['winning_id']
+        truncate_log(f'{file_tag}_data.txt', resumed['log_size'])
+    else:
+        first_round = 0
+        lag_best_eval_info ={'id':-100, 'streak': -100, 'iw': None, 'sw': None}
+        lag_vote_shares = [0 for i in range(N)]
+        platforms = initialize_platforms(N = N, policy_vars = policy_vars) #<---- For later: Custom initial positions?
+        lag_platforms = None
+    #Prepping file writing (one handle for the whole run, holding at most the rows since the last checkpoint):
+    npfile = open_datafile(file_tag, columns, buffer_rows = checkpoint.every if checkpoint else 1, append = bool(resumed))
     #Stepping..
-    for t in range(rounds):
+    for t in range(first_round, rounds):
         if verbose:
             print(f'\nRound {t}')
             print(f'Policies:\n{platforms}')
         #Agents vote:
         agent_votes = vote(lag_win_info = lag_best_eval_info, newp_runs = newp_runs,
                            platforms = platforms, agent_count = agent_count, gv = gv, av = av, vv = vv, dto = dto,
-                           steps = steps, spv = policy_vars, verbose = verbose, cores = cores)
+                           steps = steps, spv = policy_vars, verbose = verbose, cores = cores, race_vars = race_vars,
+                           cache = cache, reuse_vars = reuse_vars)
         #Votes are collected and a winning policy is determined (and the implications of the policy are recorded):
         winning_id, vote_shares = policy_winner(N=N, votes = agent_votes[0], agg_type = agg_type, verbose = verbose)
         sw_under_p  = agent_votes[1][winning_id]
@@ -144,17 +269,18 @@ def run_N_party_democracy(rounds, N, newp_runs, policy_vars,
         platforms = update_platforms(winID = winning_id, platforms = platforms, lag_platforms=lag_platforms, vote_shares=vote_shares, 
                                      lag_vote_shares=lag_vote_shares, policy_vars = policy_vars, search_vars = sv, verbose=verbose)
         lag_platforms = deepcopy(platforms)
+        if cache:
+            args = _vote_args(newp_runs, agent_count, gv, av, vv, dto, steps, policy_vars)
+            cache.retain([cache.key(plat, args) for plat in platforms.values()]) #Only platforms still in play can be reused
         if verbose:
             print(f'New policies for next round:\n{platforms}')
         #Writing results to file:
         if winning_id != lag_best_eval_info['id'] or t == rounds-1: #Write only if last round OR new policy won
-            npfile = open(f'{N}Party_{dto["tag"]}_data.txt','a')
-            tth_entry = ''
-            for pvar in platforms[winning_id].values():
-                for p in pvar:
-                    tth_entry += f',{p}'
-            npfile.write(f'{N},{t},{winning_id},{vote_shares[winning_id]}{tth_entry},{sw_under_p}\n')
-            npfile.close()
+            row = {'N': N, 't': t, 'winning_id': winning_id, 'vote_share': vote_shares[winning_id], 'fitness': sw_under_p}
+            for vname, pvar in platforms[winning_id].items():
+                for i, p in enumerate(pvar):
+                    row[f'{vname}_{i}'] = p
+            npfile.add_rows(1, **row)
         #Updating lag info for next round:
         if winning_id == lag_best_eval_info['id']:
             lag_best_eval_info['streak'] += 1
@@ -164,4 +290,13 @@ def run_N_party_democracy(rounds, N, newp_runs, policy_vars,
         lag_best_eval_info['sw'] = sw_under_p
         lag_best_eval_info['iw'] = iw_under_p
         lag_vote_shares = copy(vote_shares)
+        #Without checkpoints every round is flushed, so a crash loses no finished round:
+        if checkpoint is None or checkpoint.due(t, rounds - 1):
+            npfile.sync()
+        if checkpoint and checkpoint.due(t, rounds - 1):
+            checkpoint.state['democracy'] = {'tag': file_tag, 'round': t + 1, 'platforms': platforms, 'lag_platforms': lag_platforms,
+                                             'lag_best_eval_info': lag_best_eval_info, 'lag_vote_shares': lag_vote_shares,
+                                             'winning_id': winning_id, 'log_size': log_size(f'{file_tag}_data.txt')}
+            checkpoint.save(cache)
+    npfile.close()
     return winning_id, platforms[winning_id]
@@ -2,7 +2,10 @@ from random import uniform, choice
 from numpy.random import normal
 from copy import deepcopy
 from math import exp
-from concurrent.futures import ProcessPoolExecutor
+from random_streams import spawn_seeds
+from evaluator import Evaluator
+from fidelity import screening_args, promote, fidelity_report
+from checkpoint import SearchCheckpoint, truncate_log, log_size
 
 #---For hillclimber variants---
 def _roll_canidate(param_vars, search_vars, best_val = None, round_decimal_places = 2):
@@ -77,7 +80,9 @@ def _establish_memory():
     return memory_object
 
 def _update_memory(memory, action, feedback, verbose = False, final_choices = 'NotStored'):
-    '''Updates the hillclimbers memory object with info from this period.'''
+    '''Updates the hillclimbers memory object with info from this period.
+       Under common random numbers the incumbent is re-scored first each depth, with the same seeds as the
+       candidates, so each candidate is compared with a paired estimate of the incumbent.'''
     #Case 1: Exploited old action, so update fitness with most recent:
     if memory['action'] == action:
         new_memory = {'action': memory['action'], 'fitness': feedback, 'final_choices':final_choices}
@@ -128,12 +133,43 @@ def _run_hillclimb_helper(param_vars, search_vars, bv, fitness_fnc_args, fitness
     else:
         return [a, fitness_fnc(**a)]
 
+def _score_performance(mem, performance, return_last_act):
+    '''Updates a hillclimber's memory with one [candidate, fitness_fnc output] pair.'''
+    if return_last_act:
+        return _update_memory(mem, performance[0], performance[1]['csw'], final_choices = performance[1]['last_act'])
+    return _update_memory(mem, performance[0], performance[1]['csw'])
+
 def SA_hillclimb(param_vars, search_vars, pop_size, depth, fitness_fnc, starting_point = None, fitness_fnc_args = None,
-                 output_to_file = False, tag = ''):
+                 output_to_file = False, tag = '', batch_fitness_fnc = None, trial_jobs_fnc = None, cache = None,
+                 crn_seed = None, race_vars = None, fidelity_vars = None, surrogate = None, warm_vars = None,
+                 checkpoint = None, resume_from = None, evaluator = None):
     '''
     Runs a steepest ascent hillclimbing alg. for a given search depth.
 
-    -fitness_fnc_args allows you to input other arguments for your fitness function that aren't your parameter values specifically.
+    -evaluator (an evaluator.Evaluator) scores each depth's candidates (incumbent included). If not given, one is made from
+        fitness_fnc, fitness_fnc_args, search_vars['cores'], batch_fitness_fnc, trial_jobs_fnc, cache and race_vars
+        (see evaluator.py for the modes these pick). Its cache, if any, is saved every depth.
+    -search_vars['common_random_numbers'] if True, scores the incumbent and every candidate of a depth under the same
+        seed (fitness_fnc's seed argument, so replicate r shares its random stream across them), a fresh one each depth,
+        so candidates are compared with the incumbent on paired estimates. Depth seeds are spawned from crn_seed,
+        or else search_vars['seed'] (None ~ fresh entropy). The cache is not used in this mode, as every depth's seeds are new.
+    -fidelity_vars (see fidelity.py) if given, first scores each depth's new candidates on a short horizon and/or fewer trials,
+        and only the best fraction goes on (with the incumbent) to the full evaluation. The rank correlation between
+        the two fidelities over the promoted candidates is reported at the end (and logged to {tag}_fidelity_log.txt).
+    -surrogate (eg. a surrogate.GPSurrogate) if given, learns from every evaluation, and each depth pop_size * surrogate.oversample
+        candidates are rolled, of which only the pop_size with the highest expected improvement are simulated.
+        Evaluations on new random draws are added (weighted by their share of trials_per_policy trials); cached estimates
+        and repeats of the same seeded trials (eg. the re-scored incumbent) replace the policy's earlier ones.
+    -warm_vars ~ {'steps': adaptation steps} if given, keeps the incumbent's end of run learned agent states (fitness_fnc's
+        return_states, see scenarioV2A.run_run_model), and from the next depth on the incumbent and candidates continue from
+        them for only warm_vars['steps'] periods instead of learning from scratch. Fitness is then welfare over that horizon:
+        the first depth's winner is re-scored on it, so the logged, compared and surrogate fitnesses all share it.
+        Used in the evaluator's 'pool' and 'flat' modes (a ValueError in the others), and the cache is not used.
+        See scenarioV2A.warm_start_bias_report for how warm scores compare with cold ones.
+    -checkpoint (a checkpoint.SearchCheckpoint) if given, saves the search's state (depth, memory, incumbent, warm states,
+        log positions, random states, cache and surrogate) every checkpoint.every depths. If it holds a hill climb's
+        state (eg. loaded by resume_from, or by Iterated_Local_Search), the search continues from there.
+    -resume_from ~ path of a checkpoint to continue from (and keep checkpointing to, unless checkpoint is given)
     '''
     #Initializing:
     if starting_point:
@@ -144,17 +180,37 @@ def SA_hillclimb(param_vars, search_vars, pop_size, depth, fitness_fnc, starting
         mem = _establish_memory()
     if 'explore_range' not in search_vars:
         search_vars['explore_range'] = 1
-    if 'cores' in search_vars:
-        cores = search_vars['cores']
-    else:
-        cores = 1
-    if 'return_last_act' in fitness_fnc_args:
-        return_last_act = fitness_fnc_args['return_last_act']
-    else:
-        return_last_act = False
+    if evaluator is None:
+        evaluator = Evaluator(fitness_fnc, fitness_fnc_args, search_vars.get('cores', 1), batch_fitness_fnc = batch_fitness_fnc,
+                              trial_jobs_fnc = trial_jobs_fnc, cache = cache, race_vars = race_vars)
+    fitness_fnc_args = evaluator.fitness_fnc_args
+    return_last_act = evaluator.return_last_act
+    depth_seeds = [None]*depth
+    if search_vars.get('common_random_numbers'):
+        depth_seeds = spawn_seeds(crn_seed if crn_seed is not None else search_vars.get('seed'), depth)
+        evaluator = evaluator.without_cache()
+    fidelity_pairs = [] #(screening fitness, full fitness) of each promoted candidate
+    incumbent_states = None #The incumbent's end of run learned states, for warm starts
+    if warm_vars is not None:
+        evaluator.check_warm()
+        evaluator = evaluator.without_cache()
+    if resume_from:
+        checkpoint = SearchCheckpoint.resume(resume_from, checkpoint)
+    resumed = checkpoint.state.get('hc') if checkpoint else None
+    first_depth = 0
+    if resumed:
+        if resumed['tag'] != tag:
+            raise ValueError(f"Checkpoint is of search {resumed['tag']!r}, not {tag!r}")
+        checkpoint.restore(evaluator.cache, surrogate)
+        first_depth = resumed['depth']
+        mem, bv = resumed['mem'], resumed['bv']
+        fidelity_pairs, incumbent_states = resumed['fidelity_pairs'], resumed['incumbent_states']
     #Setting up column titles and first data row for log file:
     if output_to_file:
         file_name = f'{tag}_hc_log.txt'
+    if output_to_file and resumed:
+        truncate_log(file_name, resumed['log_size'])
+    elif output_to_file:
         lol = open(file_name,'w')
         if return_last_act:
             lol.write(f'best_policy, fitness, final_choices\n')
@@ -163,38 +219,59 @@ def SA_hillclimb(param_vars, search_vars, pop_size, depth, fitness_fnc, starting
         lol.close()
 
     #Running rounds of search:
-    for d in range(depth):
+    for d in range(first_depth, depth):
         print(f'  HC Depth {d}')
         #Step 1 - Create and evaluate pop_size variants:
-        results = []
-        performances = []
-        with ProcessPoolExecutor(cores) as threadpool:
-            #Resubmitting bv
-            if bv:
-                results.append(threadpool.submit(_run_hillclimb_helper, param_vars = param_vars, 
-                                                    search_vars = search_vars, bv = bv, 
-                                                    fitness_fnc_args = fitness_fnc_args, 
-                                                    fitness_fnc = fitness_fnc, roll_new = False))
-            for i in range(pop_size):
-                results.append(threadpool.submit(_run_hillclimb_helper, param_vars = param_vars, 
-                                                 search_vars = search_vars, bv = bv, 
-                                                 fitness_fnc_args = fitness_fnc_args, 
-                                                 fitness_fnc = fitness_fnc, roll_new = True))
-            threadpool.shutdown(wait = True)
-        for r in results:
-            if not r.exception():
-                performances.append(r.result())
-            else:
-                print(r.exception())
-                raise Exception(f"Got exception for a result from parallel process")
+        #(Candidates are rolled here, so workers, which all start from the same random state, don't repeat them)
+        candidates = []
+        rolls = pop_size*surrogate.oversample if surrogate else pop_size
+        for i in range(rolls):
+            candidates.append(_roll_canidate(param_vars, search_vars, bv))
+        if surrogate:
+            candidates = surrogate.select(candidates, pop_size)
+        if fidelity_vars is not None:
+            low_args = screening_args(fitness_fnc_args, fidelity_vars)
+            if depth_seeds[d] is not None:
+                low_args['seed'] = depth_seeds[d]
+            low_scores = evaluator.screen(candidates, low_args)
+            promoted = promote(low_scores, fidelity_vars)
+            candidates = [candidates[c] for c in promoted]
+            low_scores = [low_scores[c] for c in promoted]
+        if bv:
+            candidates.insert(0, bv) #Resubmitting bv
+        depth_extra = {} #Overrides of fitness_fnc_args for this depth's full evaluations
+        if depth_seeds[d] is not None:
+            depth_extra['seed'] = depth_seeds[d]
+        if warm_vars is not None:
+            depth_extra['return_states'] = True
+            if incumbent_states:
+                depth_extra.update(steps = warm_vars['steps'], warm_states = incumbent_states)
+        scored = [[c, output] for c, output in zip(candidates, evaluator.evaluate(candidates, depth_extra))]
+        if fidelity_vars is not None:
+            full_scores = [p[1]['csw'] for p in scored[len(candidates) - len(low_scores):]]
+            fidelity_pairs.extend(zip(low_scores, full_scores))
+        #A warm search's first depth is scored on the full horizon, so only its re-scored incumbent (below) is learned from:
+        cold_depth = warm_vars is not None and 'warm_states' not in depth_extra
+        if surrogate and not cold_depth:
+            evaluator.teach(surrogate, scored, depth_seeds[d])
         #Step 2 - Compare each to existing to see which to keep:
-        for p in performances:
+        for p in scored:
             #print(p)
-            if return_last_act:
-                mem = _update_memory(mem, p[0], p[1]['csw'], final_choices = p[1]['last_act'])
-            else:
-                mem = _update_memory(mem, p[0], p[1]['csw'])
+            mem = _score_performance(mem, p, return_last_act)
             bv = mem['action']
+        if warm_vars is not None:
+            #Taken once this depth's winner is known, so the next depth continues from its states:
+            for p in scored:
+                if p[0] == mem['action'] and 'states' in p[1]:
+                    incumbent_states = p[1]['states']
+            if cold_depth and incumbent_states:
+                #Re-scored on the warm horizon, so every fitness logged, compared or learned from is on the same one:
+                warm_extra = dict(depth_extra, steps = warm_vars['steps'], warm_states = incumbent_states, return_states = False)
+                rescored = [[bv, evaluator.evaluate([bv], warm_extra)[0]]]
+                mem = _score_performance(mem, rescored[0], return_last_act)
+                if surrogate:
+                    evaluator.teach(surrogate, rescored, depth_seeds[d])
+        evaluator.save()
             
         if output_to_file:
             lol = open(file_name,'a')
@@ -203,11 +280,27 @@ def SA_hillclimb(param_vars, search_vars, pop_size, depth, fitness_fnc, starting
             else:
                 lol.write(f'{mem["action"]}, {mem["fitness"]},\n')
             lol.close()
+        if checkpoint and checkpoint.due(d, depth - 1):
+            checkpoint.state['hc'] = {'tag': tag, 'depth': d + 1, 'mem': mem, 'bv': bv, 'fidelity_pairs': fidelity_pairs,
+                                      'incumbent_states': incumbent_states,
+                                      'log_size': log_size(file_name) if output_to_file else 0}
+            checkpoint.save(evaluator.cache, surrogate)
+    if fidelity_vars is not None:
+        report = fidelity_report(fidelity_pairs)
+        print(f'  Fidelity calibration: spearman {report["spearman"]} over {report["pairs"]} promoted candidates')
+        if output_to_file:
+            fl = open(f'{tag}_fidelity_log.txt','w')
+            fl.write(f'screening_fitness, fitness\n')
+            for low, full in fidelity_pairs:
+                fl.write(f'{low}, {full}\n')
+            fl.close()
     return mem
 
 def Iterated_Local_Search(param_vars, hc_search_vars, pop_size, hc_depth, fitness_fnc, ils_depth, 
                            ils_search_vars, fitness_fnc_args = None, verbose = False,
-                           output_to_file = False, tag = '', starting_point = None):
+                           output_to_file = False, tag = '', starting_point = None, batch_fitness_fnc = None,
+                           trial_jobs_fnc = None, cache = None, race_vars = None, fidelity_vars = None, surrogate = None,
+                           warm_vars = None, checkpoint = None, resume_from = None, evaluator = None):
     '''Hill climbs over local optima found with SA_hillclimb.
 
     -ils_search_vars ~ {'distribution': distribution, 'explore_range': explore_range, 'downhill_coeff': downhill_coeff}
@@ -215,18 +308,45 @@ def Iterated_Local_Search(param_vars, hc_search_vars, pop_size, hc_depth, fitnes
         Downhill coeff partly determines how often we'll accept a new homebase which is a bit worse.
             smaller is better. Choose from (0,1]. .1 by default
     -fitness_fnc_args lets you give arguments to the fitness function besides the parameter values
+    -evaluator (an evaluator.Evaluator) is handed to SA_hillclimb, so every restart scores candidates the same way (and
+        reuses the same cache). If not given, one is made from fitness_fnc, fitness_fnc_args, hc_search_vars['cores'],
+        batch_fitness_fnc, trial_jobs_fnc, cache and race_vars.
+    -fidelity_vars is handed to SA_hillclimb to screen each depth's candidates before full evaluation
+    -surrogate is handed to SA_hillclimb to pick which candidates to simulate, and keeps learning across restarts
+    -warm_vars is handed to SA_hillclimb (each restart starts cold, then continues from its incumbent's states)
+    -with hc_search_vars['common_random_numbers'], each restart's SA_hillclimb gets its own crn_seed, spawned from hc_search_vars['seed']
+    -checkpoint (a checkpoint.SearchCheckpoint) is handed to SA_hillclimb to checkpoint within each restart, and is also saved
+        after every restart (with the restart reached, home_base and best_ever). If it holds an ILS's state (eg. loaded
+        by resume_from), the search continues from the restart (and hill climb depth) it had reached.
+    -resume_from ~ path of a checkpoint to continue from (and keep checkpointing to, unless checkpoint is given)
     '''
-    #Step 1: Finding a local optimum with SA_hillclimb
-    print('\nILS Depth 0')
-    local_optimum = SA_hillclimb(param_vars, hc_search_vars, pop_size, hc_depth, fitness_fnc,
-                                 starting_point = starting_point, fitness_fnc_args = fitness_fnc_args,
-                                 output_to_file=output_to_file, tag = f'{tag}_ILS0')
-    if verbose:
-        print(f'LO: {local_optimum}')
+    if evaluator is None:
+        evaluator = Evaluator(fitness_fnc, fitness_fnc_args, hc_search_vars.get('cores', 1), batch_fitness_fnc = batch_fitness_fnc,
+                              trial_jobs_fnc = trial_jobs_fnc, cache = cache, race_vars = race_vars)
+    restart_seeds = spawn_seeds(hc_search_vars.get('seed'), ils_depth)
+    if resume_from:
+        checkpoint = SearchCheckpoint.resume(resume_from, checkpoint)
+    resumed = checkpoint.state.get('ils') if checkpoint else None
+    if resumed and resumed['tag'] != tag:
+        raise ValueError(f"Checkpoint is of search {resumed['tag']!r}, not {tag!r}")
+    first_restart = resumed['restart'] if resumed else 0
+    mid_restart = bool(resumed) and 'hc' in checkpoint.state #Resuming within a restart's hill climb
     if output_to_file:
-        #Setting up column titles and first data row for log file:
         file_name = f'{tag}_local_optimum_log.txt'
-        lol = open(file_name,'w')
+    if first_restart == 0:
+        #Step 1: Finding a local optimum with SA_hillclimb
+        print('\nILS Depth 0')
+        if mid_restart:
+            starting_point = resumed['starting_point']
+        if checkpoint:
+            checkpoint.state['ils'] = {'tag': tag, 'restart': 0, 'starting_point': starting_point}
+        local_optimum = SA_hillclimb(param_vars, hc_search_vars, pop_size, hc_depth, fitness_fnc,
+                                     starting_point = starting_point, output_to_file=output_to_file, tag = f'{tag}_ILS0',
+                                     evaluator = evaluator, crn_seed = restart_seeds[0], fidelity_vars = fidelity_vars, surrogate = surrogate, warm_vars = warm_vars,
+                                     checkpoint = checkpoint)
+        if verbose:
+            print(f'LO: {local_optimum}')
+        #Setting up column titles and first data row for log file:
         var_title = ''
         var_vals = ''
         for k, v in local_optimum['action'].items():
@@ -237,22 +357,46 @@ def Iterated_Local_Search(param_vars, hc_search_vars, pop_size, hc_depth, fitnes
             else:
                 var_title += f', {k}'
                 var_vals += f', {v}'
-        lol.write(f'num{var_title}, fitness\n0{var_vals}, {local_optimum["fitness"]}\n')
-        lol.close()
-    home_base = local_optimum #We'll use this to decide what are new starting points should be near.
-    best_ever = local_optimum #We'll use this to hold onto the best solution we've ever found
+        if output_to_file:
+            lol = open(file_name,'w')
+            lol.write(f'num{var_title}, fitness\n0{var_vals}, {local_optimum["fitness"]}\n')
+            lol.close()
+        home_base = local_optimum #We'll use this to decide what are new starting points should be near.
+        best_ever = local_optimum #We'll use this to hold onto the best solution we've ever found
+        mid_restart = False
+        if checkpoint:
+            checkpoint.state.pop('hc', None)
+            checkpoint.state['ils'] = {'tag': tag, 'restart': 1, 'home_base': home_base, 'best_ever': best_ever,
+                                       'var_title': var_title, 'log_size': log_size(file_name) if output_to_file else 0}
+            checkpoint.save(evaluator.cache, surrogate)
+    else:
+        home_base, best_ever, var_title = resumed['home_base'], resumed['best_ever'], resumed['var_title']
+        if output_to_file:
+            truncate_log(file_name, resumed['log_size'])
+        if not mid_restart:
+            checkpoint.restore(evaluator.cache, surrogate)
     if 'explore_range' not in ils_search_vars:
         ils_search_vars['explore_range'] = 1
     if 'downhill_coeff' not in ils_search_vars:
         ils_search_vars['downhill_coeff'] = None
-    for k in range(ils_depth-1):
+    for k in range(max(first_restart, 1) - 1, ils_depth-1):
         print(f'\nILS Depth {k+1}')
         #Step 2: Finding a starting point (which are variants of our home_base)
-        variant_hb = _roll_canidate(param_vars, ils_search_vars, best_val = home_base['action'])
-        new_sp = {'action': variant_hb, 'fitness': None}
+        if mid_restart:
+            new_sp = resumed['starting_point']
+            mid_restart = False
+        else:
+            variant_hb = _roll_canidate(param_vars, ils_search_vars, best_val = home_base['action'])
+            new_sp = {'action': variant_hb, 'fitness': None}
+        if checkpoint:
+            checkpoint.state['ils'] = {'tag': tag, 'restart': k+1, 'starting_point': new_sp, 'home_base': home_base,
+                                       'best_ever': best_ever, 'var_title': var_title,
+                                       'log_size': log_size(file_name) if output_to_file else 0}
         #Step 3: Find local optimum from that starting point
         local_optimum = SA_hillclimb(param_vars, hc_search_vars, pop_size, hc_depth, fitness_fnc, starting_point = new_sp,
-                                     fitness_fnc_args = fitness_fnc_args, output_to_file=output_to_file, tag = f'{tag}_ILS{k+1}')
+                                     output_to_file=output_to_file, tag = f'{tag}_ILS{k+1}', evaluator = evaluator,
+                                     crn_seed = restart_seeds[k+1], fidelity_vars = fidelity_vars,
+                                     surrogate = surrogate, warm_vars = warm_vars, checkpoint = checkpoint)
         if output_to_file:
             lol = open(file_name,'a')
             var_vals = ''
@@ -293,6 +437,11 @@ def Iterated_Local_Search(param_vars, hc_search_vars, pop_size, hc_depth, fitnes
                     bvv += f', {bv}'
             bp.write(f'depth{var_title}, fitness\n{k+1}{bvv}, {best_ever["fitness"]}\n')
             bp.close()
+        if checkpoint:
+            checkpoint.state.pop('hc', None)
+            checkpoint.state['ils'] = {'tag': tag, 'restart': k+2, 'home_base': home_base, 'best_ever': best_ever,
+                                       'var_title': var_title, 'log_size': log_size(file_name) if output_to_file else 0}
+            checkpoint.save(evaluator.cache, surrogate)
     return best_ever
 
 def N_Party_Platforms():
@@ -0,0 +1,112 @@
+'''
+Compiled period kernels for VectorModel's 'jit' backend.
+
+Each kernel loops over the (sims x agents) arrays VectorModel keeps, doing per agent what the
+'numpy' backend does with whole-array operations, in the same order and with the same draws,
+so both backends give identical results from the same seed (see vector_model.compare_backends).
+Per simulation sums (avg harvest, fines, total felicity) stay in VectorModel for the same reason.
+
+Numba is optional: without it njit leaves the functions as they are and the kernels run as plain Python.
+'''
+try:
+  from numba import njit
+  HAVE_NUMBA = True
+except ImportError:
+  HAVE_NUMBA = False
+  def njit(*args, **kwargs):
+    '''Stands in for numba.njit when numba is missing.'''
+    def decorate(fnc):
+      return fnc
+    return decorate
+
+
+@njit(cache = True)
+def choose_actions(mem, tie_keys, exploring, explore, explore_draws, out):
+  '''Writes each agent's chosen action position (for one action dimension) into out.
+     Exploit ~ the highest attraction, ties going to the largest tie key.
+     Explore (where explore is True) ~ the first action whose cumulative squared attraction exceeds
+     explore_draws * the total, as random.choices does.'''
+  sims, agents, actions = mem.shape
+  for s in range(sims):
+    for n in range(agents):
+      if exploring and explore[s, n]:
+        total = 0.0
+        for a in range(actions):
+          total += mem[s, n, a]*mem[s, n, a]
+        target = explore_draws[s, n] * total
+        cum = 0.0
+        pick = 0
+        for a in range(actions):
+          cum += mem[s, n, a]*mem[s, n, a]
+          if cum > target:
+            pick = a
+            break
+      else:
+        best_score = mem[s, n, 0]
+        for a in range(1, actions):
+          if mem[s, n, a] > best_score:
+            best_score = mem[s, n, a]
+        best_key = -1.0
+        pick = 0
+        for a in range(actions):
+          if mem[s, n, a] == best_score and tie_keys[s, n, a] > best_key:
+            best_key = tie_keys[s, n, a]
+            pick = a
+      out[s, n] = pick
+
+
+@njit(cache = True)
+def agent_payoffs(sheep, alpha, beta, has_fines, fine_table, sim_policy, spatial, seen, payoff, fines):
+  '''Writes each agent's harvest payoff (own sheep less the negative externality, as
+     Model._calc_externality) and the fine it owes this period (only if seen, when spatial).'''
+  sims, agents = sheep.shape
+  for s in range(sims):
+    total_sheep = 0
+    for n in range(agents):
+      total_sheep += sheep[s, n]
+    avg_sheep = total_sheep/agents
+    externality = alpha * avg_sheep + beta * (avg_sheep * avg_sheep)
+    for n in range(agents):
+      payoff[s, n] = sheep[s, n] - externality
+      if has_fines and (seen[s, n] or not spatial):
+        fines[s, n] = fine_table[sim_policy[s], sheep[s, n]]
+      else:
+        fines[s, n] = 0.0
+
+
+@njit(cache = True)
+def mix_felicity(selfish_felicity, total_felicity, altruism, out):
+  '''Writes each agent's felicity: its own, or for altruists a mix with the simulation's total.'''
+  sims, agents = selfish_felicity.shape
+  for s in range(sims):
+    for n in range(agents):
+      if altruism[n] > 0:
+        out[s, n] = (altruism[n] * total_felicity[s]) + ((1-altruism[n]) * selfish_felicity[s, n])
+      else:
+        out[s, n] = selfish_felicity[s, n]
+
+
+@njit(cache = True)
+def learn(mem, freq, chosen, update, r, recency_bias, similar, sim_weight):
+  '''Updates, for the agents flagged in update, the attraction of their chosen action
+     (running average, or recency weighted if recency_bias != 0) and, if similar,
+     partially credits the neighbouring actions with the pre-update attraction.'''
+  sims, agents, actions = mem.shape
+  for s in range(sims):
+    for n in range(agents):
+      if not update[s, n]:
+        continue
+      c = chosen[s, n]
+      existing_score = mem[s, n, c]
+      freq[s, n, c] += 1
+      f = freq[s, n, c]
+      if recency_bias != 0:
+        mem[s, n, c] = (1-recency_bias)*existing_score + (recency_bias)*r[s, n]
+      else:
+        mem[s, n, c] = ((f-1)/f)*existing_score + (1/f)*r[s, n]
+      if similar:
+        for nbr in (c - 1, c + 1):
+          if nbr >= 0 and nbr < actions:
+            freq[s, n, nbr] += sim_weight
+            f_n = freq[s, n, nbr]
+            mem[s, n, nbr] = ((f_n - sim_weight)/f_n)*existing_score + (sim_weight/f_n)*r[s, n]
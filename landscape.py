@@ -0,0 +1,63 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+class PositionIndex():
+  '''
+  Sorted record of every agent's position on the 1D landscape, kept up to date as agents move.
+  Lets the model count agents within a distance of a point in O(log N), instead of scanning everyone.
+  '''
+  def __init__(self, positions):
+    self.sorted_pos = sorted(positions)
+
+  def move(self, old_pos, new_pos):
+    '''Updates the index for one agent moving from old_pos to new_pos.'''
+    del self.sorted_pos[bisect_left(self.sorted_pos, old_pos)]
+    insort(self.sorted_pos, new_pos)
+
+  def count_within(self, pos, dist):
+    '''Returns how many agents are at most dist away from pos (including any agent at pos).'''
+    return bisect_right(self.sorted_pos, pos + dist) - bisect_left(self.sorted_pos, pos - dist)
+
+
+class FreeCells():
+  '''
+  The unoccupied cells of a landscape with cells 0..landscape_size-1, kept in an array with swap-remove,
+  so drawing a uniformly random free cell and occupying/vacating a cell are all O(1).
+  Positions outside the landscape (possible for initial positions) are counted but never free.
+  '''
+  def __init__(self, landscape_size, positions):
+    self.landscape_size = landscape_size
+    self.cells = list(range(landscape_size)) #cells[:] are the free cells, in no particular order
+    self.slot = list(range(landscape_size)) #slot[c] is where cell c sits in cells (if free)
+    self.occupants = {}
+    for pos in positions:
+      self.occupy(pos)
+
+  def set_order(self, cells):
+    '''Puts the free cells in the given order (eg. a snapshot's), so later samples match.'''
+    self.cells = list(cells)
+    for i, c in enumerate(self.cells):
+      self.slot[c] = i
+
+  def sample(self, u):
+    '''Maps u ~ U[0,1) to a uniformly random unoccupied cell (IndexError if there is none).'''
+    return self.cells[int(u*len(self.cells))]
+
+  def occupy(self, pos):
+    '''Records an agent arriving at pos.'''
+    self.occupants[pos] = self.occupants.get(pos, 0) + 1
+    if self.occupants[pos] == 1 and 0 <= pos < self.landscape_size:
+      #Swap-remove pos from the free cells:
+      last = self.cells[-1]
+      self.cells[self.slot[pos]] = last
+      self.slot[last] = self.slot[pos]
+      self.cells.pop()
+
+  def vacate(self, pos):
+    '''Records an agent leaving pos.'''
+    self.occupants[pos] -= 1
+    if self.occupants[pos] == 0:
+      del self.occupants[pos]
+      if 0 <= pos < self.landscape_size:
+        self.slot[pos] = len(self.cells)
+        self.cells.append(pos)
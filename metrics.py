@@ -0,0 +1,213 @@
+'''
+Online accumulators for the per period series a model tracks (avg_felicity, monitoring_rate).
+Each takes add(value, count) ~ value observed for count periods in a row (count > 1 when a model
+fast forwards), works on floats and on VectorModel's (sims,) arrays alike, gives the latest value
+as last, and summarises itself with result().
+Models are handed factories (the class, or a functools.partial of it) so each model gets its own.
+get_state()/set_state() give and take an accumulator's contents as a dict of numpy arrays (for Model snapshots).
+'''
+
+from collections import deque
+import numpy as np
+
+
+def _opt(value):
+  '''An optional value (eg. last, None before the first add) as a 0 or 1 element array.'''
+  return np.array([] if value is None else [value])
+
+
+def _from_opt(array):
+  return array.tolist()[0] if len(array) else None
+
+
+class History(list):
+  '''Every value, in order (a plain list, as models have always kept). O(periods) memory.'''
+  def add(self, value, count = 1):
+    if count == 1:
+      self.append(value)
+    else:
+      self.extend([value]*count)
+
+  @property
+  def last(self):
+    return self[-1]
+
+  def result(self):
+    return {'history': list(self)}
+
+  def get_state(self):
+    return {'values': np.array(self, dtype = float)}
+
+  def set_state(self, state):
+    self[:] = state['values'].tolist()
+
+
+class RunningMean():
+  '''Mean of all values so far, in O(1) memory.'''
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.last = None
+
+  def add(self, value, count = 1):
+    self.count += count
+    self.mean = self.mean + (value - self.mean)*(count/self.count)
+    self.last = value
+
+  def result(self):
+    return {'count': self.count, 'mean': self.mean}
+
+  def get_state(self):
+    return {'count': np.array(self.count), 'mean': np.array(self.mean), 'last': _opt(self.last)}
+
+  def set_state(self, state):
+    self.count, self.mean, self.last = state['count'].item(), state['mean'].item(), _from_opt(state['last'])
+
+
+class Welford():
+  '''Mean and (sample) variance of all values so far by Welford's method, in O(1) memory.
+     A value repeated count times is merged in as one block (Chan et al.'s parallel update).'''
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.last = None
+
+  def add(self, value, count = 1):
+    total = self.count + count
+    delta = value - self.mean
+    self.mean = self.mean + delta*(count/total)
+    self.m2 = self.m2 + delta*delta*(self.count*count/total)
+    self.count = total
+    self.last = value
+
+  def result(self):
+    var = self.m2/(self.count - 1) if self.count > 1 else 0.0*self.m2
+    return {'count': self.count, 'mean': self.mean, 'var': var}
+
+  def get_state(self):
+    return {'count': np.array(self.count), 'mean': np.array(self.mean), 'm2': np.array(self.m2), 'last': _opt(self.last)}
+
+  def set_state(self, state):
+    self.count, self.mean, self.m2 = state['count'].item(), state['mean'].item(), state['m2'].item()
+    self.last = _from_opt(state['last'])
+
+
+class RingBuffer():
+  '''The last size values, in O(size) memory.'''
+  def __init__(self, size = 1000):
+    self.values = deque(maxlen = size)
+    self.last = None
+
+  def add(self, value, count = 1):
+    self.values.extend([value]*min(count, self.values.maxlen))
+    self.last = value
+
+  def result(self):
+    return {'window': np.array(self.values)}
+
+  def get_state(self):
+    return {'values': np.array(self.values, dtype = float), 'last': _opt(self.last)}
+
+  def set_state(self, state):
+    self.values.clear()
+    self.values.extend(state['values'].tolist())
+    self.last = _from_opt(state['last'])
+
+
+class Decimated():
+  '''Every every-th value (periods 0, every, 2*every, ...), in O(periods/every) memory.'''
+  def __init__(self, every = 100):
+    self.every = every
+    self.count = 0
+    self.periods = []
+    self.values = []
+    self.last = None
+
+  def add(self, value, count = 1):
+    first = -(-self.count // self.every)*self.every #First multiple of every at or after count
+    for period in range(first, self.count + count, self.every):
+      self.periods.append(period)
+      self.values.append(value)
+    self.count += count
+    self.last = value
+
+  def result(self):
+    return {'periods': list(self.periods), 'values': np.array(self.values)}
+
+  def get_state(self):
+    return {'count': np.array(self.count), 'periods': np.array(self.periods, dtype = np.int64),
+            'values': np.array(self.values, dtype = float), 'last': _opt(self.last)}
+
+  def set_state(self, state):
+    self.count = state['count'].item()
+    self.periods = state['periods'].tolist()
+    self.values = state['values'].tolist()
+    self.last = _from_opt(state['last'])
+
+
+class MetricSet():
+  '''Several accumulators fed the same series.'''
+  def __init__(self, accumulators):
+    self.accumulators = accumulators
+    self.last = None
+
+  def add(self, value, count = 1):
+    for acc in self.accumulators:
+      acc.add(value, count)
+    self.last = value
+
+  def result(self):
+    results = {}
+    for acc in self.accumulators:
+      results.update(acc.result())
+    return results
+
+  def get_state(self):
+    state = {'last': _opt(self.last)}
+    for i, acc in enumerate(self.accumulators):
+      state.update({f'{i}.{k}': v for k, v in acc.get_state().items()})
+    return state
+
+  def set_state(self, state):
+    for i, acc in enumerate(self.accumulators):
+      acc.set_state({k[len(f'{i}.'):]: v for k, v in state.items() if k.startswith(f'{i}.')})
+    self.last = _from_opt(state['last'])
+
+
+class Untracked():
+  '''Keeps only the latest value.'''
+  def __init__(self):
+    self.last = None
+
+  def add(self, value, count = 1):
+    self.last = value
+
+  def result(self):
+    return {}
+
+  def get_state(self):
+    return {'last': _opt(self.last)}
+
+  def set_state(self, state):
+    self.last = _from_opt(state['last'])
+
+
+DEFAULT_METRICS = {'avg_felicity': History, 'monitoring_rate': History}
+
+
+def build_metrics(metrics = None, default = History):
+  '''Makes a model's accumulators from a dict of series name: factory (or a list of factories, or None to not track it).
+     Series left out are kept by default (the full History, unless eg. Untracked is given).'''
+  spec = {name: default for name in DEFAULT_METRICS}
+  if metrics:
+    spec.update(metrics)
+  built = {}
+  for name, factory in spec.items():
+    if factory is None:
+      built[name] = Untracked()
+    elif isinstance(factory, (list, tuple)):
+      built[name] = MetricSet([f() for f in factory])
+    else:
+      built[name] = factory()
+  return built
@@ -1,6 +1,13 @@
 from agent import Shepherd
-from random import uniform, randint, shuffle
+from landscape import PositionIndex, FreeCells
+from random_streams import UniformStream
+from datafile import open_datafile, SPATIAL_COLUMNS, NON_SPATIAL_COLUMNS
+from metrics import build_metrics, History
 from copy import copy, deepcopy
+import numpy as np
+import json
+
+SNAPSHOT_VERSION = 1
 
 
 class Model():
@@ -16,11 +23,24 @@ class Model():
     - 'init_pos' ~ determines the agent's initial position if spatial component.
                    can give a particular init_pos value, or can specify 'random' to draw from U[min,max]
     - 'action_set' ~ a dict of dictionaries w/ format var_name:{min, max, and discrete}.
+  - self.data_to_output ~ a dictionary which says what to write out:
+    - 'tag' ~ prefix of the datafile name.
+    - 'files' ~ 'per_period' writes every agent's state every period, 'final' only at the end of the run.
+    - 'format' ~ 'csv' (default), 'npy' or 'parquet' (see datafile.BufferedDatafile), or 'trajectory' for
+                 run-length encoded agent columns (see datafile.TrajectoryLog).
+    - 'buffer_rows' ~ how many rows are held before writing them out (65536 by default).
+  - rng ~ the numpy Generator (or a seed/SeedSequence to make one from) all of the model's randomness comes from.
+          None draws fresh entropy. Explore rolls and tie breaks are drawn from it a block of periods at a time.
+  - metrics ~ how the per period series self.avg_felicity and self.monitoring_rate are kept: a dict of
+              series name: accumulator factory from metrics.py (eg. metrics.Welford), a list of them, or None
+              to keep only the latest value. By default both keep their full history (a list).
+  - metric_default ~ the factory for the series metrics leaves out (History; eg. metrics.Untracked where
+                     no one reads the series, so they take O(1) memory).
   """
 
   def __init__(self, agent_count, game_variables, agent_variables, data_to_output = {},
                 verbose_variables = [], fine_vector = None, run = 0, social_planner_vars = None,
-                store_attraction_snapshots = []):
+                store_attraction_snapshots = [], rng = None, metrics = None, metric_default = History):
     self.game_variables = game_variables
     if 'return_type' not in game_variables:
       self.game_variables['return_type'] == 'negative_externality'
@@ -31,16 +51,18 @@ class Model():
     self.agent_variables = agent_variables
     self.social_planner_vars = social_planner_vars
     self.action_names = [i for i in self.agent_variables['action_set'].keys()]
+    self.spatial = 'move_if_seen' in self.action_names
     self.verbose_variables = verbose_variables
     self.fine_vector = fine_vector
     self.period = 0
     self.agent_count = agent_count
     self.data_to_output = data_to_output
-    self.monitoring_rate = []
+    tracked = build_metrics(metrics, metric_default)
+    self.monitoring_rate = tracked['monitoring_rate']
     self.avg_lifetime_harvest = 0
     self.avg_lifetime_fines = 0
     self.avg_lifetime_harvest_w_fines = 0
-    self.avg_felicity = []
+    self.avg_felicity = tracked['avg_felicity']
     self.avg_social_welfare = 0
     self.run = run
     self.converged = False
@@ -71,6 +93,9 @@ class Model():
       self.max_payoff = max_sheep - self._calc_externality(max_sheep)
     #print(f'Minimum payoff is: {self.min_payoff}')
     #print(f'Maximum payoff is: {self.max_payoff}')
+    self.rng = np.random.default_rng(rng)
+    #Uniform draws for roughly 256 periods at a time (an explore roll and a draw per action for each agent):
+    self.uniform = UniformStream(self.rng, 256*self.agent_count*(1 + len(self.action_names)))
     self.agents = {}
     if 'landscape_size' in self.game_variables:
       upper_range = self.game_variables['landscape_size']
@@ -78,19 +103,68 @@ class Model():
     else:
       upper_range = 0
     #Creating Agents:
+    init_positions = self.rng.integers(0, upper_range+2, size = self.agent_count).tolist() #U{0,...,upper_range+1}
     for id in range(self.agent_count):
-      self.agents[id] = Shepherd(aid = id, agent_variables = agent_variables, init_pos = randint(0,upper_range+1),
+      self.agents[id] = Shepherd(aid = id, agent_variables = agent_variables, init_pos = init_positions[id],
                                  landscape_size = self.game_variables['landscape_size'], min_payoff = self.min_payoff,
                                  max_payoff = self.max_payoff, model = self)
+    #Spatial index of agent positions and the free cells left, kept up to date by move_agent:
+    self.position_index = PositionIndex([a.pos for a in self.agents.values()])
+    self.free_cells = FreeCells(self.game_variables['landscape_size'], [a.pos for a in self.agents.values()])
+    self.agent_list = list(self.agents.values())
+    #One buffered datafile for the model's life, opened by the first update_datafile (so a model that is never
+    #run holds no file handle):
+    self.output_files = self.data_to_output.get('files', [])
+    self.writes_datafile = 'per_period' in self.output_files or 'final' in self.output_files
+    self.datafile = None
+    #The phases step() runs, fixed once for this configuration:
+    self.step_plan = self._build_step_plan()
+
+  def _build_step_plan(self):
+    '''Picks the phase functions this model's configuration needs, in the order step() runs them,
+       so the per period loop never re-checks spatial/fines/transfers/verbose settings.'''
+    plan = []
+    if self.store_attraction_snapshots:
+      plan.append(self._take_snapshot)
+    plan.append(self._decide_strategies)
+    if self.spatial:
+      plan.append(self._move_agents)
+      plan.append(self._update_seen)
+    plan.append(self._graze)
+    plan.append(self.calculate_harvests)
+    if not self.fine_vector:
+      plan.append(self._apply_no_fines)
+    elif self.spatial:
+      plan.append(self._apply_fines_if_seen)
+    else:
+      plan.append(self._apply_fines)
+    if self.fine_vector and self.transfers:
+      plan.append(self._apply_transfers)
+    plan.append(self._evaluate)
+    plan.append(self.calc_social_welfare)
+    if self.spatial:
+      plan.append(self._take_stock_spatial)
+    else:
+      plan.append(self._take_stock)
+    if self.verbose_variables:
+      plan.append(self.print_output)
+    if 'per_period' in self.output_files:
+      plan.append(self.update_datafile)
+    plan.append(self._end_period)
+    return plan
+
+  def move_agent(self, agent, new_pos):
+    '''Relocates agent to new_pos, updating the position index and free cells.'''
+    self.free_cells.occupy(new_pos)
+    self.free_cells.vacate(agent.pos)
+    self.position_index.move(agent.pos, new_pos)
+    agent.pos = new_pos
 
   def is_agent_seen(self, agent):
-    '''Determines if a particular agent is visible to other agents this period.'''
-    agent_seen = False
-    for other_a in self.agents.values(): 
-      dist = abs(other_a.pos - agent.pos)
-      if other_a.id != agent.id and dist <= other_a.agent_variables['vision']:
-        agent_seen = True
-    return agent_seen
+    '''Determines if a particular agent is visible to other agents this period.
+       All agents share agent_variables, so everyone has the same vision and an agent is seen
+       exactly when someone else stands within vision of it.'''
+    return self.position_index.count_within(agent.pos, self.agent_variables['vision']) > 1
 
   def _calc_externality(self, total_sheep):
     '''Returns the payoff per sheep as a function of total sheep.'''
@@ -108,54 +182,69 @@ class Model():
     for agent in self.agents.values():
       agent.period_payoff = agent.period_choices['sheep_count'] - externality
       total_period_harvest += agent.period_payoff
-    self.avg_lifetime_harvest += (total_period_harvest / self.agent_count)
+    self.avg_period_harvest = total_period_harvest / self.agent_count
+    self.avg_lifetime_harvest += self.avg_period_harvest
 
-  def apply_fines(self):
-    '''Determines fines (if any) applied to each agent as a function of sheepcount choice.'''
+  def _apply_no_fines(self):
+    '''No fine vector: nothing to collect this period.'''
     self.avg_period_fines = 0
-    if self.fine_vector:
-      #1. Applying fines
-      for a in self.agents.values():
-        if ('move_if_seen' in self.action_names and a.seen) or 'move_if_seen' not in self.action_names:
-          fine = self.fine_vector[a.period_choices['sheep_count']]
-          a.period_payoff -= fine
-          self.avg_period_fines -= fine
-      #2. Redistributing if transfers
-      if self.transfers:
-        for a in self.agents.values():
-          a.period_payoff -= self.transfers*self.avg_period_fines #This is - because avg fines are negative.
-    #3. Updating lifetime fines var
+
+  def _apply_fines(self):
+    '''Fines every agent as a function of sheepcount choice (non-spatial, so everyone is seen).'''
+    self.avg_period_fines = 0
+    for a in self.agent_list:
+      fine = self.fine_vector[a.period_choices['sheep_count']]
+      a.period_payoff -= fine
+      self.avg_period_fines -= fine
+    self.avg_lifetime_fines += (self.avg_period_fines/self.agent_count)
+
+  def _apply_fines_if_seen(self):
+    '''Fines the agents seen this period as a function of sheepcount choice.'''
+    self.avg_period_fines = 0
+    for a in self.agent_list:
+      if a.seen:
+        fine = self.fine_vector[a.period_choices['sheep_count']]
+        a.period_payoff -= fine
+        self.avg_period_fines -= fine
     self.avg_lifetime_fines += (self.avg_period_fines/self.agent_count)
-    
+
+  def _apply_transfers(self):
+    '''Redistributes the share transfers of the fines collected this period to everyone.'''
+    for a in self.agent_list:
+      a.period_payoff -= self.transfers*self.avg_period_fines #This is - because avg fines are negative.
 
   def calc_total_selfish_felicity(self):
     '''Takes each agent felicity from own consumption only and adds them up.'''
     total_selfish_felicity = 0
-    for agent in self.agents.values():
+    for agent in self.agent_list:
       total_selfish_felicity += agent.period_selfish_felicity
     return total_selfish_felicity
 
   def calc_social_welfare(self):
     '''Takes each agent felicity (including altruism payoffs) and adds them up.'''
     sw = 0
-    for agent in self.agents.values():
+    for agent in self.agent_list:
       sw += agent.period_felicity
-      self.period_total_felicity = sw
+    self.period_total_felicity = sw
     return sw
 
-  def take_stock(self):
-    '''Updates/calculates a few values for storage/outputting.'''
-    #Calculating period monitoring rate:
+  def _take_stock(self):
+    '''Updates/calculates a few values for storage/outputting (non-spatial, so no one is monitored).'''
+    avg_felicity = self.period_total_felicity / self.agent_count
+    self.avg_felicity.add(avg_felicity)
+    self.avg_social_welfare += avg_felicity
+    self.monitoring_rate.add(0.0)
+
+  def _take_stock_spatial(self):
+    '''Updates/calculates a few values for storage/outputting, including the period monitoring rate.'''
     p_seen = 0
-    for a in self.agents.values():
-      if 'move_if_seen' in self.action_names:
-        p_seen += int(a.seen == True)
-    p_seen = p_seen / len(self.agents)
-    #Storing the values:
+    for a in self.agent_list:
+      p_seen += int(a.seen == True)
+    p_seen = p_seen / self.agent_count
     avg_felicity = self.period_total_felicity / self.agent_count
-    self.avg_felicity.append(avg_felicity)
+    self.avg_felicity.add(avg_felicity)
     self.avg_social_welfare += avg_felicity
-    self.monitoring_rate.append(p_seen)
+    self.monitoring_rate.add(p_seen)
 
   def print_output(self):
     '''Allows for printing of output for debugging/analysis purposes.'''
@@ -187,23 +276,36 @@ class Model():
           print(f'    {name}: {strat}')
 
   def update_datafile(self, last = False):
-    '''Creates and updates all datafiles requested.'''
-    if 'per_period' or 'final' in self.data_to_output['files']:
-      if self.period == 0 and self.run == 0:
-        file = open(f'{self.tag}_data.txt','w')
-        if 'move_if_seen' in self.action_names:
-          file.write(f'run,period,agent_count,landscape_size,pop_density,agent_id,position,move_if_seen,best_move_if_seen,move_if_unseen,best_move_if_unseen,sheep_count_if_seen,best_sheep_count_if_seen,sheep_count_if_unseen,best_sheep_count_if_unseen,avg_social_welfare,payoff,avg_period_felicity,monitored,monitoring_rate\n')
-        else:
-          file.write(f'run,period,agent_count,landscape_size,agent_id,sheep_count_if_seen,best_sheep_count_if_seen,payoff,avg_period_felicity,avg_social_welfare\n')
+    '''Adds this period's rows to the datafile requested (every period for 'per_period', and once at the end
+       for 'final'), and closes it once the run is over (last).'''
+    if not self.writes_datafile:
+      return
+    if self.datafile is None:
+      self.datafile = open_datafile(self.tag, SPATIAL_COLUMNS if self.spatial else NON_SPATIAL_COLUMNS,
+                                    fmt = self.data_to_output.get('format', 'csv'),
+                                    buffer_rows = self.data_to_output.get('buffer_rows', 65536),
+                                    append = self.run != 0, run = self.run)
+    if 'per_period' in self.output_files or (last and 'final' in self.output_files):
+      agents = self.agent_list
+      shared = {'run': self.run, 'period': self.period, 'agent_count': self.agent_count,
+                'landscape_size': self.game_variables['landscape_size'], 'agent_id': [a.id for a in agents],
+                'payoff': [a.period_payoff for a in agents], 'avg_period_felicity': self.avg_felicity.last,
+                'avg_social_welfare': self.avg_social_welfare}
+      if self.spatial:
+        acts = ['move_if_seen', 'move_if_unseen', 'sheep_count_if_seen', 'sheep_count_if_unseen']
       else:
-        endpoint_update = last and 'final' in self.data_to_output['files']
-        if 'per_period' in self.data_to_output['files'] or endpoint_update: 
-          file = open(f'{self.tag}_data.txt','a')
-          for a in self.agents.values():
-            if 'move_if_seen' in self.action_names:
-              file.write(f'{self.run},{self.period},{self.agent_count},{self.game_variables["landscape_size"]},{self.density},{a.id},{a.pos},{a.period_strategy["move_if_seen"]},{a.memory["move_if_seen"].index(max(a.memory["move_if_seen"]))},{a.period_strategy["move_if_unseen"]},{a.memory["move_if_unseen"].index(max(a.memory["move_if_unseen"]))},{a.period_strategy["sheep_count_if_seen"]},{a.memory["sheep_count_if_seen"].index(max(a.memory["sheep_count_if_seen"]))},{a.period_strategy["sheep_count_if_unseen"]},{a.memory["sheep_count_if_unseen"].index(max(a.memory["sheep_count_if_unseen"]))},{self.avg_social_welfare},{a.period_payoff},{self.avg_felicity[-1]},{a.seen},{self.monitoring_rate[-1]}\n')
-            else:
-              file.write(f'{self.run},{self.period},{self.agent_count},{self.game_variables["landscape_size"]},{a.id},{a.period_strategy["sheep_count_if_seen"]},{a.memory["sheep_count_if_seen"].index(max(a.memory["sheep_count_if_seen"]))},{a.period_payoff},{self.avg_felicity[-1]},{self.avg_social_welfare}\n')
+        acts = ['sheep_count_if_seen']
+      for act in acts:
+        shared[act] = [a.period_strategy[act] for a in agents]
+        shared[f'best_{act}'] = [a.attraction_trees[act].sample_max(0) for a in agents] #First of the best scoring actions
+      if self.spatial:
+        shared.update({'pop_density': self.density, 'position': [a.pos for a in agents],
+                       'monitored': [a.seen for a in agents], 'monitoring_rate': self.monitoring_rate.last})
+      self.datafile.add_rows(self.agent_count, **shared)
+    if last:
+      self.datafile.close()
+      self.datafile = None
+      self.writes_datafile = False #The run is over
 
   def collect_agent_attractions(self):
     '''Collect average agent attraction per snapshot.'''
@@ -218,53 +320,203 @@ class Model():
         else:
           self.attraction_snaps[self.period][k] += v/len(temp_list)
           
-  def step(self):
+  def is_absorbing(self):
+    '''True once the (non-spatial) game is locked in: no one explores again, every agent's choice stays its
+       strict best, so the same choices, payoffs and felicities repeat every remaining period.'''
+    if self.spatial or 'per_period' in self.data_to_output.get('files', []):
+      return False
+    for agent in self.agents.values():
+      if not agent.is_locked_in():
+        return False
+    return True
+
+  def fast_forward(self, periods):
+    '''Closes form up to periods repeats of the current (absorbing) period instead of stepping through them.
+       Stops short of any requested attraction snapshot so step() can still take it. Returns periods skipped.'''
+    upcoming_snaps = [p for p in self.store_attraction_snapshots if p >= self.period]
+    if upcoming_snaps:
+      periods = min(periods, min(upcoming_snaps) - self.period)
+    if periods <= 0:
+      return 0
+    for agent in self.agents.values():
+      agent.fast_forward(periods)
+    avg_felicity = self.avg_felicity.last
+    self.avg_lifetime_harvest += periods*self.avg_period_harvest
+    self.avg_lifetime_fines += periods*(self.avg_period_fines/self.agent_count)
+    self.avg_social_welfare += periods*avg_felicity
+    self.avg_felicity.add(avg_felicity, periods)
+    self.monitoring_rate.add(self.monitoring_rate.last, periods)
+    self.period += periods
+    self.converged = True
+    return periods
+
+  def learned_state(self):
+    '''Returns the agents' learned state (attractions, choice frequencies, explore rates), their positions
+       and the period, for another model to continue from with resume_learning.'''
+    return {'period': self.period, 'positions': [a.pos for a in self.agent_list],
+            'agents': [a.learned_state() for a in self.agent_list]}
+
+  def resume_learning(self, state):
+    '''Starts this model's agents from a learned_state of another model (eg. one run under the parent policy),
+       so they adapt to this model's policy instead of learning from scratch. The learning schedule carries on
+       from the state's period, while welfare and the other accumulators count from here.'''
+    for agent, pos, learned in zip(self.agent_list, state['positions'], state['agents']):
+      agent.load_learned_state(**learned)
+      agent.pos = pos
+    self.position_index = PositionIndex(state['positions'])
+    self.free_cells = FreeCells(self.game_variables['landscape_size'], state['positions'])
+    self.period = state['period']
+
+  def snapshot(self):
+    '''Returns the model's full dynamic state as a dict of numpy arrays (no pickled objects): period and lifetime
+       accumulators, every agent's attractions, choice frequencies, explore rate, position and this period's
+       strategy/choices/payoffs, the free cell order, the tracked series, and the Generator's state with the
+       draws of the current block not yet used. Loading it into a model with the same configuration
+       (load_snapshot) continues the run exactly as this model would have.'''
+    agents = self.agent_list
+    stepped = hasattr(self, 'avg_period_harvest')
+    snap = {'version': np.array(SNAPSHOT_VERSION), 'period': np.array(self.period, dtype = np.int64),
+            'stepped': np.array(stepped), 'converged': np.array(self.converged),
+            'lifetime': np.array([self.avg_lifetime_harvest, self.avg_lifetime_fines, self.avg_lifetime_harvest_w_fines,
+                                  self.avg_social_welfare], dtype = float),
+            'rng_state': np.array(json.dumps(self.rng.bit_generator.state)),
+            'uniform_pending': np.array(self.uniform.pending(), dtype = float),
+            'explore_rate': np.array([a.explore_rate for a in agents], dtype = float),
+            'position': np.array([a.pos for a in agents], dtype = np.int64),
+            'lifetime_felicity': np.array([a.lifetime_felicity for a in agents], dtype = float),
+            'free_cells': np.array(self.free_cells.cells, dtype = np.int64),
+            'attraction_snaps': np.array(json.dumps(self.attraction_snaps))}
+    for act in self.action_names:
+      snap[f'memory.{act}'] = np.array([a.memory[act] for a in agents], dtype = float)
+      freq = [a.choice_freq[act] for a in agents]
+      snap[f'choice_freq.{act}'] = np.array(freq) #int64 unless similarity made some fractional
+      if stepped:
+        snap[f'strategy.{act}'] = np.array([a.period_strategy[act] for a in agents], dtype = np.int64)
+    if stepped:
+      snap['period_values'] = np.array([self.avg_period_harvest, self.avg_period_fines, self.period_total_felicity], dtype = float)
+      for name in ('period_payoff', 'period_felicity', 'period_selfish_felicity'):
+        snap[name] = np.array([getattr(a, name) for a in agents], dtype = float)
+      snap['sheep_count'] = np.array([a.period_choices['sheep_count'] for a in agents], dtype = np.int64)
+      for name in ('seen', 'seen_before_move'):
+        snap[name] = np.array([-1 if getattr(a, name) is None else int(getattr(a, name)) for a in agents], dtype = np.int8)
+      if self.spatial:
+        snap['moved'] = np.array([a.period_choices['moved'] for a in agents])
+    for series in ('avg_felicity', 'monitoring_rate'):
+      for k, v in getattr(self, series).get_state().items():
+        snap[f'{series}.{k}'] = v
+    return snap
+
+  def load_snapshot(self, snap):
+    '''Sets this model (built with the same configuration as the one snapshotted) to a snapshot's state.'''
+    if int(snap['version']) != SNAPSHOT_VERSION:
+      raise ValueError(f"Snapshot version {int(snap['version'])} isn't {SNAPSHOT_VERSION}")
+    agents = self.agent_list
+    self.period = int(snap['period'])
+    self.converged = bool(snap['converged'])
+    (self.avg_lifetime_harvest, self.avg_lifetime_fines, self.avg_lifetime_harvest_w_fines,
+     self.avg_social_welfare) = snap['lifetime'].tolist()
+    self.rng.bit_generator.state = json.loads(str(snap['rng_state']))
+    self.uniform.set_pending(snap['uniform_pending'].tolist())
+    positions = snap['position'].tolist()
+    for n, a in enumerate(agents):
+      for act in self.action_names:
+        for pos, value in enumerate(snap[f'memory.{act}'][n].tolist()):
+          a._set_attraction(act, pos, value)
+        a.choice_freq[act][:] = snap[f'choice_freq.{act}'][n].tolist()
+      a.explore_rate = snap['explore_rate'][n].item()
+      a.pos = positions[n]
+      a.lifetime_felicity = snap['lifetime_felicity'][n].item()
+    self.position_index = PositionIndex(positions)
+    self.free_cells = FreeCells(self.game_variables['landscape_size'], positions)
+    self.free_cells.set_order(snap['free_cells'].tolist())
+    self.attraction_snaps = {int(p): {int(k): v for k, v in probs.items()}
+                             for p, probs in json.loads(str(snap['attraction_snaps'])).items()}
+    if bool(snap['stepped']):
+      self.avg_period_harvest, self.avg_period_fines, self.period_total_felicity = snap['period_values'].tolist()
+      for n, a in enumerate(agents):
+        for act in self.action_names:
+          a.period_strategy[act] = snap[f'strategy.{act}'][n].item()
+        for name in ('period_payoff', 'period_felicity', 'period_selfish_felicity'):
+          setattr(a, name, snap[name][n].item())
+        a.period_choices['sheep_count'] = snap['sheep_count'][n].item()
+        for name in ('seen', 'seen_before_move'):
+          flag = snap[name][n].item()
+          setattr(a, name, None if flag == -1 else bool(flag))
+        if self.spatial:
+          a.period_choices['moved'] = bool(snap['moved'][n])
+    for series in ('avg_felicity', 'monitoring_rate'):
+      getattr(self, series).set_state({k[len(series) + 1:]: v for k, v in snap.items() if k.startswith(f'{series}.')})
+
+  def save_snapshot(self, path):
+    '''Writes snapshot() to path as an uncompressed .npz.'''
+    np.savez(path, **self.snapshot())
+
+  def restore_snapshot(self, path):
+    '''Loads a save_snapshot file into this model (see load_snapshot).'''
+    with np.load(path) as saved:
+      self.load_snapshot({k: saved[k] for k in saved.files})
+
+  def _take_snapshot(self):
     #Step0: Store some top of the round info
     if self.period in self.store_attraction_snapshots:
       self.collect_agent_attractions()
+
+  def _decide_strategies(self):
     #Step1: Decide strategies for the period
-    for agent in self.agents.values():
-        agent.decide_period_strategy()
-    #Step2: Apply movement part of strategies   
-    if 'move_if_seen' in self.action_names:
-      id_list = [k for k in self.agents.keys()]
-      shuffle(id_list)
-      for aid in id_list:
-        agent = self.agents[aid]
-        agent.seen_before_move = self.is_agent_seen(agent)
-        agent.apply_move_strategy()
+    for agent in self.agent_list:
+      agent.decide_period_strategy()
+
+  def _move_agents(self):
+    #Step2: Apply movement part of strategies
+    id_list = self.rng.permutation(self.agent_count).tolist()
+    for aid in id_list:
+      agent = self.agents[aid]
+      agent.seen_before_move = self.is_agent_seen(agent)
+      agent.apply_move_strategy()
+
+  def _update_seen(self):
     #Step3: Update who sees who
-    if 'move_if_seen' in self.action_names:
-      for agent in self.agents.values():
-        agent.seen = self.is_agent_seen(agent)
-    #Step4: Apply grazing part of strategy
-    if 'move_if_seen' in self.action_names:
-      for agent in self.agents.values():
-        agent.apply_sheep_strategy()
-    else:
-      for agent in self.agents.values():
-        agent.apply_sheep_strategy()
+    for agent in self.agent_list:
+      agent.seen = self.is_agent_seen(agent)
+
+  def _graze(self):
     #Step4: Apply grazing part of strategy
-    self.calculate_harvests()
-    #Step5: Fine players
-    self.apply_fines()
+    for agent in self.agent_list:
+      agent.apply_sheep_strategy()
+
+  def _evaluate(self):
     #Step6: Agents evaluate the sucess of their strategy
-    for agent in self.agents.values():
+    for agent in self.agent_list:
       agent.calc_selfish_felicity()
     total_fel = self.calc_total_selfish_felicity()
-    for agent in self.agents.values():
+    for agent in self.agent_list:
       agent.calc_felicity(total_fel)
       agent.update_memory()
-    self.calc_social_welfare()
-    #Step7: Output and prepping for next round of play
-    self.take_stock()
-    self.print_output()
-    self.update_datafile()
+
+  def _end_period(self):
     self.period += 1
 
-def run_model(model, steps):
-  for i in range(steps):
+  def step(self):
+    '''Plays one period: harvests, fines, learning and bookkeeping, as laid out in step_plan.'''
+    for phase in self.step_plan:
+      phase()
+
+def restore_model(path, **model_args):
+  '''Builds a Model from model_args (the configuration the snapshot's model was built with) and restores
+     the save_snapshot file at path into it.'''
+  model = Model(**model_args)
+  model.restore_snapshot(path)
+  return model
+
+def run_model(model, steps, fast_forward = True):
+  '''Steps the model steps times. With fast_forward, once the model reports an absorbing state
+     the remaining periods are added in closed form rather than simulated.'''
+  remaining = steps
+  while remaining > 0:
     model.step()
+    remaining -= 1
+    if fast_forward and remaining > 0 and model.is_absorbing():
+      remaining -= model.fast_forward(remaining)
   model.update_datafile(last = True)
 
 '''def run_run_model(steps, runs, model_params):
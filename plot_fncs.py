@@ -1,10 +1,14 @@
 import pandas as pd
+from datafile import read_trajectory
 from matplotlib import pyplot as plt
 import opinionated
 plt.style.use("opinionated_rc")
 
 def plot_my_stuff(in_filename, y_var, y_label, title, figname, aid = 'all'):
-    df = pd.read_csv(in_filename, sep=',')
+    if in_filename.endswith('.traj'): #Trajectory log (data_to_output format 'trajectory'), expanding only what is plotted
+        df = read_trajectory(in_filename, columns = ['period', 'agent_id', y_var])
+    else:
+        df = pd.read_csv(in_filename, sep=',')
 
     # Define a list of colors for the plot lines. You can change these as you like.
     color_list = ['#686868', '#0f203a', '#f98e31', '#a81a26', 'magenta', 'yellow', 'black']
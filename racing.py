@@ -0,0 +1,97 @@
+'''
+Racing evaluation of candidate policies: every candidate first gets a few trials, and trials are only
+added for the candidates that could still win, so clearly worse candidates stop costing full trials_per_policy runs.
+
+A candidate is dropped once, on every criterion (eg. social welfare, or each voter's welfare), the upper
+confidence bound of its mean is below the best lower bound among the other candidates still racing.
+With race_vars['keep_fraction'] set, each round also keeps at most that fraction of the field (successive halving).
+
+race_vars ~ {'initial_trials': 2, 'step_trials': 2, 'z': 2.0, 'keep_fraction': None} (these are the defaults)
+'''
+from math import sqrt, ceil, inf
+import os
+from execution import get_pool, run_flat
+
+RACE_DEFAULTS = {'initial_trials': 2, 'step_trials': 2, 'z': 2.0, 'keep_fraction': None}
+
+
+def social_welfare_criteria(trial):
+    '''Races on the trial's social welfare (for SA_hillclimb).'''
+    return [trial['social_welfare']]
+
+
+def voter_criteria(trial):
+    '''Races on each agent's welfare, so a platform is kept while any voter could still prefer it (for government.vote).'''
+    return trial['indv_welfare']
+
+
+def _bounds(values, z):
+    '''Returns the mean and half width of the confidence interval of each criterion over values (one list per trial).'''
+    n = len(values)
+    means = [sum(col)/n for col in zip(*values)]
+    if n < 2:
+        return means, [inf]*len(means)
+    half = [z*sqrt(sum((v - m)**2 for v in col)/(n - 1)/n) for col, m in zip(zip(*values), means)]
+    return means, half
+
+
+def _still_racing(racing, values, z):
+    '''Returns the positions in racing not yet beaten on every criterion.'''
+    bounds = {c: _bounds(values[c], z) for c in racing}
+    keep = []
+    for c in racing:
+        means, half = bounds[c]
+        beaten = True
+        for k in range(len(means)):
+            best_lower = max((bounds[o][0][k] - bounds[o][1][k] for o in racing if o != c), default = -inf)
+            if means[k] + half[k] >= best_lower:
+                beaten = False
+                break
+        if not beaten:
+            keep.append(c)
+    return keep
+
+
+def _race_result(trials, trials_per_policy):
+    '''Collects a candidate's trial outputs into a run_run_model style output, with iw scaled to trials_per_policy
+       trials (as run_run_model sums it over its trials) so candidates raced for different numbers of trials compare.'''
+    n = len(trials)
+    result = {'csw': sum(t['social_welfare'] for t in trials)/n, 'trials': n}
+    if 'indv_welfare' in trials[0]:
+        result['iw'] = [sum(col)*trials_per_policy/n for col in zip(*[t['indv_welfare'] for t in trials])]
+    if 'last_act' in trials[0]:
+        result['last_act'] = [t['last_act'] for t in trials]
+    return result
+
+
+def race(candidates, trial_jobs_fnc, fitness_fnc_args, race_vars = None, criteria = social_welfare_criteria, pool = None):
+    '''Races candidates (a list of parameter dicts, eg. {'fine_vector': [...]}) with up to
+       fitness_fnc_args['trials_per_policy'] trials each, running every round's trials as one flat queue.
+    -trial_jobs_fnc ~ splits one candidate's trials into jobs (eg. scenarioV2A.run_run_model_jobs, which takes first_trial)
+    -criteria ~ maps a trial's output to the list of values candidates race on
+    Returns one run_run_model style output per candidate, in order, each with the number of trials it got under 'trials'.
+    Candidates still racing at the end get the full trials_per_policy.'''
+    race_vars = dict(RACE_DEFAULTS, **(race_vars or {}))
+    pool = pool or get_pool(os.cpu_count())
+    total = fitness_fnc_args['trials_per_policy']
+    trials = [[] for c in candidates]
+    values = [[] for c in candidates]
+    racing = list(range(len(candidates)))
+    done = 0
+    while done < total:
+        if done:
+            racing = _still_racing(racing, values, race_vars['z'])
+            if race_vars['keep_fraction'] and len(racing) > 1:
+                by_mean = sorted(racing, key = lambda c: -sum(_bounds(values[c], race_vars['z'])[0]))
+                racing = sorted(by_mean[:max(1, ceil(len(racing)*race_vars['keep_fraction']))])
+        count = min(race_vars['step_trials'] if done else race_vars['initial_trials'], total - done)
+        round_args = dict(fitness_fnc_args, first_trial = done, trials_per_policy = count)
+        candidate_jobs = [trial_jobs_fnc(**candidates[c], **round_args)[0] for c in racing]
+        for pos, job_results in run_flat(pool, candidate_jobs, [list]*len(racing)):
+            c = racing[pos]
+            for r in job_results:
+                for t in (r if isinstance(r, list) else [r]): #A batched job returns a list of trials
+                    trials[c].append(t)
+                    values[c].append(criteria(t))
+        done += count
+    return [_race_result(t, total) for t in trials]
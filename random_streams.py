@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class UniformStream():
+  '''
+  U[0,1) draws from a numpy Generator, drawn block_size at a time in one vectorized call
+  and handed out one by one, so a Model pays the Generator's call overhead once per block
+  rather than once per draw. The sequence depends only on the Generator's seed.
+  '''
+  def __init__(self, rng, block_size):
+    self.rng = rng
+    self.block_size = block_size
+    self._draws = iter(())
+
+  def next(self):
+    '''Returns the next draw, drawing a new block when this one is used up.'''
+    for u in self._draws:
+      return u
+    self._draws = iter(self.rng.random(self.block_size).tolist())
+    return next(self._draws)
+
+  def pending(self):
+    '''Returns the draws of the current block not handed out yet (leaving them to be handed out).'''
+    remaining = list(self._draws)
+    self._draws = iter(remaining)
+    return remaining
+
+  def set_pending(self, draws):
+    '''Makes draws the rest of the current block (eg. a snapshot's pending draws).'''
+    self._draws = iter(list(draws))
+
+
+def spawn_seeds(seed, n):
+  '''Returns n independent SeedSequences spawned from seed (an int, a SeedSequence, or None for fresh entropy),
+     one per replicate, so replicate r's stream depends only on seed and r.
+     Unlike SeedSequence.spawn this doesn't advance seed, so the same seed always gives the same children.'''
+  if not isinstance(seed, np.random.SeedSequence):
+    seed = np.random.SeedSequence(seed)
+  return [np.random.SeedSequence(seed.entropy, spawn_key = seed.spawn_key + (r,), pool_size = seed.pool_size)
+          for r in range(n)]
@@ -1,7 +1,12 @@
 from hillclimbing import  Iterated_Local_Search
 import time
 from model import Model, run_model
-from concurrent.futures import ProcessPoolExecutor
+from vector_model import VectorModel
+from random_streams import spawn_seeds
+from execution import get_pool
+from functools import partial
+from fidelity import spearman
+from metrics import Untracked
 import multiprocessing as mp
 import os
 
@@ -37,11 +42,15 @@ import os
 '''
 
 def model_helper_fnc(agent_count, game_variables, agent_variables, verbose_variables, fine_vector,
-                     data_to_output, social_planner_vars, steps, return_indv_welfare, return_last_act):
-    #Running the model:
+                     data_to_output, social_planner_vars, steps, return_indv_welfare, return_last_act, rng = None,
+                     metrics = None, warm_state = None, return_state = False):
+    #Running the model (continuing from another run's learned state if given):
     trial = Model(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
                         verbose_variables = verbose_variables, fine_vector = fine_vector,
-                        data_to_output = data_to_output, social_planner_vars = social_planner_vars)
+                        data_to_output = data_to_output, social_planner_vars = social_planner_vars, rng = rng,
+                        metrics = metrics, metric_default = Untracked) #Series not asked for aren't kept
+    if warm_state:
+        trial.resume_learning(warm_state)
     run_model(model = trial, steps = steps)
     #Creating desired output:
     output = {}
@@ -57,33 +66,78 @@ def model_helper_fnc(agent_count, game_variables, agent_variables, verbose_varia
                 if var_name not in output['last_act']:
                     output['last_act'][var_name] = []
                 output['last_act'][var_name].append(var_val)
+    if metrics:
+        output['metrics'] = {name: getattr(trial, name).result() for name in metrics}
+    if return_state:
+        output['state'] = trial.learned_state()
     return output
 
+def batched_model_helper_fnc(agent_count, game_variables, agent_variables, verbose_variables, fine_vector,
+                             data_to_output, social_planner_vars, steps, return_indv_welfare, return_last_act, trials,
+                             backend = 'numpy', rng = None, metrics = None):
+    '''Runs trials replicates of the model in lockstep with one VectorModel (on the given backend).
+       Returns a list with one model_helper_fnc style output per trial.'''
+    batch = VectorModel(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
+                        verbose_variables = verbose_variables, fine_vector = fine_vector,
+                        data_to_output = data_to_output, social_planner_vars = social_planner_vars, trials = trials,
+                        backend = backend, rng = rng, metrics = metrics, metric_default = Untracked)
+    run_model(model = batch, steps = steps)
+    return batch.trial_results(return_indv_welfare = return_indv_welfare, return_last_act = return_last_act)
+
 def run_run_model(agent_count, game_variables, agent_variables, verbose_variables, 
                   fine_vector, data_to_output, steps, trials_per_policy, social_planner_vars = None,
-                  return_last_act = False, return_indv_welfare = False, cores = 1):
-    '''A function which finds the expected social welfare given a policy (fine vector) fv.'''
+                  return_last_act = False, return_indv_welfare = False, cores = 1, engine = 'agent', backend = 'numpy',
+                  seed = None, metrics = None, first_trial = 0, warm_states = None, return_states = False):
+    '''A function which finds the expected social welfare given a policy (fine vector) fv.
+
+    -engine ~ 'agent' runs each trial as its own per-Shepherd Model (in parallel on the shared worker pool if cores > 1),
+              'vector' runs all trials in lockstep inside one array based VectorModel (cores is ignored).
+    -backend ~ for the vector engine, 'numpy' or 'jit' (the compiled kernels in kernels.py), see VectorModel.
+    -seed ~ root seed (int or SeedSequence) the trials' Generators are spawned from, for reproducible evaluations.
+            None draws fresh entropy.
+    -metrics ~ per period series statistics to report for each trial (under 'metrics'), as a dict of
+               series name: accumulator factory (see metrics.py and Model). Series not asked for keep only their latest value.
+    -first_trial ~ replicate number of the first trial, so more trials of a policy (eg. for eval_cache.EvalCache)
+                   continue seed's stream of replicates rather than repeating it.
+    -warm_states ~ one Model.learned_state per trial (eg. from a parent policy's run) for the trials to continue from,
+                   for steps more periods, rather than start from scratch. return_states gives back each trial's
+                   end state (under 'states') for the same use. Both need the agent engine.
+    '''
+    if (warm_states or return_states) and engine == 'vector':
+        raise ValueError("warm_states and return_states need engine = 'agent'")
+    warm_states = warm_states or [None]*trials_per_policy
     parallel = (cores > 1)
     run_results = []
-    if not parallel:
+    trial_seeds = spawn_seeds(seed, first_trial + trials_per_policy)[first_trial:]
+    if engine == 'vector':
+        run_results = batched_model_helper_fnc(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
+                        verbose_variables = verbose_variables, fine_vector = fine_vector,
+                        data_to_output = data_to_output, social_planner_vars = social_planner_vars, steps = steps,
+                        return_indv_welfare=return_indv_welfare, return_last_act=return_last_act, trials = trials_per_policy,
+                        backend = backend, rng = trial_seeds, metrics = metrics) #Each lockstep trial draws from its own Generator
+    elif not parallel:
         for r in range(trials_per_policy):
             run_results.append(model_helper_fnc(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
                         verbose_variables = verbose_variables, fine_vector = fine_vector,
                         data_to_output = data_to_output, social_planner_vars = social_planner_vars, steps = steps,
-                        return_indv_welfare=return_indv_welfare, return_last_act=return_last_act))
+                        return_indv_welfare=return_indv_welfare, return_last_act=return_last_act, rng = trial_seeds[r],
+                        metrics = metrics, warm_state = warm_states[r], return_state = return_states))
     else:
         para_results = []
-        with ProcessPoolExecutor(os.cpu_count()) as threadpool:
-            for r in range(trials_per_policy):
-                para_results.append(threadpool.submit(model_helper_fnc, agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
-                        verbose_variables = verbose_variables, fine_vector = fine_vector,
-                        data_to_output = data_to_output, social_planner_vars = social_planner_vars, steps = steps,
-                        return_indv_welfare=return_indv_welfare, return_last_act=return_last_act))
-            threadpool.shutdown(wait = True)
-            for r in para_results:
-                run_results.append(r.result())
+        pool = get_pool(os.cpu_count())
+        for r in range(trials_per_policy):
+            para_results.append(pool.submit(model_helper_fnc, agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
+                    verbose_variables = verbose_variables, fine_vector = fine_vector,
+                    data_to_output = data_to_output, social_planner_vars = social_planner_vars, steps = steps,
+                    return_indv_welfare=return_indv_welfare, return_last_act=return_last_act, rng = trial_seeds[r],
+                    metrics = metrics, warm_state = warm_states[r], return_state = return_states))
+        for r in para_results:
+            run_results.append(r.result())
     #print(f'Run Results:\n{run_results}\n\n')
-    #COLLECTING RESULTS:
+    return collect_run_results(run_results, agent_count, trials_per_policy, return_indv_welfare, return_last_act)
+
+def collect_run_results(run_results, agent_count, trials_per_policy, return_indv_welfare = False, return_last_act = False):
+    '''Reduces a policy's per-trial outputs into its csw (and iw, last_act if requested).'''
     rr_results = {}
     #Collecting avg social welfare:
     csw = 0
@@ -96,15 +150,88 @@ def run_run_model(agent_count, game_variables, agent_variables, verbose_variable
         iw = [0]*agent_count
         for pos in range(len(run_results)):
             iw = [a + b for a, b in zip(iw, run_results[pos]['indv_welfare'])]
-    rr_results['iw'] = iw
+        rr_results['iw'] = iw
     #Collecting each final action taken by players: <---- Double check this grooves with it's existing use case...
     if return_last_act:
         final_choices = []
         for pos in range(len(run_results)):
             final_choices.append(run_results[pos]['last_act'])
         rr_results['last_act'] = final_choices
+    #Collecting each trial's requested metrics:
+    if run_results and 'metrics' in run_results[0]:
+        rr_results['metrics'] = [run_results[pos]['metrics'] for pos in range(len(run_results))]
+    #Collecting each trial's end state, if requested:
+    if run_results and 'state' in run_results[0]:
+        rr_results['states'] = [run_results[pos]['state'] for pos in range(len(run_results))]
     return rr_results
 
+def run_run_model_jobs(agent_count, game_variables, agent_variables, verbose_variables,
+                       fine_vector, data_to_output, steps, trials_per_policy, social_planner_vars = None,
+                       return_last_act = False, return_indv_welfare = False, cores = 1, engine = 'agent', backend = 'numpy',
+                       seed = None, metrics = None, first_trial = 0, warm_states = None, return_states = False):
+    '''Splits run_run_model's work for one policy into independent jobs (one per trial, or one VectorModel
+       for the vector engine) for execution.run_flat, with the same seeds run_run_model would use.
+       Returns the list of (fnc, kwargs) jobs and the function reducing their results to run_run_model's output.
+       (cores is ignored: the jobs are run on whichever pool they're handed to.)'''
+    trial_seeds = spawn_seeds(seed, first_trial + trials_per_policy)[first_trial:]
+    shared = {'agent_count': agent_count, 'game_variables': game_variables, 'agent_variables': agent_variables,
+              'verbose_variables': verbose_variables, 'fine_vector': fine_vector, 'data_to_output': data_to_output,
+              'social_planner_vars': social_planner_vars, 'steps': steps, 'return_indv_welfare': return_indv_welfare,
+              'return_last_act': return_last_act, 'metrics': metrics}
+    if (warm_states or return_states) and engine == 'vector':
+        raise ValueError("warm_states and return_states need engine = 'agent'")
+    warm_states = warm_states or [None]*trials_per_policy
+    if engine == 'vector':
+        jobs = [(batched_model_helper_fnc, dict(shared, trials = trials_per_policy, backend = backend, rng = trial_seeds))]
+    else:
+        jobs = [(model_helper_fnc, dict(shared, rng = trial_seeds[r], warm_state = warm_states[r], return_state = return_states))
+                for r in range(trials_per_policy)]
+    reducer = partial(_reduce_jobs, batched = (engine == 'vector'), agent_count = agent_count, trials_per_policy = trials_per_policy,
+                      return_indv_welfare = return_indv_welfare, return_last_act = return_last_act)
+    return jobs, reducer
+
+def _reduce_jobs(job_results, batched, **collect_args):
+    '''Collects run_run_model_jobs' job results into run_run_model's output.'''
+    run_results = job_results[0] if batched else job_results
+    return collect_run_results(run_results, **collect_args)
+
+def warm_start_bias_report(parent_policy, child_policies, warm_steps, fitness_fnc_args):
+    '''Compares warm start scores (each child continuing for warm_steps from the parent policy's end of run learned states)
+       with cold start scores (each child simulated from scratch for the full steps), both from run_run_model with
+       fitness_fnc_args. Warm csw is scaled up to the full steps, so 'bias' is the mean of warm - cold.
+       Returns the scores, the bias, mean absolute bias and the Spearman rank correlation of warm with cold.'''
+    parent = run_run_model(**parent_policy, **dict(fitness_fnc_args, return_states = True))
+    warm_args = dict(fitness_fnc_args, steps = warm_steps, warm_states = parent['states'])
+    scale = fitness_fnc_args['steps']/warm_steps
+    warm = [run_run_model(**child, **warm_args)['csw']*scale for child in child_policies]
+    cold = [run_run_model(**child, **fitness_fnc_args)['csw'] for child in child_policies]
+    diffs = [w - c for w, c in zip(warm, cold)]
+    return {'warm': warm, 'cold': cold, 'bias': sum(diffs)/len(diffs), 'mean_abs_bias': sum(abs(d) for d in diffs)/len(diffs),
+            'spearman': spearman(warm, cold)}
+
+def run_run_model_batch(agent_count, game_variables, agent_variables, verbose_variables,
+                        fine_vector, data_to_output, steps, trials_per_policy, social_planner_vars = None,
+                        return_last_act = False, return_indv_welfare = False, cores = 1, engine = 'vector', backend = 'numpy',
+                        seed = None, metrics = None):
+    '''Batch version of run_run_model: fine_vector is a (policies x actions) matrix of candidate fine vectors,
+       and every trial of every candidate is simulated at once in one VectorModel.
+       Replicate t of every candidate draws from the same Generator (the t-th spawned from seed), so candidates
+       are compared on common random numbers.
+       Returns a list with run_run_model's output for each candidate, in order.
+       (cores and engine are accepted so the same fitness_fnc_args work for both, but are ignored.)'''
+    batch = VectorModel(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
+                        verbose_variables = verbose_variables, fine_vector = fine_vector,
+                        data_to_output = data_to_output, social_planner_vars = social_planner_vars, trials = trials_per_policy,
+                        backend = backend, rng = spawn_seeds(seed, trials_per_policy), metrics = metrics,
+                        metric_default = Untracked)
+    run_model(model = batch, steps = steps)
+    sim_results = batch.trial_results(return_indv_welfare = return_indv_welfare, return_last_act = return_last_act)
+    policy_results = []
+    for p in range(batch.policies):
+        run_results = sim_results[p*trials_per_policy:(p+1)*trials_per_policy]
+        policy_results.append(collect_run_results(run_results, agent_count, trials_per_policy, return_indv_welfare, return_last_act))
+    return policy_results
+
 #Game params:
 gv = {'return_type': 'negative_externality', 'landscape_size':1, 'alpha':.8, 'beta':.05} 
 #Shepherd params:
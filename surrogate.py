@@ -0,0 +1,152 @@
+'''
+A Gaussian process surrogate of the fitness landscape over policy parameters (eg. the six fine_vector entries),
+used by SA_hillclimb to over-generate candidates and simulate only those with the highest expected improvement.
+
+It learns online from every (candidate, fitness) pair the search scores, and can be warm-started from
+earlier searches' hc_log files (only logs of searches run with the same model config and steps belong together,
+as fitness is summed over periods). Independent evaluations of a policy are averaged (add), with the GP trusting
+the average more the more trials it has; an estimate that already includes or repeats earlier ones (eg. a cached
+running mean, or the same seeded trials run again) replaces them instead (update).
+'''
+from math import erf, exp, pi, sqrt
+import ast
+import glob
+import numpy as np
+
+LENGTH_SCALES = (.05, .1, .2, .4, .8, 1.6) #Tried on the [0,1] scaled parameters
+NOISE_LEVELS = (.01, .1, .3) #Tried as a fraction of the fitness variance
+
+
+def read_hc_log(path):
+    '''Returns the (policy, fitness) rows of an SA_hillclimb {tag}_hc_log.txt file.'''
+    rows = []
+    with open(path) as f:
+        next(f) #Column titles
+        for line in f:
+            if not line.startswith('{'):
+                continue
+            end = line.index('}') + 1
+            policy = ast.literal_eval(line[:end])
+            fitness = float(line[end:].split(',')[1])
+            rows.append((policy, fitness))
+    return rows
+
+
+class GPSurrogate():
+    '''
+    GP regression (squared exponential kernel, hyperparameters picked by marginal likelihood from
+    LENGTH_SCALES x NOISE_LEVELS) on param_vars' parameters scaled to [0,1].
+    -oversample ~ how many candidates SA_hillclimb rolls per one it simulates
+    -min_points ~ distinct policies needed before it ranks candidates (until then they're taken in rolled order)
+    -max_points ~ most recent distinct policies it's fitted to (the fit is O(max_points^3))
+    '''
+    def __init__(self, param_vars, oversample = 4, min_points = 5, max_points = 500, xi = 0.0):
+        self.param_vars = param_vars
+        self.oversample = oversample
+        self.min_points = min_points
+        self.max_points = max_points
+        self.xi = xi
+        self.points = {} #Scaled policy tuple: [fitness sum, count]
+        self.fitted = None
+
+    def _scale(self, policy):
+        '''Flattens a policy into its [0,1] scaled parameter tuple.'''
+        x = []
+        for name, ranges in self.param_vars.items():
+            span = (ranges['max'] - ranges['min']) or 1
+            values = policy[name] if isinstance(policy[name], (list, tuple)) else [policy[name]]
+            x.extend((v - ranges['min'])/span for v in values)
+        return tuple(x)
+
+    def add(self, policy, fitness, count = 1):
+        '''Learns a new, independent evaluation of policy, weighted by count (eg. its share of a full evaluation's trials).'''
+        key = self._scale(policy)
+        point = self.points.pop(key, [0.0, 0])
+        point[0] += fitness*count
+        point[1] += count
+        self.points[key] = point #Most recent last
+        self.fitted = None
+
+    def update(self, policy, fitness, count = 1):
+        '''Replaces what was learned of policy with fitness, an estimate that already includes or repeats
+           its earlier evaluations (eg. an EvalCache running mean), weighted by count.'''
+        key = self._scale(policy)
+        self.points.pop(key, None)
+        self.points[key] = [fitness*count, count] #Most recent last
+        self.fitted = None
+
+    def warm_start(self, paths):
+        '''Learns every row of the hc_log files matching paths (a glob pattern or a list of them).
+           Returns how many rows were read.'''
+        if isinstance(paths, str):
+            paths = [paths]
+        rows = 0
+        for pattern in paths:
+            for path in sorted(glob.glob(pattern)):
+                for policy, fitness in read_hc_log(path):
+                    self.add(policy, fitness)
+                    rows += 1
+        return rows
+
+    def get_state(self):
+        '''The learned evaluations (for search checkpoints; the fit is redone from them).'''
+        return {'points': {k: list(v) for k, v in self.points.items()}}
+
+    def set_state(self, state):
+        self.points = {k: list(v) for k, v in state['points'].items()}
+        self.fitted = None
+
+    def _fit(self):
+        '''Fits the GP to the most recent max_points policies.'''
+        keys = list(self.points.keys())[-self.max_points:]
+        X = np.array(keys)
+        counts = np.array([self.points[k][1] for k in keys], dtype = float)
+        y = np.array([self.points[k][0] for k in keys])/counts
+        y_mean, y_std = y.mean(), (y.std() or 1.0)
+        z = (y - y_mean)/y_std
+        sq_dist = ((X[:, None, :] - X[None, :, :])**2).sum(-1)
+        best = None
+        for ls in LENGTH_SCALES:
+            K = np.exp(-.5*sq_dist/ls**2)
+            for noise in NOISE_LEVELS:
+                try:
+                    L = np.linalg.cholesky(K + np.diag(noise/counts) + 1e-9*np.eye(len(z)))
+                except np.linalg.LinAlgError:
+                    continue
+                alpha = np.linalg.solve(L.T, np.linalg.solve(L, z))
+                log_lik = -.5*z @ alpha - np.log(np.diag(L)).sum()
+                if best is None or log_lik > best[0]:
+                    best = (log_lik, ls, L, alpha)
+        _, ls, L, alpha = best
+        self.fitted = {'X': X, 'L': L, 'alpha': alpha, 'ls': ls, 'y_mean': y_mean, 'y_std': y_std, 'best': y.max()}
+
+    def predict(self, policies):
+        '''Returns the predicted mean and standard deviation of each policy's fitness.'''
+        if self.fitted is None:
+            self._fit()
+        f = self.fitted
+        Xs = np.array([self._scale(p) for p in policies])
+        Ks = np.exp(-.5*((Xs[:, None, :] - f['X'][None, :, :])**2).sum(-1)/f['ls']**2)
+        mu = Ks @ f['alpha']
+        v = np.linalg.solve(f['L'], Ks.T)
+        var = np.maximum(1 - (v**2).sum(0), 1e-12)
+        return mu*f['y_std'] + f['y_mean'], np.sqrt(var)*f['y_std']
+
+    def expected_improvement(self, policies):
+        '''Returns each policy's expected improvement (maximizing) over the best mean fitness seen.'''
+        mu, sigma = self.predict(policies)
+        best = self.fitted['best'] + self.xi
+        ei = []
+        for m, s in zip(mu, sigma):
+            z = (m - best)/s
+            ei.append((m - best)*.5*(1 + erf(z/sqrt(2))) + s*exp(-.5*z*z)/sqrt(2*pi))
+        return ei
+
+    def select(self, candidates, k):
+        '''Returns the k candidates (in rolled order) with the highest expected improvement,
+           or the first k until it has min_points policies to learn from.'''
+        if len(self.points) < self.min_points or len(candidates) <= k:
+            return candidates[:k]
+        ei = self.expected_improvement(candidates)
+        best = sorted(range(len(candidates)), key = lambda c: -ei[c])[:k]
+        return [candidates[c] for c in sorted(best)]
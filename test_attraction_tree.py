@@ -0,0 +1,45 @@
+import random
+import pytest
+from attraction_tree import AttractionTree
+
+
+def random_memory(rng, size):
+  '''Attractions as Shepherds hold them: zeros, repeats (ties) and floats.'''
+  pool = [0.0, 1.0, 2.5, rng.uniform(0, 5), rng.uniform(0, 5)]
+  return [rng.choice(pool) for _ in range(size)]
+
+
+def old_exploit(memory):
+  '''The linear scan Shepherd used before the tree: the max and the tied positions in action order.'''
+  max_score = max(memory)
+  return max_score, [s for s in range(len(memory)) if memory[s] == max_score]
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 6, 11, 16])
+def test_weighted_draw_matches_random_choices(size):
+  rng = random.Random(size)
+  for trial in range(300):
+    memory = random_memory(rng, size)
+    if not any(memory):
+      continue
+    tree = AttractionTree(memory)
+    random.seed(trial)
+    expected = random.choices(range(size), weights = [m**2 for m in memory], k = 1)[0]
+    random.seed(trial)
+    assert tree.sample_weighted(random.random()) == expected
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 6, 11, 16])
+def test_best_and_tie_break_match_the_linear_scan(size):
+  rng = random.Random(size)
+  memory = random_memory(rng, size)
+  tree = AttractionTree(memory)
+  for step in range(300):
+    pos = rng.randrange(size)
+    memory[pos] = rng.choice([0.0, 2.5, max(memory), rng.uniform(0, 5)]) #Often making or breaking a tie
+    tree.update(pos, memory[pos])
+    max_score, max_positions = old_exploit(memory)
+    assert tree.best() == (max_score, len(max_positions))
+    assert [tree.sample_max(k) for k in range(len(max_positions))] == max_positions
+    others = memory[:pos] + memory[pos + 1:]
+    assert tree.max_excluding(pos) == (max(others) if others else float('-inf'))
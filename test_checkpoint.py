@@ -0,0 +1,113 @@
+import random
+import numpy as np
+import pytest
+import bundler_V0_V1_V2A
+from checkpoint import SearchCheckpoint
+from hillclimbing import SA_hillclimb, Iterated_Local_Search
+from scenarioV2A import run_run_model, run_run_model_batch
+from test_hillclimbing import FFA, GAME, AGENT, PLANNER
+
+SEARCH_VARS = {'distribution': 'normal', 'explore_range': .5}
+ILS_VARS = {'distribution': 'normal', 'explore_range': 1, 'downhill_coeff': None}
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after(monkeypatch, saves):
+    '''Makes the run stop (as if the machine went down) right after its saves-th checkpoint is written.'''
+    save = SearchCheckpoint.save
+    count = [0]
+    def crashing_save(self, *args, **kwargs):
+        save(self, *args, **kwargs)
+        count[0] += 1
+        if count[0] == saves:
+            raise Crash()
+    monkeypatch.setattr(SearchCheckpoint, 'save', crashing_save)
+
+
+def reseed():
+    random.seed(1)
+    np.random.seed(1)
+
+
+def read_logs(path):
+    return {p.name: p.read_text() for p in sorted(path.glob('*.txt'))}
+
+
+def sa(**kwargs):
+    return SA_hillclimb(PLANNER, dict(SEARCH_VARS), 3, 5, None, fitness_fnc_args = FFA, batch_fitness_fnc = run_run_model_batch,
+                        output_to_file = True, tag = 'sa', **kwargs)
+
+
+def ils(**kwargs):
+    return Iterated_Local_Search(PLANNER, dict(SEARCH_VARS), 3, 3, None, 3, dict(ILS_VARS), fitness_fnc_args = FFA,
+                                 batch_fitness_fnc = run_run_model_batch, output_to_file = True, tag = 'ils', **kwargs)
+
+
+@pytest.mark.parametrize('saves', [1, 3])
+def test_sa_resume_matches_uninterrupted(saves, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reseed()
+    whole = sa(checkpoint = SearchCheckpoint('sa_checkpoint.pkl'))
+    whole_logs = read_logs(tmp_path)
+    reseed()
+    with monkeypatch.context() as m:
+        crash_after(m, saves)
+        with pytest.raises(Crash):
+            sa(checkpoint = SearchCheckpoint('sa_checkpoint.pkl'))
+    random.seed(99) #The resumed run takes its random state from the checkpoint
+    assert sa(resume_from = 'sa_checkpoint.pkl') == whole
+    assert read_logs(tmp_path) == whole_logs
+
+
+@pytest.mark.parametrize('saves', [2, 4, 7])
+def test_ils_resume_matches_uninterrupted(saves, tmp_path, monkeypatch):
+    '''Crashes within a restart's hill climb and between restarts.'''
+    monkeypatch.chdir(tmp_path)
+    reseed()
+    whole = ils(checkpoint = SearchCheckpoint('ils_checkpoint.pkl'))
+    whole_logs = read_logs(tmp_path)
+    reseed()
+    with monkeypatch.context() as m:
+        crash_after(m, saves)
+        with pytest.raises(Crash):
+            ils(checkpoint = SearchCheckpoint('ils_checkpoint.pkl'))
+    random.seed(99)
+    assert ils(resume_from = 'ils_checkpoint.pkl') == whole
+    assert read_logs(tmp_path) == whole_logs
+
+
+def bundle(**kwargs):
+    sv = {'distribution': 'normal', 'explore_range': .5, 'cores': 2, 'hc_depth': 2}
+    ils_sv = {'distribution': 'normal', 'explore_range': 1, 'ils_depth': 2, 'downhill_coeff': None}
+    ffa = dict(FFA, steps = 50, trials_per_policy = 2)
+    return bundler_V0_V1_V2A.run_model_bundle(GAME, AGENT, [], {'files': []}, sv, ils_sv, PLANNER, ffa, tag = 'b',
+                                              finetune = True, **kwargs)
+
+
+@pytest.mark.parametrize('saves', [1, 4, 8])
+def test_bundle_resume_matches_uninterrupted(saves, tmp_path, monkeypatch):
+    '''Crashes after the no policy runs, within the search and within the fine-tune.'''
+    monkeypatch.chdir(tmp_path)
+    reseed()
+    whole = bundle(checkpoint_every = 1)
+    reseed()
+    with monkeypatch.context() as m:
+        crash_after(m, saves)
+        with pytest.raises(Crash):
+            bundle(checkpoint_every = 1)
+    random.seed(99)
+    assert bundle(resume_from = 'v2A_b_checkpoint.pkl') == whole
+
+
+def test_finished_bundle_is_not_rerun(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reseed()
+    whole = bundle(checkpoint_every = 1)
+    def no_search(*args, **kwargs):
+        raise AssertionError('a finished bundle was searched again')
+    monkeypatch.setattr(bundler_V0_V1_V2A, 'Iterated_Local_Search', no_search)
+    monkeypatch.setattr(bundler_V0_V1_V2A, '_run_no_policy', no_search)
+    assert bundle(resume_from = 'v2A_b_checkpoint.pkl') == whole
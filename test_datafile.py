@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+from datafile import BufferedDatafile, read_datafile
+from model import Model, run_model
+from test_model import CONFIGS, PLANNER
+
+COLUMNS = [('run', int), ('period', int), ('payoff', float)]
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'npy'])
+def test_sync_reaches_the_file_before_close(fmt, tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  datafile = BufferedDatafile('sync', COLUMNS, fmt = fmt, buffer_rows = 10)
+  datafile.add_rows(3, run = 0, period = [0, 1, 2], payoff = 1.5)
+  datafile.sync()
+  df = read_datafile('sync', fmt) #Read by a second handle while the writer is still open
+  assert df['period'].tolist() == [0, 1, 2]
+  assert df['payoff'].tolist() == [1.5]*3
+  datafile.close()
+
+
+@pytest.mark.parametrize('config', ['fines', 'spatial'])
+def test_trajectory_reads_back_as_the_csv_rows(config, tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  game, agent, fines = CONFIGS[config]
+  for fmt in ('csv', 'trajectory'):
+    model = Model(4, dict(game), agent, fine_vector = fines, social_planner_vars = PLANNER, rng = 2,
+                  data_to_output = {'tag': fmt, 'files': ['per_period'], 'format': fmt})
+    run_model(model, 60, fast_forward = False)
+  csv = read_datafile('csv', 'csv')
+  traj = read_datafile('trajectory', 'trajectory')
+  csv = csv.sort_values(['run', 'period', 'agent_id']).reset_index(drop = True)
+  assert list(traj.columns) == list(csv.columns)
+  pd.testing.assert_frame_equal(traj, csv, check_dtype = False)
+  some = read_datafile('trajectory', 'trajectory', columns = ['period', 'payoff'])
+  pd.testing.assert_frame_equal(some, traj[['period', 'payoff']])
@@ -0,0 +1,40 @@
+import pytest
+import execution
+from execution import get_pool, shutdown_pool
+
+
+def scaled(x, factor):
+    return x*factor
+
+
+@pytest.fixture(autouse = True)
+def no_pools():
+    shutdown_pool()
+    yield
+    shutdown_pool()
+
+
+def test_pools_are_kept_per_workers_and_config():
+    doubling = get_pool(2, config = {'factor': 2})
+    hardware = get_pool(3)
+    tripling = get_pool(2, config = {'factor': 3})
+    assert len({id(doubling), id(hardware), id(tripling)}) == 3
+    #Alternating between them (as fidelity screening and flat queues do each depth) restarts nothing:
+    for _ in range(3):
+        assert get_pool(2, config = {'factor': 2}) is doubling
+        assert get_pool(3) is hardware
+    assert get_pool(2) is doubling #Without a config, the most recently used pool with those workers
+    assert doubling.submit_with_config(scaled, x = 5).result() == 10
+    assert tripling.submit_with_config(scaled, x = 5).result() == 15
+    assert hardware.submit(scaled, 5, 4).result() == 20
+
+
+def test_least_recently_used_pool_is_stopped_past_max_pools(monkeypatch):
+    monkeypatch.setattr(execution, 'MAX_POOLS', 2)
+    first = get_pool(1, config = {'factor': 1})
+    second = get_pool(1, config = {'factor': 2})
+    assert get_pool(1, config = {'factor': 1}) is first
+    get_pool(1, config = {'factor': 3})
+    assert execution._shared_pools[0] is first and second not in execution._shared_pools
+    shutdown_pool()
+    assert not execution._shared_pools
@@ -0,0 +1,42 @@
+import math
+import numpy as np
+import pytest
+from fidelity import fidelity_report, promote, screening_args, spearman
+
+
+def test_spearman_without_ties_matches_the_rank_difference_formula():
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(size = 20), rng.normal(size = 20)
+    d = np.argsort(np.argsort(x)) - np.argsort(np.argsort(y))
+    assert spearman(x, y) == pytest.approx(1 - 6*(d**2).sum()/(20*(20**2 - 1)))
+
+
+def test_spearman_shares_ranks_between_ties():
+    x, y = [1, 2, 2, 3, 5, 5, 5], [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0]
+    rx, ry = [1, 2.5, 2.5, 4, 6, 6, 6], [4, 1.5, 5, 1.5, 6, 7, 3]
+    assert spearman(x, y) == pytest.approx(np.corrcoef(rx, ry)[0, 1])
+
+
+def test_spearman_of_monotone_and_degenerate_inputs():
+    assert spearman([1, 2, 3], [10, 200, 3000]) == pytest.approx(1.0)
+    assert spearman([1, 2, 3], [3, 2, 1]) == pytest.approx(-1.0)
+    assert math.isnan(spearman([1, 1, 1], [1, 2, 3]))
+    assert math.isnan(spearman([1], [1]))
+    report = fidelity_report([(1, 10), (2, 20), (3, 15)])
+    assert report['pairs'] == 3 and report['spearman'] == pytest.approx(.5)
+
+
+def test_promote_keeps_the_best_fraction_in_order():
+    scores = [5.0, 9.0, 1.0, 7.0, 3.0, 8.0, 2.0, 4.0]
+    assert promote(scores, {'promote': .25}) == [1, 5]
+    assert promote(scores, {'promote': .3}) == [1, 3, 5] #Rounded up
+    assert promote(scores, {'promote': .01}) == [1] #At least one
+    assert promote([2.0, 2.0, 1.0], {'promote': .3}) == [0] #Ties go to the earlier candidate
+
+
+def test_screening_args_compress_the_learning_schedule():
+    args = {'steps': 1000, 'trials_per_policy': 10, 'agent_variables': {'vision': 1}}
+    low = screening_args(args, {'horizon': .1, 'trials': .2})
+    assert (low['steps'], low['trials_per_policy']) == (100, 2)
+    assert low['agent_variables'] == {'vision': 1, 'explore_decay': pytest.approx(.005)}
+    assert args['agent_variables'] == {'vision': 1} #The full fidelity arguments are left as they were
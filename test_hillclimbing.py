@@ -0,0 +1,43 @@
+import random
+import numpy as np
+import pytest
+from eval_cache import EvalCache
+from evaluator import Evaluator
+from hillclimbing import SA_hillclimb
+from scenarioV2A import run_run_model, run_run_model_jobs
+
+GAME = {'return_type': 'negative_externality', 'landscape_size': 1, 'alpha': .8, 'beta': .05}
+AGENT = {'vision': 1, 'explore_decay': .005,
+         'action_set': {'sheep_count_if_seen': {'min': 0, 'max': 5, 'grain': 1}}}
+PLANNER = {'fine_vector': {'type': 'vector', 'min': 0, 'max': 10, 'size': 6}}
+FFA = {'agent_count': 4, 'game_variables': GAME, 'agent_variables': AGENT, 'verbose_variables': [],
+       'data_to_output': {}, 'steps': 100, 'trials_per_policy': 3, 'social_planner_vars': PLANNER, 'seed': 3}
+
+
+def test_flat_duplicate_candidates_share_reused_trials():
+    '''In reuse mode the second copy of a candidate waits for the trials the first copy runs.'''
+    policy = {'fine_vector': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]}
+    cache = EvalCache(mode = 'reuse')
+    evaluator = Evaluator(fitness_fnc_args = FFA, trial_jobs_fnc = run_run_model_jobs, cache = cache)
+    assert evaluator.mode == 'flat'
+    scores = evaluator.evaluate([policy, dict(policy)])
+    assert scores[0] == scores[1]
+    assert scores[0]['trials'] == 3
+    assert cache.hits == 1 and cache.misses == 1 and not cache.pending
+
+
+@pytest.mark.parametrize('flat', [True, False])
+def test_warm_search_logs_one_horizon(flat, tmp_path, monkeypatch):
+    '''The first depth is scored on the full horizon and later ones on warm_vars' steps: the first winner is re-scored
+       on the warm horizon, so every logged fitness is a warm one.'''
+    monkeypatch.chdir(tmp_path)
+    random.seed(0)
+    np.random.seed(0)
+    ffa = dict(FFA, steps = 200)
+    result = SA_hillclimb(PLANNER, {'distribution': 'normal', 'explore_range': 1}, 2, 3, run_run_model, fitness_fnc_args = ffa,
+                          trial_jobs_fnc = run_run_model_jobs if flat else None, warm_vars = {'steps': 20},
+                          output_to_file = True, tag = 'warm')
+    logged = [float(line.rsplit(',', 2)[1]) for line in (tmp_path / 'warm_hc_log.txt').read_text().splitlines()[1:]]
+    cold = run_run_model(**result['action'], **ffa)['csw']
+    assert len(logged) == 3
+    assert all(abs(f) < abs(cold)/2 for f in logged)
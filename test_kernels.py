@@ -0,0 +1,33 @@
+import pytest
+from vector_model import compare_backends, compare_engines
+from test_model import CONFIGS, PLANNER
+
+VARIANTS = {'recency': {'recency_bias': .1},
+            'similarity': {'similarity': True},
+            'altruism': {'altruism': .3}}
+
+
+@pytest.mark.parametrize('config', sorted(CONFIGS))
+@pytest.mark.parametrize('variant', [None] + sorted(VARIANTS))
+def test_jit_matches_numpy(config, variant):
+  '''Both backends take the same draws from one seed, so they agree exactly.'''
+  game, agent, fines = CONFIGS[config]
+  if variant:
+    agent = dict(agent, **VARIANTS[variant])
+  diffs = compare_backends(4, dict(game), agent, 400, fine_vector = fines,
+                           social_planner_vars = PLANNER if fines else None, trials = 3, seed = 5)
+  assert diffs['max_welfare_diff'] == 0
+  assert diffs['max_attraction_diff'] == 0
+  assert diffs['same_last_choices']
+
+
+@pytest.mark.parametrize('config', sorted(CONFIGS))
+@pytest.mark.parametrize('backend', ['numpy', 'jit'])
+def test_vector_engine_matches_model(config, backend):
+  '''Both backends against the reference Model (so a bug the two backends share is caught too): mean welfare
+     and monitoring rate over 30 seeded replicates within 4 standard errors.'''
+  game, agent, fines = CONFIGS[config]
+  report = compare_engines(4, dict(game), agent, 600, fine_vector = fines, social_planner_vars = PLANNER if fines else None,
+                           trials = 30, seed = 0, backend = backend)
+  for name, stats in report.items():
+    assert abs(stats['z']) <= 4, (name, stats)
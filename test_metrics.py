@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from metrics import Decimated, RingBuffer, RunningMean, Welford
+
+
+def blocks(seed, shape = ()):
+  '''Values each repeated count periods in a row (as a fast forwarding model adds them), and the series they make.'''
+  rng = np.random.default_rng(seed)
+  added = [(rng.normal(size = shape), int(c)) for c in rng.integers(1, 8, size = 40)]
+  return added, np.concatenate([np.repeat(np.reshape(v, (1,) + shape), c, axis = 0) for v, c in added])
+
+
+def feed(accumulator, added):
+  for value, count in added:
+    accumulator.add(value if np.ndim(value) else float(value), count)
+  return accumulator
+
+
+@pytest.mark.parametrize('shape', [(), (5,)])
+def test_welford_matches_numpy_over_repeated_values(shape):
+  added, series = blocks(0, shape)
+  result = feed(Welford(), added).result()
+  assert result['count'] == len(series)
+  assert result['mean'] == pytest.approx(series.mean(axis = 0), rel = 1e-10)
+  assert result['var'] == pytest.approx(series.var(axis = 0, ddof = 1), rel = 1e-10)
+  assert feed(RunningMean(), added).mean == pytest.approx(series.mean(axis = 0), rel = 1e-10)
+
+
+@pytest.mark.parametrize('every', [1, 7, 100])
+def test_decimated_keeps_every_nth_period(every):
+  added, series = blocks(1)
+  result = feed(Decimated(every), added).result()
+  assert result['periods'] == list(range(0, len(series), every))
+  assert np.array_equal(result['values'], series[::every])
+
+
+def test_ring_buffer_keeps_the_last_values():
+  added, series = blocks(2)
+  assert np.array_equal(feed(RingBuffer(25), added).result()['window'], series[-25:])
@@ -0,0 +1,122 @@
+import pytest
+from model import Model, restore_model, run_model
+
+GAME = {'return_type': 'negative_externality', 'landscape_size': 1, 'alpha': .8, 'beta': .05}
+AGENT = {'vision': 1, 'explore_decay': .005,
+         'action_set': {'sheep_count_if_seen': {'min': 0, 'max': 5, 'grain': 1}}}
+SPATIAL_GAME = {'return_type': 'negative_externality', 'landscape_size': 10, 'alpha': .8, 'beta': .05}
+SPATIAL_AGENT = {'vision': 1, 'explore_decay': .005,
+                 'action_set': {'move_if_seen': {'min': 0, 'max': 1, 'grain': 1},
+                                'move_if_unseen': {'min': 0, 'max': 1, 'grain': 1},
+                                'sheep_count_if_seen': {'min': 0, 'max': 5, 'grain': 1},
+                                'sheep_count_if_unseen': {'min': 0, 'max': 5, 'grain': 1}}}
+PLANNER = {'fine_vector': {'type': 'vector', 'min': 0, 'max': 10, 'size': 6}}
+FINES = [0, 0, 0, 2, 4, 6]
+
+CONFIGS = {'plain': (GAME, AGENT, None),
+           'fines': (GAME, AGENT, FINES),
+           'transfers': (dict(GAME, transfers = .5), AGENT, FINES),
+           'spatial': (SPATIAL_GAME, SPATIAL_AGENT, FINES)}
+
+
+def model_args(config, seed):
+  game, agent, fines = CONFIGS[config]
+  return dict(agent_count = 4, game_variables = dict(game), agent_variables = agent, fine_vector = fines,
+              social_planner_vars = PLANNER if fines else None, rng = seed, store_attraction_snapshots = [0, 50])
+
+
+def make_model(config, seed):
+  return Model(**model_args(config, seed))
+
+
+#Seed 7, 300 periods of Model.step, recorded on the tree before step_plan (its one pass step, with this tree's Generator
+#draws): (avg_social_welfare, avg_lifetime_fines, summed monitoring_rate, agent positions, agent lifetime felicities)
+PRE_STEP_PLAN = {
+  'fines': (3919.4124999999976, -246.0, 0.0, [2, 1, 2, 2],
+            [3923.912499999997, 3926.912499999997, 3895.9124999999976, 3930.9124999999976]),
+  'plain': (1085.8218749999996, 0.0, 0.0, [2, 1, 2, 2],
+            [1062.5718749999996, 1084.5718749999996, 1074.5718749999999, 1121.5718749999999]),
+  'spatial': (4025.7593750000015, -105.0, 102.25, [4, 8, 2, 0],
+              [4010.0093750000015, 4003.0093750000015, 4030.0093750000015, 4060.0093750000015]),
+  'transfers': (4590.618749999994, -429.5, 0.0, [2, 1, 2, 2],
+                [4537.618749999995, 4598.618749999994, 4595.618749999993, 4630.618749999993])}
+
+
+@pytest.mark.parametrize('config', sorted(CONFIGS))
+def test_step_plan_matches_pre_step_plan_baseline(config):
+  model = make_model(config, 7)
+  for _ in range(300):
+    model.step()
+  welfare, fines, monitoring, positions, felicities = PRE_STEP_PLAN[config]
+  assert model.avg_social_welfare == pytest.approx(welfare, rel = 1e-12)
+  assert model.avg_lifetime_fines == pytest.approx(fines, rel = 1e-12)
+  assert sum(model.monitoring_rate) == pytest.approx(monitoring, rel = 1e-12)
+  assert [a.pos for a in model.agent_list] == positions
+  assert [a.lifetime_felicity for a in model.agent_list] == pytest.approx(felicities, rel = 1e-12)
+
+
+def test_same_seed_same_run():
+  first, second = make_model('spatial', 3), make_model('spatial', 3)
+  run_model(first, 500)
+  run_model(second, 500)
+  assert first.avg_social_welfare == second.avg_social_welfare
+
+
+@pytest.mark.parametrize('config', sorted(CONFIGS))
+def test_snapshot_restore_continues_identically(config, tmp_path):
+  original = make_model(config, 11)
+  for _ in range(30):
+    original.step()
+  original.save_snapshot(tmp_path / 'snap.npz')
+  restored = restore_model(tmp_path / 'snap.npz', **model_args(config, 0)) #Its own seed is replaced by the snapshot's
+  for _ in range(100): #Past the period 50 attraction snapshot
+    original.step()
+    restored.step()
+  assert restored.period == original.period
+  assert restored.avg_social_welfare == original.avg_social_welfare
+  assert restored.avg_lifetime_fines == original.avg_lifetime_fines
+  assert list(restored.avg_felicity) == list(original.avg_felicity)
+  assert list(restored.monitoring_rate) == list(original.monitoring_rate)
+  assert restored.attraction_snaps == original.attraction_snaps
+  for a, b in zip(restored.agent_list, original.agent_list):
+    assert (a.memory, a.choice_freq, a.pos, a.explore_rate) == (b.memory, b.choice_freq, b.pos, b.explore_rate)
+
+
+@pytest.mark.parametrize('recency_bias', [None, .3])
+def test_fast_forward_matches_stepping(recency_bias):
+  agent = dict(AGENT, explore_decay = .05)
+  if recency_bias:
+    agent['recency_bias'] = recency_bias
+  skipped, stepped = [Model(4, dict(GAME), agent, fine_vector = FINES, social_planner_vars = PLANNER, rng = 5)
+                      for _ in range(2)]
+  run_model(skipped, 1000, fast_forward = True)
+  run_model(stepped, 1000, fast_forward = False)
+  assert skipped.converged and not stepped.converged
+  assert skipped.period == stepped.period == 1000
+  assert skipped.avg_social_welfare == pytest.approx(stepped.avg_social_welfare, rel = 1e-12)
+  assert skipped.avg_lifetime_fines == stepped.avg_lifetime_fines
+  assert list(skipped.avg_felicity) == pytest.approx(list(stepped.avg_felicity), rel = 1e-12)
+  for a, b in zip(skipped.agent_list, stepped.agent_list):
+    assert a.choice_freq == b.choice_freq
+    assert a.memory['sheep_count_if_seen'] == pytest.approx(b.memory['sheep_count_if_seen'], rel = 1e-12)
+    assert a.lifetime_felicity == pytest.approx(b.lifetime_felicity, rel = 1e-12)
+
+
+def test_crowded_landscape_raises():
+  #Four agents, two cells: once both are taken, the next mover has nowhere to go.
+  model = Model(4, dict(SPATIAL_GAME, landscape_size = 2), SPATIAL_AGENT, rng = 0)
+  with pytest.raises(IndexError):
+    for _ in range(200):
+      model.step()
+
+
+def test_datafile_opened_by_run(tmp_path, monkeypatch):
+  '''A model that is never run holds no datafile handle; one that is run writes and closes its file.'''
+  monkeypatch.chdir(tmp_path)
+  game, agent, fines = CONFIGS['plain']
+  idle = Model(4, dict(game), agent, data_to_output = {'tag': 'idle', 'files': ['per_period']}, rng = 0)
+  assert idle.datafile is None and not list(tmp_path.iterdir())
+  model = Model(4, dict(game), agent, data_to_output = {'tag': 'run', 'files': ['per_period']}, rng = 0)
+  run_model(model, 5, fast_forward = False)
+  assert model.datafile is None
+  assert len((tmp_path / 'run_data.txt').read_text().splitlines()) == 1 + 6*4 #Header, 5 periods and the last call's rows
@@ -0,0 +1,50 @@
+from concurrent.futures import Future
+from math import sqrt
+import pytest
+from racing import _bounds, _still_racing, race
+
+
+class InlinePool():
+    '''Runs run_flat's jobs as they are submitted, in this process.'''
+    def submit(self, fnc, **kwargs):
+        future = Future()
+        future.set_result(fnc(**kwargs))
+        return future
+
+
+def noisy_trial(mean, trial):
+    return {'social_welfare': mean + (1 if trial % 2 else -1)}
+
+
+def trial_jobs(mean, trials_per_policy, first_trial):
+    return [(noisy_trial, {'mean': mean, 'trial': first_trial + r}) for r in range(trials_per_policy)], list
+
+
+def test_bounds_are_z_standard_errors():
+    means, half = _bounds([[1.0], [-1.0], [1.0], [-1.0]], 2.0)
+    assert means == [0.0]
+    assert half[0] == pytest.approx(2.0*sqrt(4/3)/2)
+    assert _bounds([[5.0]], 2.0)[1] == [float('inf')] #One trial can't be bounded yet
+
+
+def test_dropped_only_when_upper_bound_is_below_the_best_lower_bound():
+    #Means 0, 7 and 10, each +-2 after two trials of +-1:
+    values = {c: [[m - 1], [m + 1]] for c, m in enumerate([0.0, 7.0, 10.0])}
+    assert _still_racing([0, 1, 2], values, 2.0) == [1, 2] #0's upper 2 < 10's lower 8; 7's upper 9 isn't
+    assert _still_racing([0, 1, 2], values, 6.0) == [0, 1, 2] #Wider bounds: everyone overlaps
+    #Raced on several criteria, a candidate stays while it could win on any of them:
+    values = {0: [[0.0, 9.0], [0.0, 11.0]], 1: [[10.0, 0.0], [10.0, 2.0]]}
+    assert _still_racing([0, 1], values, 2.0) == [0, 1]
+
+
+def test_race_stops_trials_for_beaten_candidates():
+    candidates = [{'mean': 0.0}, {'mean': 10.0}, {'mean': 10.5}]
+    results = race(candidates, trial_jobs, {'trials_per_policy': 10}, pool = InlinePool())
+    assert [r['trials'] for r in results] == [2, 10, 10]
+    assert [r['csw'] for r in results] == [0.0, 10.0, 10.5]
+
+
+def test_keep_fraction_halves_the_field():
+    candidates = [{'mean': m} for m in (10.0, 10.1, 10.2, 10.3)]
+    results = race(candidates, trial_jobs, {'trials_per_policy': 6}, race_vars = {'keep_fraction': .5}, pool = InlinePool())
+    assert [r['trials'] for r in results] == [2, 2, 4, 6] #Two of four after the first round, then one of two
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from surrogate import GPSurrogate
+
+PARAMS = {'x': {'min': 0, 'max': 10}}
+
+
+def toy(x):
+    return -(x - 7.0)**2
+
+
+def fitted_surrogate(**kw):
+    surrogate = GPSurrogate(PARAMS, **kw)
+    for x in np.linspace(0, 10, 11):
+        surrogate.add({'x': x}, toy(x))
+    return surrogate
+
+
+def test_gp_interpolates_the_toy_function():
+    surrogate = fitted_surrogate()
+    grid = [{'x': x} for x in np.linspace(0.5, 9.5, 10)]
+    mu, sigma = surrogate.predict(grid)
+    error = np.abs(mu - [toy(p['x']) for p in grid])
+    assert error.max() < 2.0 #The toy function spans 49
+    assert (error < 2*sigma).all()
+
+
+def test_expected_improvement_matches_sampling_the_prediction():
+    surrogate = fitted_surrogate()
+    policies = [{'x': 6.5}, {'x': 2.5}]
+    mu, sigma = surrogate.predict(policies)
+    draws = np.random.default_rng(0).normal(mu, sigma, size = (200000, 2))
+    sampled = np.maximum(draws - surrogate.fitted['best'], 0).mean(0)
+    assert surrogate.expected_improvement(policies) == pytest.approx(sampled, rel = .02, abs = 1e-3)
+
+
+def test_select_picks_candidates_near_the_optimum_in_rolled_order():
+    surrogate = fitted_surrogate()
+    candidates = [{'x': x} for x in (1.2, 6.8, 9.8, 7.3, 3.1)]
+    assert surrogate.select(candidates, 2) == [{'x': 6.8}, {'x': 7.3}]
+    assert GPSurrogate(PARAMS).select(candidates, 2) == candidates[:2] #Too few points yet: taken as rolled
+
+
+def test_add_averages_and_update_replaces():
+    surrogate = GPSurrogate(PARAMS)
+    surrogate.add({'x': 1}, 10.0)
+    surrogate.add({'x': 1}, 20.0, count = 3)
+    assert surrogate.points[(.1,)] == [70.0, 4]
+    surrogate.update({'x': 1}, 5.0, count = 2)
+    assert surrogate.points[(.1,)] == [10.0, 2]
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from model import Model, run_model
+from vector_model import VectorModel
+from test_model import CONFIGS, PLANNER, SPATIAL_GAME, SPATIAL_AGENT
+
+SEEDS = 40
+STEPS = 600
+
+
+def outcomes(config, engine):
+  '''Per run welfare, final period felicity and fines over SEEDS runs of one engine.'''
+  game, agent, fines = CONFIGS[config]
+  planner = PLANNER if fines else None
+  if engine == 'vector':
+    model = VectorModel(4, dict(game), agent, fine_vector = fines, social_planner_vars = planner,
+                        trials = SEEDS, rng = 1000)
+    run_model(model, STEPS)
+    return {'welfare': model.avg_social_welfare/STEPS, 'felicity': np.asarray(model.avg_felicity.last),
+            'fines': model.avg_lifetime_fines/STEPS}
+  runs = {'welfare': [], 'felicity': [], 'fines': []}
+  for seed in range(SEEDS):
+    model = Model(4, dict(game), agent, fine_vector = fines, social_planner_vars = planner, rng = seed)
+    run_model(model, STEPS)
+    runs['welfare'].append(model.avg_social_welfare/STEPS)
+    runs['felicity'].append(model.avg_felicity.last)
+    runs['fines'].append(model.avg_lifetime_fines/STEPS)
+  return {k: np.array(v) for k, v in runs.items()}
+
+
+@pytest.mark.parametrize('config', ['plain', 'fines', 'spatial'])
+def test_vector_engine_matches_model_distribution(config):
+  '''The engines draw differently, so only their outcome distributions should agree: means within
+     4 standard errors of each other.'''
+  ref, vec = outcomes(config, 'model'), outcomes(config, 'vector')
+  for key in ref:
+    se = np.sqrt(ref[key].var(ddof = 1)/SEEDS + vec[key].var(ddof = 1)/SEEDS)
+    assert abs(ref[key].mean() - vec[key].mean()) <= 4*se + 1e-9, key
+
+
+def test_trials_match_separate_runs():
+  '''With one seed per trial, a batch of trials runs each trial as it would run on its own.'''
+  game, agent, fines = CONFIGS['spatial']
+  batch = VectorModel(4, dict(game), agent, fine_vector = fines, social_planner_vars = PLANNER,
+                      trials = 3, rng = [11, 12, 13])
+  run_model(batch, 300)
+  for t, seed in enumerate([11, 12, 13]):
+    single = VectorModel(4, dict(game), agent, fine_vector = fines, social_planner_vars = PLANNER, rng = [seed])
+    run_model(single, 300)
+    assert single.avg_social_welfare[0] == batch.avg_social_welfare[t]
+
+
+def test_crowded_landscape_raises():
+  '''As in Model, a mover with no unoccupied cell to go to is an IndexError.'''
+  model = VectorModel(4, dict(SPATIAL_GAME, landscape_size = 2), SPATIAL_AGENT, rng = 0)
+  with pytest.raises(IndexError):
+    for _ in range(200):
+      model.step()
@@ -0,0 +1,625 @@
+import numpy as np
+from agent import default_felicity_fnc
+import kernels
+from datafile import open_datafile, SPATIAL_COLUMNS, NON_SPATIAL_COLUMNS
+from metrics import build_metrics, History, RunningMean
+from random_streams import spawn_seeds
+
+
+class VectorModel():
+  """
+  A struct-of-arrays version of Model. Instead of one Shepherd object per agent,
+  all agent state (memory, choice_freq, explore_rate, period_strategy, payoffs...)
+  lives in NumPy arrays, and a whole period is advanced with batched array operations.
+
+  Arrays carry a leading simulation axis, so one VectorModel can advance several independent
+  simulations in lockstep: trials (replicates) of one policy, and/or several candidate policies.
+  Given P fine vectors and T trials, simulation s = p*T + t runs policy p, and behaves exactly
+  like a separate Model with fine_vector = fine_vector[p] and run = run + s.
+
+  The learning rules, payoffs, fines and outputs follow Model/Shepherd exactly, so
+  the two engines are interchangeable (including with run_model). Only the random
+  draws differ: both use a numpy Generator (rng), but consume it in a different order.
+  rng may instead be a list of one seed (or Generator) per trial: simulation p*T + t then takes all its draws
+  from trial t's Generator, so replicate t of every policy sees the same random numbers (common random numbers),
+  and a trial's stream doesn't depend on how many other trials or policies share the batch.
+
+  VARIABLE DETAILS:
+  - fine_vector ~ either one fine vector, or a (policies x actions) matrix of candidate fine vectors.
+  - backend ~ 'numpy' (default) advances the period with whole-array operations,
+              'jit' with the per agent loops in kernels.py (compiled if numba is installed).
+              Both give identical results from the same rng seed.
+  - self.trials ~ how many independent trials are simulated per policy.
+  - self.sims ~ policies * trials, the length of the leading axis.
+  - self.memory ~ dict of action name: (sims x agents x actions) array of attractions.
+  - self.choice_freq ~ dict of action name: (sims x agents x actions) array of (weighted) choice counts.
+  - self.period_strategy ~ dict of action name: (sims x agents) array of chosen action positions.
+  - self.period_choices ~ dict with 'moved' (spatial only) and 'sheep_count', each a (sims x agents) array.
+  - Per-simulation totals (avg_social_welfare, avg_lifetime_harvest, ...) are (sims,) arrays,
+    and avg_felicity/monitoring_rate are fed (sims,) arrays (kept as set by metrics and metric_default, see Model).
+  """
+
+  def __init__(self, agent_count, game_variables, agent_variables, data_to_output = {},
+                verbose_variables = [], fine_vector = None, run = 0, social_planner_vars = None,
+                store_attraction_snapshots = [], rng = None, trials = 1, backend = 'numpy', metrics = None,
+                metric_default = History):
+    if backend not in ('numpy', 'jit'):
+      raise ValueError(f"backend must be 'numpy' or 'jit', got {backend}")
+    self.backend = backend
+    self.game_variables = game_variables
+    if 'transfers' in self.game_variables:
+      self.transfers = self.game_variables['transfers']
+    else:
+      self.transfers = False
+    self.agent_variables = agent_variables
+    self.social_planner_vars = social_planner_vars
+    self.action_names = [i for i in self.agent_variables['action_set'].keys()]
+    self.spatial = 'move_if_seen' in self.action_names
+    self.verbose_variables = verbose_variables
+    self.fine_vector = fine_vector
+    self.has_fines = fine_vector is not None and len(fine_vector) > 0
+    self.period = 0
+    self.agent_count = agent_count
+    self.trials = trials
+    if self.has_fines and np.ndim(self.fine_vector) == 2:
+      self.policies = len(self.fine_vector)
+    else:
+      self.policies = 1
+    self.sims = self.policies * self.trials
+    self.sim_policy = np.repeat(np.arange(self.policies), self.trials) #Which policy each simulation runs
+    self.data_to_output = data_to_output
+    tracked = build_metrics(metrics, metric_default)
+    self.metric_names = list(metrics) if metrics else [] #Series reported per trial by trial_results
+    self.monitoring_rate = tracked['monitoring_rate']
+    self.avg_lifetime_harvest = np.zeros(self.sims)
+    self.avg_lifetime_fines = np.zeros(self.sims)
+    self.avg_lifetime_harvest_w_fines = np.zeros(self.sims)
+    self.avg_felicity = tracked['avg_felicity']
+    self.avg_social_welfare = np.zeros(self.sims)
+    self.run = run
+    self.converged = False
+    self.store_attraction_snapshots = store_attraction_snapshots
+    self.attraction_snaps = {}
+    if isinstance(rng, (list, tuple)):
+      if len(rng) != self.trials:
+        raise ValueError(f'Got {len(rng)} trial Generators for {self.trials} trials')
+      self.trial_rngs = [np.random.default_rng(r) for r in rng]
+      self.rng = None
+    else:
+      self.trial_rngs = None
+      self.rng = np.random.default_rng(rng)
+    self.sim_trial = np.tile(np.arange(self.trials), self.policies) #Which trial each simulation is
+    if 'tag' in self.data_to_output:
+      self.tag = self.data_to_output['tag']
+    else:
+      self.tag = ''
+    if 'alpha' in self.game_variables: #coeff of the linear part of externality
+      self.alpha = self.game_variables['alpha']
+    if 'beta' in self.game_variables: #coeff on the squ part of externality
+      self.beta = self.game_variables['beta']
+    #Establishing bounds for payoffs (as in Model):
+    max_sheep = self.agent_variables['action_set']['sheep_count_if_seen']['max']
+    min_sheep = self.agent_variables['action_set']['sheep_count_if_seen']['min']
+    if self.has_fines:
+      self.min_payoff = min_sheep -self._calc_externality((self.agent_count-1)*max_sheep) - self.social_planner_vars['fine_vector']['max']
+      self.max_payoff = max_sheep - self._calc_externality(max_sheep) - self.social_planner_vars['fine_vector']['min']
+      self.fine_table = np.asarray(self.fine_vector, dtype=float).reshape(self.policies, -1) #(policies x actions)
+    else:
+      self.min_payoff = min_sheep - self._calc_externality((self.agent_count-1)*max_sheep)
+      self.max_payoff = max_sheep - self._calc_externality(max_sheep)
+    self.landscape_size = self.game_variables['landscape_size']
+    self.density = self.landscape_size/self.agent_count
+    self._init_agent_arrays()
+    #One buffered datafile for the model's life, opened by the first update_datafile (so a model that is never
+    #run holds no file handle):
+    self.output_files = self.data_to_output.get('files', [])
+    self.writes_datafile = 'per_period' in self.output_files or 'final' in self.output_files
+    self.datafile = None
+
+  def _init_agent_arrays(self):
+    '''Sets up the (sims x agents x actions) arrays standing in for each Shepherd's attributes.'''
+    av = self.agent_variables
+    t, n = self.sims, self.agent_count
+    self.ids = np.arange(n)
+    self.sim_ids = np.arange(t)
+    self.rows = np.arange(t*n) #Agents of all simulations, flattened
+    self.init_explore_rate = 1
+    self.min_explore_rate = 0
+    self.explore_rate = np.full((t, n), float(self.init_explore_rate))
+    self.exploring = True #False once every agent's explore rate has hit its minimum
+    if 'explore_decay' in av:
+      self.explore_decay = av['explore_decay']
+    else:
+      self.explore_decay = 0.0005
+    if 'recency_bias' in av:
+      self.recency_bias = av['recency_bias']
+    else:
+      self.recency_bias = None
+    if 'similarity' in av and av['similarity']: #NOTE As in Shepherd, only applied for harvest actions.
+      self.similarity = True
+      self.sim_weight = np.exp(-av['action_set']['sheep_count_if_seen']['grain'])
+    else:
+      self.similarity = False
+    if 'altruism' in av:
+      if type(av['altruism']) is list:
+        self.altruism = np.asarray(av['altruism'][:n], dtype=float)
+      else:
+        self.altruism = np.full(n, float(av['altruism']))
+    else:
+      self.altruism = np.zeros(n)
+    self.altruistic = bool((self.altruism > 0).any())
+    if 'utility_fnc' in av:
+      self.felicity_fnc = av['utility_fnc'] #Must work elementwise on arrays (eg. x**.5)
+    else:
+      self.felicity_fnc = default_felicity_fnc
+    self.actions_avail = {}
+    self.memory = {}
+    self.choice_freq = {}
+    self.period_strategy = {}
+    for a_k, a_v in av['action_set'].items():
+      self.actions_avail[a_k] = np.arange(a_v['min'], a_v['max'] + a_v['grain'], a_v['grain']).tolist()
+      size = len(self.actions_avail[a_k])
+      self.memory[a_k] = np.full((t, n, size), float(self.max_payoff - self.min_payoff))
+      self.choice_freq[a_k] = np.zeros((t, n, size))
+      self.period_strategy[a_k] = np.zeros((t, n), dtype=int)
+    #Same range as Model's initial positions:
+    if self.trial_rngs is None:
+      self.pos = self.rng.integers(0, self.landscape_size + 2, size = (t, n))
+    else:
+      self.pos = np.stack([g.integers(0, self.landscape_size + 2, size = n) for g in self.trial_rngs])[self.sim_trial]
+    self.seen_before_move = np.zeros((t, n), dtype=bool)
+    self.seen = np.zeros((t, n), dtype=bool)
+    self.period_choices = {}
+    self.everyone = np.ones((t, n), dtype=bool)
+    self.period_payoff = np.zeros((t, n))
+    self.period_selfish_felicity = np.zeros((t, n))
+    self.period_felicity = np.zeros((t, n))
+    self.lifetime_felicity = np.zeros((t, n))
+
+  def _calc_externality(self, total_sheep):
+    '''Returns the payoff per sheep as a function of total sheep.'''
+    if self.game_variables['return_type'] == 'negative_externality':
+      avg_sheep = total_sheep/self.agent_count
+      return self.alpha * avg_sheep + self.beta * (avg_sheep ** 2)
+
+  def _random(self, shape):
+    '''U[0,1) draws of shape (sims, ...), from the shared Generator or, per trial, from each trial's.'''
+    if self.trial_rngs is None:
+      return self.rng.random(shape)
+    return np.stack([g.random(shape[1:]) for g in self.trial_rngs])[self.sim_trial]
+
+  def _period_prob_explore(self):
+    '''Updates every agent's explore rate for this period (see Shepherd._period_prob_explore).'''
+    if self.exploring:
+      rate = self.min_explore_rate + (self.init_explore_rate-self.min_explore_rate)*np.exp(-self.explore_decay*self.period)
+      rate = round(max(rate, self.min_explore_rate), 3)
+      self.explore_rate = np.where(self.explore_rate > self.min_explore_rate, rate, self.explore_rate)
+      self.exploring = bool((self.explore_rate > self.min_explore_rate).any())
+    return self.explore_rate
+
+  def decide_period_strategy(self):
+    '''Chooses every agent's strategy for this period.'''
+    self._period_prob_explore()
+    if self.exploring:
+      explore = self._random(self.explore_rate.shape) < self.explore_rate
+    else:
+      explore = self.everyone
+    for act in self.action_names:
+      mem = self.memory[act]
+      if self.backend == 'jit':
+        tie_keys = self._random(mem.shape)
+        explore_draws = self._random(explore.shape) if self.exploring else tie_keys[:,:,0]
+        strategy = np.empty(explore.shape, dtype=int)
+        kernels.choose_actions(mem, tie_keys, self.exploring, explore, explore_draws, strategy)
+        self.period_strategy[act] = strategy
+        continue
+      #Exploit ~ the highest attraction, with ties broken uniformly at random:
+      tie_keys = self._random(mem.shape)
+      tie_keys[mem != mem.max(axis=2, keepdims=True)] = -1
+      self.period_strategy[act] = tie_keys.argmax(axis=2)
+      if self.exploring:
+        #Explore ~ weighted by squared attraction (as random.choices does with cumulative weights):
+        cum_weights = np.cumsum(mem**2, axis=2)
+        target = self._random(explore.shape) * cum_weights[:,:,-1]
+        explored = (cum_weights > target[:,:,None]).argmax(axis=2)
+        self.period_strategy[act] = np.where(explore, explored, self.period_strategy[act])
+
+  def _is_seen(self, aid):
+    '''Determines, in each simulation, if agent aid[sim] is visible to any other agent at current positions.'''
+    dist = np.abs(self.pos - self.pos[self.sim_ids, aid][:,None])
+    dist[self.sim_ids, aid] = self.agent_variables['vision'] + 1
+    return (dist <= self.agent_variables['vision']).any(axis=1)
+
+  def apply_move_strategy(self):
+    '''Agents move one at a time (in a random order per simulation), as moves change who sees whom.
+       1 means move to random unoccupied, 0 means stay. Each agent has one uniform draw for where it
+       would move, taken whether or not it moves (so per trial streams stay in step across policies).'''
+    moved = np.zeros((self.sims, self.agent_count), dtype=bool)
+    if self.trial_rngs is None:
+      order = self.rng.permuted(np.tile(self.ids, (self.sims, 1)), axis=1)
+    else:
+      order = np.stack([g.permutation(self.agent_count) for g in self.trial_rngs])[self.sim_trial]
+    cell_draws = self._random((self.sims, self.agent_count))
+    for k in range(self.agent_count):
+      aid = order[:,k]
+      seen_before = self._is_seen(aid)
+      self.seen_before_move[self.sim_ids, aid] = seen_before
+      wants_move = np.where(seen_before, self.period_strategy['move_if_seen'][self.sim_ids, aid] == 1,
+                            self.period_strategy['move_if_unseen'][self.sim_ids, aid] == 1)
+      if wants_move.any():
+        movers = self.sim_ids[wants_move]
+        self.pos[movers, aid[movers]] = self._free_cell(movers, cell_draws[movers, k])
+        moved[movers, aid[movers]] = True
+    self.period_choices['moved'] = moved
+
+  def _free_cell(self, movers, u):
+    '''Maps u ~ U[0,1) to a uniformly random unoccupied cell in each of the simulations movers (as FreeCells.sample,
+       IndexError if there is none), from the sorted occupied cells: the r-th free cell is r plus the number of
+       occupied cells with at most r free cells below them.'''
+    occupied = np.sort(self.pos[movers], axis=1)
+    #Each occupied cell counted once, and only cells of the landscape:
+    counted = occupied < self.landscape_size
+    counted[:,1:] &= occupied[:,1:] != occupied[:,:-1]
+    free_count = self.landscape_size - counted.sum(axis=1)
+    if (free_count == 0).any():
+      raise IndexError('No unoccupied cell to move to (as in Model, via FreeCells.sample)')
+    r = (u*free_count).astype(int)
+    free_below = occupied - (np.cumsum(counted, axis=1) - 1)
+    return r + (counted & (free_below <= r[:,None])).sum(axis=1)
+
+  def update_seen(self):
+    '''Determines who is visible to other agents after moving: an agent is seen when more than one agent
+       (itself included) stands within vision of it, counted from the sorted positions as PositionIndex does.'''
+    vision = self.agent_variables['vision']
+    #Each simulation's positions shifted into its own range, so one sorted array serves them all:
+    stride = self.landscape_size + 2 + 2*int(np.ceil(vision))
+    flat = self.pos + (self.sim_ids*stride)[:,None]
+    ordered = np.sort(flat, axis=None)
+    within = np.searchsorted(ordered, flat + vision, side='right') - np.searchsorted(ordered, flat - vision, side='left')
+    self.seen = within > 1
+
+  def apply_sheep_strategy(self):
+    '''Takes each agent's strategy for choosing grazing level and acts on it.'''
+    if self.spatial:
+      self.period_choices['sheep_count'] = np.where(self.seen, self.period_strategy['sheep_count_if_seen'],
+                                                    self.period_strategy['sheep_count_if_unseen'])
+    else:
+      self.period_choices['sheep_count'] = self.period_strategy['sheep_count_if_seen']
+
+  def calculate_harvests(self):
+    '''Returns period payoff for each agent as a fnc of own and total sheep count.'''
+    sheep = self.period_choices['sheep_count']
+    if self.backend == 'jit':
+      #Each agent's fine is worked out alongside its payoff, for apply_fines:
+      self.period_payoff = np.empty(sheep.shape)
+      self.period_fines = np.empty(sheep.shape)
+      fine_table = self.fine_table if self.has_fines else np.zeros((1, 1))
+      kernels.agent_payoffs(sheep, float(self.alpha), float(self.beta), self.has_fines, fine_table, self.sim_policy,
+                            self.spatial, self.seen, self.period_payoff, self.period_fines)
+    else:
+      externality = self._calc_externality(sheep.sum(axis=1))
+      self.period_payoff = sheep - externality[:,None]
+    self.avg_period_harvest = self.period_payoff.sum(axis=1) / self.agent_count
+    self.avg_lifetime_harvest += self.avg_period_harvest
+
+  def apply_fines(self):
+    '''Determines fines (if any) applied to each agent as a function of sheepcount choice.'''
+    self.avg_period_fines = np.zeros(self.sims)
+    if self.has_fines:
+      if self.backend == 'jit':
+        fines = self.period_fines
+      else:
+        #Gathering each agent's fine from its simulation's row of the (policies x actions) table:
+        fines = self.fine_table[self.sim_policy[:,None], self.period_choices['sheep_count']]
+        if self.spatial:
+          fines = np.where(self.seen, fines, 0)
+      self.period_payoff = self.period_payoff - fines
+      self.avg_period_fines = -fines.sum(axis=1)
+      if self.transfers:
+        self.period_payoff -= self.transfers*self.avg_period_fines[:,None] #This is - because avg fines are negative.
+    self.avg_lifetime_fines += (self.avg_period_fines/self.agent_count)
+
+  def calc_felicity(self):
+    '''Calculates felicity from own consumption and, through altruism, from everyone's.'''
+    self.period_selfish_felicity = self.felicity_fnc(self.period_payoff - self.min_payoff)
+    if self.altruistic and self.backend == 'jit':
+      self.period_felicity = np.empty(self.period_selfish_felicity.shape)
+      kernels.mix_felicity(self.period_selfish_felicity, self.period_selfish_felicity.sum(axis=1),
+                           self.altruism, self.period_felicity)
+    elif self.altruistic:
+      total_fel = self.period_selfish_felicity.sum(axis=1, keepdims=True)
+      self.period_felicity = np.where(self.altruism > 0,
+                                      (self.altruism * total_fel) + ((1-self.altruism) * self.period_selfish_felicity),
+                                      self.period_selfish_felicity)
+    else:
+      self.period_felicity = self.period_selfish_felicity
+    self.lifetime_felicity += self.period_felicity
+
+  def _learn(self, act, rows, r):
+    '''Updates the attraction of the action dimension act for the (flattened sim x agent) rows given.'''
+    if len(rows) == 0:
+      return
+    size = self.memory[act].shape[2]
+    mem = self.memory[act].reshape(-1, size)
+    freq = self.choice_freq[act].reshape(-1, size)
+    chosen = self.period_strategy[act].reshape(-1)[rows]
+    r = r.reshape(-1)[rows]
+    existing_score = mem[rows, chosen]
+    freq[rows, chosen] += 1
+    f = freq[rows, chosen]
+    if self.recency_bias:
+      mem[rows, chosen] = (1-self.recency_bias)*existing_score + (self.recency_bias)*r
+    else:
+      mem[rows, chosen] = ((f-1)/f)*existing_score + (1/f)*r
+    if self.similarity and act.startswith('sheep_count'):
+      for nbr in (chosen - 1, chosen + 1):
+        ok = (nbr >= 0) & (nbr < size)
+        n_rows, n_pos = rows[ok], nbr[ok]
+        freq[n_rows, n_pos] += self.sim_weight
+        f_n = freq[n_rows, n_pos]
+        mem[n_rows, n_pos] = ((f_n - self.sim_weight)/f_n)*existing_score[ok] + (self.sim_weight/f_n)*r[ok]
+
+  def _learn_jit(self, act, update, r):
+    '''As _learn, through kernels.learn, for the agents where the (sims x agents) mask update is True.'''
+    kernels.learn(self.memory[act], self.choice_freq[act], self.period_strategy[act], update,
+                  np.ascontiguousarray(r, dtype=float), float(self.recency_bias or 0),
+                  self.similarity and act.startswith('sheep_count'), float(self.sim_weight if self.similarity else 0))
+
+  def update_memory(self):
+    '''Updates action weights based on performance this round.'''
+    r = self.period_felicity
+    if self.backend == 'jit':
+      if self.spatial:
+        self._learn_jit('move_if_unseen', ~self.seen_before_move, r)
+        self._learn_jit('move_if_seen', self.seen_before_move, r)
+        self._learn_jit('sheep_count_if_unseen', ~self.seen, r)
+        self._learn_jit('sheep_count_if_seen', self.seen, r)
+      else:
+        self._learn_jit('sheep_count_if_seen', self.everyone, r)
+    elif self.spatial:
+      seen_before_move = self.seen_before_move.reshape(-1)
+      seen = self.seen.reshape(-1)
+      self._learn('move_if_unseen', self.rows[~seen_before_move], r)
+      self._learn('move_if_seen', self.rows[seen_before_move], r)
+      self._learn('sheep_count_if_unseen', self.rows[~seen], r)
+      self._learn('sheep_count_if_seen', self.rows[seen], r)
+    else:
+      self._learn('sheep_count_if_seen', self.rows, r)
+
+  def calc_social_welfare(self):
+    '''Takes each agent felicity (including altruism payoffs) and adds them up.'''
+    self.period_total_felicity = self.period_felicity.sum(axis=1)
+    return self.period_total_felicity
+
+  def take_stock(self):
+    '''Updates/calculates a few values for storage/outputting.'''
+    if self.spatial:
+      p_seen = self.seen.mean(axis=1)
+    else:
+      p_seen = np.zeros(self.sims)
+    avg_felicity = self.period_total_felicity / self.agent_count
+    self.avg_felicity.add(avg_felicity)
+    self.avg_social_welfare += avg_felicity
+    self.monitoring_rate.add(p_seen)
+
+  def collect_agent_attractions(self):
+    '''Collect average agent attraction per snapshot (see Shepherd.store_attraction_snapshot).
+       Each entry holds a (sims,) array of the average over that simulation's agents.'''
+    p_explore = self._period_prob_explore()[:,:,None]
+    mem = self.memory['sheep_count_if_seen']
+    weights = mem**2
+    weight_sum = weights.sum(axis=2, keepdims=True)
+    safe_sum = np.where(weight_sum == 0, 1, weight_sum)
+    prob_choose = np.where(weight_sum == 0, 1/mem.shape[2], weights*p_explore/safe_sum)
+    if self.period > 0:
+      is_max = mem == mem.max(axis=2, keepdims=True)
+      prob_choose = prob_choose + is_max*(1-p_explore)/is_max.sum(axis=2, keepdims=True)
+    avg_prob = prob_choose.mean(axis=1)
+    self.attraction_snaps[self.period] = {}
+    for aa_pos, aa in enumerate(self.actions_avail['sheep_count_if_seen']):
+      self.attraction_snaps[self.period][aa] = avg_prob[:,aa_pos]
+
+  def is_absorbing(self):
+    '''True once every simulation is locked in (see Model.is_absorbing and Shepherd.is_locked_in).'''
+    if self.spatial or self.similarity or self.exploring or self.min_explore_rate > 0:
+      return False
+    if 'per_period' in self.data_to_output.get('files', []):
+      return False
+    mem = self.memory['sheep_count_if_seen']
+    chosen = self.period_strategy['sheep_count_if_seen'][:,:,None]
+    chosen_score = np.take_along_axis(mem, chosen, axis=2)[:,:,0]
+    others = np.where(np.arange(mem.shape[2]) == chosen, -np.inf, mem).max(axis=2)
+    return bool((np.minimum(chosen_score, self.period_felicity) > others).all())
+
+  def fast_forward(self, periods):
+    '''Closes form up to periods repeats of the current (absorbing) period instead of stepping through them.
+       Stops short of any requested attraction snapshot so step() can still take it. Returns periods skipped.'''
+    upcoming_snaps = [p for p in self.store_attraction_snapshots if p >= self.period]
+    if upcoming_snaps:
+      periods = min(periods, min(upcoming_snaps) - self.period)
+    if periods <= 0:
+      return 0
+    mem = self.memory['sheep_count_if_seen']
+    freq = self.choice_freq['sheep_count_if_seen']
+    chosen = self.period_strategy['sheep_count_if_seen'][:,:,None]
+    chosen_score = np.take_along_axis(mem, chosen, axis=2)[:,:,0]
+    chosen_freq = np.take_along_axis(freq, chosen, axis=2)[:,:,0]
+    r = self.period_felicity
+    if self.recency_bias:
+      new_score = r + ((1-self.recency_bias)**periods)*(chosen_score - r)
+    else:
+      new_score = (chosen_freq*chosen_score + periods*r)/(chosen_freq + periods)
+    np.put_along_axis(mem, chosen, new_score[:,:,None], axis=2)
+    np.put_along_axis(freq, chosen, (chosen_freq + periods)[:,:,None], axis=2)
+    self.lifetime_felicity += periods*r
+    avg_felicity = self.avg_felicity.last
+    self.avg_lifetime_harvest += periods*self.avg_period_harvest
+    self.avg_lifetime_fines += periods*(self.avg_period_fines/self.agent_count)
+    self.avg_social_welfare += periods*avg_felicity
+    self.avg_felicity.add(avg_felicity, periods)
+    self.monitoring_rate.add(self.monitoring_rate.last, periods)
+    self.period += periods
+    self.converged = True
+    return periods
+
+  def trial_results(self, return_indv_welfare = False, return_last_act = False):
+    '''Returns one output dict per simulation (policy major), in the format of scenarioV2A.model_helper_fnc.'''
+    results = []
+    metric_results = {name: getattr(self, name).result() for name in self.metric_names}
+    for t in range(self.sims):
+      output = {}
+      if return_indv_welfare:
+        output['indv_welfare'] = self.lifetime_felicity[t].tolist()
+      output['social_welfare'] = float(self.avg_social_welfare[t])
+      if return_last_act:
+        output['last_act'] = {var_name: var_val[t].tolist() for var_name, var_val in self.period_choices.items()}
+      if self.metric_names:
+        output['metrics'] = {name: {k: _sim_slice(v, t, self.sims) for k, v in res.items()} for name, res in metric_results.items()}
+      results.append(output)
+    return results
+
+  def print_output(self):
+    '''Allows for printing of output for debugging/analysis purposes.'''
+    if self.verbose_variables:
+      print()
+    if 'period' in self.verbose_variables:
+      print(f'---Period {self.period}---')
+    for t in range(self.sims):
+      if 'strategies' in self.verbose_variables or 'LearningAttractions' in self.verbose_variables:
+        print(f'\nRun {self.run + t} period {self.period} strategies')
+        for aid in self.ids:
+          print(f'Agent {aid} had strategies...')
+          for name, strat in self.period_strategy.items():
+            print(f'    {name}: {strat[t, aid]}')
+      if 'actions' in self.verbose_variables:
+        print(f'\nRun {self.run + t} period {self.period} choices')
+        for aid in self.ids:
+          print(f'Agent {aid} choose...')
+          for name, choice in self.period_choices.items():
+            print(f'    {name}: {choice[t, aid]}')
+      if 'payoff' in self.verbose_variables:
+        print(f'\nRun {self.run + t} period {self.period} payoffs')
+        for aid in self.ids:
+          print(f'Agent {aid} got payoff {self.period_payoff[t, aid]}')
+
+  def update_datafile(self, last = False):
+    '''Adds this period's rows to the datafile requested (same layout as Model.update_datafile),
+       and closes it once the run is over (last). Simulation s is written with run index run + s.'''
+    if not self.writes_datafile:
+      return
+    if self.datafile is None:
+      self.datafile = open_datafile(self.tag, SPATIAL_COLUMNS if self.spatial else NON_SPATIAL_COLUMNS,
+                                    fmt = self.data_to_output.get('format', 'csv'),
+                                    buffer_rows = self.data_to_output.get('buffer_rows', 65536),
+                                    append = self.run != 0, run = self.run)
+    if 'per_period' in self.output_files or (last and 'final' in self.output_files):
+      rows = self.sims * self.agent_count
+      shared = {'run': np.repeat(self.run + self.sim_ids, self.agent_count), 'period': self.period,
+                'agent_count': self.agent_count, 'landscape_size': self.landscape_size,
+                'agent_id': np.tile(self.ids, self.sims), 'payoff': self.period_payoff.reshape(-1),
+                'avg_period_felicity': np.repeat(self.avg_felicity.last, self.agent_count),
+                'avg_social_welfare': np.repeat(self.avg_social_welfare, self.agent_count)}
+      for act in self.action_names:
+        shared[act] = self.period_strategy[act].reshape(-1)
+        shared[f'best_{act}'] = self.memory[act].argmax(axis=2).reshape(-1)
+      if self.spatial:
+        shared.update({'pop_density': self.density, 'position': self.pos.reshape(-1), 'monitored': self.seen.reshape(-1),
+                       'monitoring_rate': np.repeat(self.monitoring_rate.last, self.agent_count)})
+      self.datafile.add_rows(rows, **shared)
+    if last:
+      self.datafile.close()
+      self.datafile = None
+      self.writes_datafile = False #The run is over
+
+  def step(self):
+    #Step0: Store some top of the round info
+    if self.period in self.store_attraction_snapshots:
+      self.collect_agent_attractions()
+    #Step1: Decide strategies for the period
+    self.decide_period_strategy()
+    if self.spatial:
+      #Step2: Apply movement part of strategies
+      self.apply_move_strategy()
+      #Step3: Update who sees who
+      self.update_seen()
+    #Step4: Apply grazing part of strategy
+    self.apply_sheep_strategy()
+    self.calculate_harvests()
+    #Step5: Fine players
+    self.apply_fines()
+    #Step6: Agents evaluate the sucess of their strategy
+    self.calc_felicity()
+    self.update_memory()
+    self.calc_social_welfare()
+    #Step7: Output and prepping for next round of play
+    self.take_stock()
+    self.print_output()
+    if 'per_period' in self.output_files:
+      self.update_datafile()
+    self.period += 1
+
+
+def _sim_slice(value, t, sims):
+  '''Simulation t's part of an accumulator result (simulations are the last axis of the arrays they hold).
+     Lists of (sims,) arrays (eg. History's values) are stacked first; plain lists (eg. Decimated's periods)
+     and scalars are shared by every simulation.'''
+  if isinstance(value, list) and value and isinstance(value[0], np.ndarray):
+    value = np.stack(value)
+  if isinstance(value, np.ndarray) and value.size > 0:
+    if value.shape[-1] != sims:
+      raise ValueError(f'Accumulator result of shape {value.shape} has no per simulation axis of length {sims}')
+    value = value[..., t]
+    return value.item() if value.ndim == 0 else value
+  return value
+
+
+def compare_backends(agent_count, game_variables, agent_variables, steps, fine_vector = None,
+                     social_planner_vars = None, trials = 1, seed = 0):
+  '''Runs the same configuration on the 'numpy' and 'jit' backends from one shared seed and
+     reports how far apart they end up (both should be 0 when the kernels match the reference).
+     The vector engine itself is checked against Model by compare_engines.'''
+  from model import run_model
+  finals = {}
+  for backend in ('numpy', 'jit'):
+    model = VectorModel(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
+                        data_to_output = {'files': []}, fine_vector = fine_vector,
+                        social_planner_vars = social_planner_vars, rng = np.random.default_rng(seed),
+                        trials = trials, backend = backend)
+    run_model(model, steps)
+    finals[backend] = model
+  ref, jit = finals['numpy'], finals['jit']
+  return {'kernels_compiled': kernels.HAVE_NUMBA,
+          'max_welfare_diff': float(np.abs(ref.avg_social_welfare - jit.avg_social_welfare).max()),
+          'max_attraction_diff': max(float(np.abs(ref.memory[act] - jit.memory[act]).max()) for act in ref.action_names),
+          'same_last_choices': all(np.array_equal(ref.period_strategy[act], jit.period_strategy[act]) for act in ref.action_names)}
+
+
+def compare_engines(agent_count, game_variables, agent_variables, steps, fine_vector = None,
+                    social_planner_vars = None, trials = 30, seed = 0, backend = 'numpy'):
+  '''Runs trials seeded replicates of one configuration with Model (the reference) and with VectorModel on backend,
+     and compares their mean welfare per period and mean monitoring rate. The engines draw their random numbers
+     in different orders, so only the distributions should agree: each z is the gap between the means in
+     standard errors (|z| of a few at most when the engines match).'''
+  from model import Model, run_model
+  seeds = spawn_seeds(seed, 2*trials)
+  runs = {'welfare': [], 'monitoring': []}
+  for rng in seeds[:trials]:
+    model = Model(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
+                  fine_vector = fine_vector, social_planner_vars = social_planner_vars, rng = rng,
+                  metrics = {'avg_felicity': None, 'monitoring_rate': RunningMean})
+    run_model(model, steps)
+    runs['welfare'].append(model.avg_social_welfare/steps)
+    runs['monitoring'].append(model.monitoring_rate.mean)
+  vector = VectorModel(agent_count = agent_count, game_variables = game_variables, agent_variables = agent_variables,
+                       fine_vector = fine_vector, social_planner_vars = social_planner_vars, rng = seeds[trials:],
+                       trials = trials, backend = backend, metrics = {'avg_felicity': None, 'monitoring_rate': RunningMean})
+  run_model(vector, steps)
+  vec = {'welfare': vector.avg_social_welfare/steps, 'monitoring': np.asarray(vector.monitoring_rate.mean)}
+  report = {}
+  for name, ref in runs.items():
+    ref = np.array(ref)
+    se = np.sqrt(ref.var(ddof = 1)/trials + vec[name].var(ddof = 1)/trials)
+    gap = ref.mean() - vec[name].mean()
+    report[name] = {'model': float(ref.mean()), 'vector': float(vec[name].mean()),
+                    'z': float(gap/se) if se > 0 else (0.0 if gap == 0 else float('inf'))}
+  return report